@@ -0,0 +1,19 @@
+"""
+URL configuration for requests served over ASGI.
+
+The same routes as urls.py, except that GET requests to the read-heavy
+endpoints below go to the native async views in
+tripexpensetrackerapi/views/async_views.py. The ASGI routing middleware
+selects this module for ASGI requests.
+"""
+from django.urls import path, re_path
+from tripexpensetracker.urls import urlpatterns as sync_urlpatterns
+from tripexpensetrackerapi.views import async_views
+
+urlpatterns = [
+    path('trips', async_views.trip_list),
+    re_path(r'^trips/(?P<pk>[^/.]+)$', async_views.trip_detail),
+    path('expenses', async_views.expense_list),
+    path('categories', async_views.category_list),
+    path('checkuser', async_views.check_user),
+] + sync_urlpatterns
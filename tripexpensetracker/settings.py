@@ -10,6 +10,7 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/4.2/ref/settings/
 """
 
+import os
 from pathlib import Path
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
@@ -48,6 +49,13 @@ CORS_ORIGIN_WHITELIST = (
 )
 
 MIDDLEWARE = [
+    # First, so its timings cover all of the request
+    'tripexpensetrackerapi.middleware.metrics_middleware',
+    # Inside the metrics middleware, so profiles can be tagged with the request's query count
+    'tripexpensetrackerapi.middleware.profiling_middleware',
+    'tripexpensetrackerapi.middleware.asgi_urlconf_middleware',
+    'tripexpensetrackerapi.middleware.replica_routing_middleware',
+    'tripexpensetrackerapi.middleware.catalog_middleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'corsheaders.middleware.CorsMiddleware',
@@ -60,6 +68,10 @@ MIDDLEWARE = [
 
 ROOT_URLCONF = 'tripexpensetracker.urls'
 
+# Requests served over ASGI (asgi.py) use this URL configuration instead,
+# which serves the read-heavy endpoints with native async views
+ASGI_ROOT_URLCONF = 'tripexpensetracker.asgi_urls'
+
 TEMPLATES = [
     {
         'BACKEND': 'django.template.backends.django.DjangoTemplates',
@@ -82,13 +94,64 @@ WSGI_APPLICATION = 'tripexpensetracker.wsgi.application'
 # Database
 # https://docs.djangoproject.com/en/4.2/ref/settings/#databases
 
+# Connections persist between requests, and wait up to `timeout` seconds for
+# a lock instead of failing with "database is locked". Every new SQLite
+# connection also gets SQLITE_PRAGMAS (see tripexpensetrackerapi/signals.py).
+
 DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.sqlite3',
         'NAME': BASE_DIR / 'db.sqlite3',
+        'CONN_MAX_AGE': 600,
+        'CONN_HEALTH_CHECKS': True,
+        'OPTIONS': {
+            'timeout': 20,
+        },
     }
 }
 
+SQLITE_PRAGMAS = {
+    'journal_mode': 'WAL',
+    'synchronous': 'NORMAL',
+}
+
+# Read replicas: DATABASE_REPLICAS is a list of SQLite files, separated by
+# os.pathsep, that are kept in step with the primary outside Django. GET and
+# HEAD requests read from them (tripexpensetrackerapi/routers.py).
+
+DATABASE_READ_REPLICAS = []
+
+for index, replica_path in enumerate(filter(None, os.environ.get('DATABASE_REPLICAS', '').split(os.pathsep))):
+    DATABASES[f'replica{index + 1}'] = {
+        **DATABASES['default'],
+        'NAME': replica_path,
+        'TEST': {'MIRROR': 'default'},
+    }
+    DATABASE_READ_REPLICAS.append(f'replica{index + 1}')
+
+DATABASE_ROUTERS = ['tripexpensetrackerapi.routers.ReadReplicaRouter']
+
+
+# Cache
+# https://docs.djangoproject.com/en/4.2/topics/cache/
+# The category catalog and the trip response cache keep their version stamps
+# here; use a backend shared by all worker processes (file-based, memcached,
+# ...) when running several. Setting CACHE_DIR switches to a file-based cache.
+
+if os.environ.get('CACHE_DIR'):
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+            'LOCATION': os.environ['CACHE_DIR'],
+        }
+    }
+else:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        }
+    }
+
 
 # Password validation
 # https://docs.djangoproject.com/en/4.2/ref/settings/#auth-password-validators
@@ -130,3 +193,93 @@ STATIC_URL = 'static/'
 # https://docs.djangoproject.com/en/4.2/ref/settings/#default-auto-field
 
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
+
+
+# Keyset pagination for list endpoints (tripexpensetrackerapi/pagination.py).
+# Clients may ask for a smaller or larger page with ?page_size=, up to the cap.
+
+PAGINATION_PAGE_SIZE = 50
+
+PAGINATION_MAX_PAGE_SIZE = 200
+
+
+# In-process user cache used by check_user and ownership lookups
+# (tripexpensetrackerapi/identity.py). TTL is in seconds.
+
+IDENTITY_CACHE_MAX_SIZE = 10000
+
+IDENTITY_CACHE_TTL = 300
+
+# Per-user prefix indexes behind GET /expenses/suggest
+# (tripexpensetrackerapi/suggestions.py): the expense names held across all
+# users before the least recently used index is evicted, and the seconds an
+# index is kept before it is rebuilt to pick up bulk writes and deletes.
+
+SUGGEST_INDEX_MAX_NAMES = 200000
+
+SUGGEST_INDEX_TTL = 300
+
+# Per-user expense columns behind GET /users/{id}/analytics
+# (tripexpensetrackerapi/analytics.py): the expenses held across all users
+# before the least recently used user's are evicted. Writes invalidate them,
+# so they need no expiry.
+
+ANALYTICS_CACHE_MAX_ROWS = 2000000
+
+# Cache of serialized trip detail and trip list responses
+# (tripexpensetrackerapi/response_cache.py). Timeout is in seconds.
+
+RESPONSE_CACHE_ALIAS = 'default'
+
+RESPONSE_CACHE_TIMEOUT = 300
+
+
+# Expenses deleted per transaction by background trip deletion
+# (DELETE /trips/<pk>?background=true, see tripexpensetrackerapi/deletes.py)
+
+TRIP_PURGE_CHUNK_SIZE = 1000
+
+
+# List endpoints build their JSON from values() rows instead of the DRF
+# serializers (tripexpensetrackerapi/fast_serializers.py); the output is the same
+
+FAST_LIST_SERIALIZERS = True
+
+
+# Currency that trip, user and summary totals are converted to (tripexpensetrackerapi/fx.py),
+# and the default currency of new expenses
+
+HOME_CURRENCY = 'USD'
+
+
+# Request metrics (tripexpensetrackerapi/metrics.py): a Server-Timing header
+# on every response, and per-view histograms served at /metrics to the
+# scrapers at METRICS_ALLOWED_IPS
+
+SERVER_TIMING_HEADER = True
+METRICS_ALLOWED_IPS = os.environ.get('METRICS_ALLOWED_IPS', '127.0.0.1,::1').split(',')
+
+REST_FRAMEWORK = {
+    'DEFAULT_RENDERER_CLASSES': [
+        'tripexpensetrackerapi.metrics.TimedJSONRenderer',
+        'rest_framework.renderers.BrowsableAPIRenderer',
+    ],
+}
+
+# Opt-in sampled SQL fingerprint totals (tripexpensetrackerapi/slow_queries.py);
+# sampled queries slower than the threshold are also logged
+
+SLOW_QUERY_LOG = os.environ.get('SLOW_QUERY_LOG') == '1'
+SLOW_QUERY_SAMPLE_RATE = 0.1
+SLOW_QUERY_THRESHOLD_MS = 100
+SLOW_QUERY_TOP = 20
+
+
+# Opt-in request profiling (tripexpensetrackerapi/profiling.py): requests with
+# a signed X-Profile header (manage.py profile_token), plus a random sample
+# of all requests, are run under cProfile and dumped to PROFILE_DIR
+
+PROFILE_SAMPLE_RATE = float(os.environ.get('PROFILE_SAMPLE_RATE', 0))
+PROFILE_DIR = os.environ.get('PROFILE_DIR', BASE_DIR / 'profiles')
+PROFILE_MAX_FILES = 200
+PROFILE_TOKEN_MAX_AGE = 3600
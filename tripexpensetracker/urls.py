@@ -17,7 +17,9 @@ Including another URLconf
 from django.contrib import admin
 from django.urls import path, include
 from rest_framework import routers
-from tripexpensetrackerapi.views import CategoryView, ExpenseCategoryView, ExpenseView, TripView, UserView, check_user, register_user
+from tripexpensetrackerapi.views import (
+    CategoryView, ExpenseCategoryView, ExpenseView, TripView, UserView, check_user, metrics, register_user,
+)
 
 router = routers.DefaultRouter(trailing_slash=False)
 
@@ -33,6 +35,8 @@ urlpatterns = [
     # Authentication-related paths
     path('checkuser', check_user, name='check-user'),
     path('register', register_user, name='register-user'),
+    # Request metrics in the Prometheus text format
+    path('metrics', metrics, name='metrics'),
     path('trips/<int:pk>/add_expense', TripView.as_view({'post': 'add_trip_expense'}), name='trip-add-expense'),
     path('trips/<int:pk>/remove_trip_expense/<int:expense_id>', TripView.as_view({'delete': 'remove_trip_expense'}), name='trip-remove-expense'),
     path('expenses/<int:pk>/remove_expense_category/<int:expense_category>', ExpenseView.as_view({'delete': 'remove_expense_category'}), name='expense-remove-expense-category')
@@ -0,0 +1,333 @@
+"""Per-user spending analytics computed over NumPy arrays.
+
+A user's expenses are loaded once as columns: the id, date, amount and
+currency of each expense and the (expense, category) pairs of their links
+are read on a plain cursor and turned into arrays LOAD_CHUNK_SIZE rows at a
+time, without the ORM's per-row work; the expenses come from an index that
+holds all four columns (expense_user_amount_idx), so the table itself is not
+read. Dates are read as ISO text and parsed
+by NumPy in bulk, rather than one date object per row. Amounts in other
+currencies are converted with one `searchsorted` over each currency's rate
+history, rather than an SQL subquery per row.
+
+The work that depends only on the expenses (sorting amounts overall and
+per category, daily totals with np.bincount, the median and median
+absolute deviation of the log amounts) is done once, as whole-array
+operations, when the columns are loaded (see Columns). A request's own
+options then cost little more than lookups and slices:
+
+- `percentiles()`: interpolated from the sorted amounts, as np.percentile()
+  would.
+- `trend()`: a slice of the daily totals and their moving average from a
+  cumulative sum.
+- `anomalies()`: expenses whose modified z-score is above
+  ANOMALY_THRESHOLD; unlike a mean and standard deviation, the median and
+  median absolute deviation are not skewed by the outliers they look for.
+
+Loaded columns are cached per user until that user's expenses or the
+exchange rates change. Like the category catalog they are checked against
+version stamps in the shared Django cache: every expense write publishes a
+new stamp for its users (`expenses_changed()`, called from rollups.py, which
+every expense write goes through), and a rate change publishes fx.py's.
+They are evicted least recently used first once together they hold more
+than settings.ANALYTICS_CACHE_MAX_ROWS expenses.
+"""
+from datetime import date, timedelta
+import numpy as np
+from django.conf import settings
+from django.db import connections, transaction
+from django.db.models import CharField
+from django.db.models.functions import Cast
+from tripexpensetrackerapi import fx
+from tripexpensetrackerapi.catalog import publish_stamp, read_stamp
+from tripexpensetrackerapi.lru import LRUCache
+from tripexpensetrackerapi.models import Expense, ExpenseCategory, FxRate
+from tripexpensetrackerapi.money import format_amount, home_currency
+
+DEFAULT_PERCENTILES = (50, 90, 99)
+MAX_PERCENTILES = 10
+DEFAULT_DAYS = 90
+MAX_DAYS = 3650
+DEFAULT_WINDOW = 7
+MAX_WINDOW = 365
+DEFAULT_ANOMALIES = 20
+MAX_ANOMALIES = 100
+# Iglewicz and Hoaglin's cut-off for the modified z-score
+ANOMALY_THRESHOLD = 3.5
+# Scales the median absolute deviation to the standard deviation of a normal distribution
+MAD_SCALE = 0.6745
+# Rows fetched and converted to arrays at a time while loading
+LOAD_CHUNK_SIZE = 10000
+# date(1970, 1, 1).toordinal(), where NumPy's datetime64 days start
+EPOCH_ORDINAL = 719163
+
+cache = LRUCache(getattr(settings, 'ANALYTICS_CACHE_MAX_ROWS', 2000000))
+
+
+class InvalidAnalytics(ValueError):
+    """Raised for analytics options that cannot be used."""
+
+
+class Columns:
+    """One user's expenses as arrays, with what every request needs worked out once, when loaded.
+
+    `ids`, `days` (proleptic Gregorian ordinals, as date.toordinal()) and
+    `amounts` (in minor units of the home currency) are parallel arrays,
+    ordered by id. The rest are derived from them:
+
+    - `order` sorts the expenses by amount, and `sorted_amounts` are their
+      amounts in that order, so a percentile is one index lookup.
+    - `categories` are the linked category ids; `link_amounts` are the
+      amounts of each category's expenses, sorted, with category n's run
+      from `bounds[n]` to `bounds[n + 1]`.
+    - `first_day` is the earliest day and `daily` the total of each day
+      from it on, so a trend is a slice.
+    - `logs` are the logs of the positive sorted amounts, from
+      `sorted_amounts[positive:]` on, with their `median` and median
+      absolute `deviation`.
+    """
+
+    def __init__(self, ids, days, amounts, link_rows, link_categories):
+        self.ids = ids
+        self.days = days
+        self.amounts = amounts
+
+        self.order = np.argsort(amounts, kind='stable')
+        self.sorted_amounts = amounts[self.order]
+
+        link_amounts = amounts[link_rows]
+        by_category = np.lexsort((link_amounts, link_categories))
+        self.link_amounts = link_amounts[by_category]
+        link_categories = link_categories[by_category]
+        starts = np.flatnonzero(np.diff(link_categories)) + 1
+        self.bounds = np.concatenate(([0], starts, [len(link_categories)]))
+        self.categories = link_categories[self.bounds[:-1]] if len(link_categories) else link_categories
+
+        self.first_day = int(days.min()) if len(days) else 0
+        self.daily = np.bincount(days - self.first_day, weights=amounts) if len(days) else np.zeros(0)
+
+        self.positive = int(np.searchsorted(self.sorted_amounts, 0, side='right'))
+        self.logs = np.log(self.sorted_amounts[self.positive:])
+        self.median = np.median(self.logs) if len(self.logs) else 0.0
+        self.deviation = np.median(np.abs(self.logs - self.median)) if len(self.logs) else 0.0
+
+    def __len__(self):
+        return len(self.ids)
+
+
+def sorted_percentiles(values, points):
+    """np.percentile() of the already sorted `values`, without sorting them again."""
+    positions = (len(values) - 1) * np.asarray(points, dtype=np.float64) / 100
+    below = np.floor(positions).astype(np.int64)
+    above = np.minimum(below + 1, len(values) - 1)
+    return values[below] + (values[above] - values[below]) * (positions - below)
+
+
+def to_home(amounts, currencies, days):
+    """Convert `amounts` in `currencies` to the home currency at the rate in effect on each of `days`.
+
+    Rows whose currency has no rate on or before their date come back as NaN.
+    """
+    home = amounts.astype(np.float64)
+    foreign = set(np.unique(currencies).tolist()) - {home_currency()}
+    if not foreign:
+        return home
+    history = {}
+    rates = FxRate.objects.filter(currency__in=foreign).order_by('currency', 'date')
+    for currency, day, rate in rates.values_list('currency', 'date', 'rate'):
+        history.setdefault(currency, ([], []))
+        history[currency][0].append(day.toordinal())
+        history[currency][1].append(rate)
+    for currency in foreign:
+        rows = currencies == currency
+        rate_days, rate_values = history.get(currency, ([], []))
+        # The last rate dated on or before each expense
+        found = np.searchsorted(np.array(rate_days, dtype=np.int64), days[rows], side='right') - 1
+        converted = np.full(found.shape, np.nan)
+        known = found >= 0
+        converted[known] = home[rows][known] * np.array(rate_values, dtype=np.float64)[found[known]] / fx.RATE_SCALE
+        home[rows] = converted
+    return home
+
+
+def fetch_chunks(queryset):
+    """Run a values_list() `queryset` on a plain cursor, yielding its rows LOAD_CHUNK_SIZE at a time.
+
+    The rows come back as the database driver returns them, without the
+    ORM's converters.
+    """
+    connection = connections[queryset.db]
+    sql, params = queryset.query.get_compiler(connection=connection).as_sql()
+    with connection.cursor() as cursor:
+        cursor.execute(sql, params)
+        while True:
+            rows = cursor.fetchmany(LOAD_CHUNK_SIZE)
+            if not rows:
+                return
+            yield rows
+
+
+def read_columns(queryset, dtypes):
+    """The columns of a values_list() `queryset` as arrays of `dtypes`, built chunk by chunk."""
+    chunks = [
+        [np.array(column, dtype=dtype) for column, dtype in zip(zip(*rows), dtypes)]
+        for rows in fetch_chunks(queryset)
+    ]
+    if not chunks:
+        return [np.zeros(0, dtype=dtype) for dtype in dtypes]
+    return [np.concatenate(column) for column in zip(*chunks)]
+
+
+def ordinals(days):
+    """date.toordinal() of an array of ISO dates ('YYYY-MM-DD'), for all of them at once."""
+    # Each character as its code point, then as its digit
+    digits = days.astype('U10').view(np.uint32).reshape(-1, 10).astype(np.int64) - ord('0')
+    years = digits[:, 0] * 1000 + digits[:, 1] * 100 + digits[:, 2] * 10 + digits[:, 3]
+    months = digits[:, 5] * 10 + digits[:, 6]
+    firsts = ((years - 1970).astype('datetime64[Y]').astype('datetime64[M]') + (months - 1)).astype('datetime64[D]')
+    return firsts.astype(np.int64) + EPOCH_ORDINAL + digits[:, 8] * 10 + digits[:, 9] - 1
+
+
+def load(user_id):
+    """Read `user_id`'s expenses and category links into Columns, with up to three queries."""
+    # The cast comes last because the SQL lists plain columns before expressions
+    expenses = Expense.objects.filter(user_id=user_id).order_by().values_list(
+        'id', 'amount_minor', 'currency', Cast('date', CharField()),
+    )
+    ids, amounts, currencies, days = read_columns(expenses, (np.int64, np.int64, 'U3', 'U10'))
+    # Sorted here rather than by the database, which would sort every row in a temporary B-tree
+    order = np.argsort(ids, kind='stable')
+    ids, amounts, currencies, days = ids[order], amounts[order], currencies[order], ordinals(days[order])
+    amounts = to_home(amounts, currencies, days)
+    # Rates that expenses convert at cannot be deleted, but an expense saved without fx.check() has none
+    kept = ~np.isnan(amounts)
+    ids, days, amounts = ids[kept], days[kept], amounts[kept]
+
+    links = ExpenseCategory.objects.filter(expense__user_id=user_id).order_by().values_list('expense_id', 'category_id')
+    link_expenses, link_categories = read_columns(links, (np.int64, np.int64))
+    link_rows = np.searchsorted(ids, link_expenses)
+    linked = link_rows < len(ids)
+    linked[linked] = ids[link_rows[linked]] == link_expenses[linked]
+    return Columns(ids, days, amounts, link_rows[linked], link_categories[linked])
+
+
+def version_key(user_id):
+    return f'analytics-version:{user_id}'
+
+
+def columns(user_id):
+    """`user_id`'s Columns, from the cache unless their expenses or the exchange rates changed since loading."""
+    stamps = (read_stamp(version_key(user_id)), read_stamp(fx.VERSION_KEY))
+    cached = cache.get(user_id)
+    if cached is not None and cached[0] == stamps:
+        return cached[1]
+    loaded = load(user_id)
+    # Each expense counts once against the memory budget
+    cache.set(user_id, (stamps, loaded), cost=len(loaded) + 1)
+    return loaded
+
+
+def expenses_changed(user_ids):
+    """Make every process reload the columns of `user_ids`, now and again when the transaction commits.
+
+    The second stamp stops columns loaded from the not-yet-committed state
+    from being used afterwards. This process also drops its own copies,
+    which then never depend on the stamps surviving in the shared cache.
+    """
+    user_ids = set(user_ids)
+
+    def publish():
+        for user_id in user_ids:
+            cache.delete(user_id)
+            publish_stamp(version_key(user_id))
+
+    if user_ids:
+        publish()
+        transaction.on_commit(publish)
+
+
+def percentiles(data, points):
+    """The `points` percentiles of all amounts and of each category's amounts.
+
+    Returns (overall values, {category id: (expense count, values)}).
+    """
+    overall = sorted_percentiles(data.sorted_amounts, points) if len(data) else None
+    categories = {}
+    for category_id, start, end in zip(data.categories.tolist(), data.bounds[:-1], data.bounds[1:]):
+        categories[category_id] = (int(end - start), sorted_percentiles(data.link_amounts[start:end], points))
+    return overall, categories
+
+
+def trend(data, until, days, window):
+    """Daily totals of the `days` days up to `until` with their `window`-day moving average.
+
+    Returns (first day, totals, averages) with one total and average per day.
+    """
+    last = until.toordinal()
+    # The average of the first day reaches back window - 1 days more
+    low = last - days - window + 2
+    totals = np.zeros(days + window - 1)
+    # The part of the range the user has expenses in, if any
+    start, end = max(low, data.first_day), min(last + 1, data.first_day + len(data.daily))
+    if start < end:
+        totals[start - low:end - low] = data.daily[start - data.first_day:end - data.first_day]
+    sums = np.cumsum(np.concatenate(([0.0], totals)))
+    averages = (sums[window:] - sums[:-window]) / window
+    return until - timedelta(days=days - 1), totals[window - 1:], averages
+
+
+def anomalies(data, limit):
+    """The `limit` most unusually large expenses, as (row indexes, scores), highest score first."""
+    if len(data.logs) < 3 or data.deviation == 0:
+        # With a deviation of 0 most expenses are the same amount, so nothing stands out by this measure
+        return np.zeros(0, dtype=np.int64), np.zeros(0)
+    # The logs are sorted, so the flagged expenses are the ones after the cut-off
+    cutoff = data.median + ANOMALY_THRESHOLD * data.deviation / MAD_SCALE
+    flagged = np.arange(
+        max(int(np.searchsorted(data.logs, cutoff, side='right')), len(data.logs) - limit), len(data.logs)
+    )[::-1]
+    scores = MAD_SCALE * (data.logs[flagged] - data.median) / data.deviation
+    return data.order[data.positive + flagged], scores
+
+
+def formatted(value):
+    """Render an amount in (fractional) minor units of the home currency the way the API does."""
+    return format_amount(int(round(float(value))), home_currency())
+
+
+def bounded(params, name, default, largest):
+    try:
+        value = int(params.get(name, default))
+    except ValueError as ex:
+        raise InvalidAnalytics(f'{name} must be a whole number') from ex
+    if not 1 <= value <= largest:
+        raise InvalidAnalytics(f'{name} must be between 1 and {largest}')
+    return value
+
+
+def options(params, today):
+    """Read the analytics options of a request's query `params`."""
+    points = params.get('percentiles')
+    if points:
+        try:
+            points = [float(point) for point in points.split(',')]
+        except ValueError as ex:
+            raise InvalidAnalytics('percentiles must be numbers separated by commas') from ex
+        if len(points) > MAX_PERCENTILES or not all(0 <= point <= 100 for point in points):
+            raise InvalidAnalytics(f'percentiles must be at most {MAX_PERCENTILES} numbers from 0 to 100')
+    until = params.get('until')
+    try:
+        until = date.fromisoformat(until) if until else today
+    except ValueError as ex:
+        raise InvalidAnalytics('until must be a date') from ex
+    return {
+        'percentiles': points or list(DEFAULT_PERCENTILES),
+        'until': until,
+        'days': bounded(params, 'days', DEFAULT_DAYS, MAX_DAYS),
+        'window': bounded(params, 'window', DEFAULT_WINDOW, MAX_WINDOW),
+        'limit': bounded(params, 'limit', DEFAULT_ANOMALIES, MAX_ANOMALIES),
+    }
+
+
+def clear():
+    cache.clear()
@@ -4,3 +4,7 @@ from django.apps import AppConfig
 class TripexpensetrackerapiConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'tripexpensetrackerapi'
+
+    def ready(self):
+        # Connects the cache invalidation receivers
+        from tripexpensetrackerapi import signals  # noqa: F401
@@ -0,0 +1,268 @@
+"""Batched expense writes used by ExpenseView's bulk endpoints.
+
+Each function validates every item first, then checks all foreign keys with
+one `in_bulk` query per model (categories come from the in-memory catalog)
+and writes everything with `bulk_create` /
+`bulk_update` inside a single transaction. If any item is invalid nothing
+is written and the per-item errors are returned instead.
+"""
+from collections import defaultdict
+from django.db import transaction
+from django.db.models import Q
+from django.utils import timezone
+from rest_framework import serializers
+from tripexpensetrackerapi import fx, rollups
+from tripexpensetrackerapi.catalog import category_catalog
+from tripexpensetrackerapi.deletes import delete_expense_rows
+from tripexpensetrackerapi.models import Trip, Expense, User, ExpenseCategory
+from tripexpensetrackerapi.money import InvalidAmount, parse_currency, to_minor
+from tripexpensetrackerapi.timestamps import touch_trips
+
+
+class BulkExpenseSerializer(serializers.Serializer):
+    """Validates one item of a bulk expense request without touching the database."""
+    user = serializers.IntegerField()
+    trip = serializers.IntegerField(required=False, allow_null=True)
+    name = serializers.CharField(max_length=51)
+    # Enough places for any currency; validate() checks them against the item's currency
+    amount = serializers.DecimalField(max_digits=15, decimal_places=3)
+    currency = serializers.CharField(required=False)
+    description = serializers.CharField(allow_blank=True)
+    date = serializers.DateField()
+    categories = serializers.ListField(child=serializers.IntegerField(), required=False)
+
+    def default_currency(self):
+        return parse_currency(None)
+
+    def validate(self, data):
+        """Resolve the currency and add `amount_minor`, the amount in the currency's minor unit."""
+        try:
+            currency = parse_currency(data['currency']) if 'currency' in data else self.default_currency()
+        except InvalidAmount as ex:
+            raise serializers.ValidationError({'currency': [str(ex)]})
+        data['currency'] = currency
+        if currency is not None:
+            try:
+                data['amount_minor'] = to_minor(data['amount'], currency)
+            except InvalidAmount as ex:
+                raise serializers.ValidationError({'amount': [str(ex)]})
+        return data
+
+
+class BulkExpenseUpdateSerializer(BulkExpenseSerializer):
+    """Bulk update items also carry the id of the expense they change.
+
+    Without a currency an item keeps the expense's, as a single update does.
+    """
+    id = serializers.IntegerField()
+
+    def default_currency(self):
+        return None
+
+
+def validate_items(data, serializer_class):
+    """Validate each item in `data`, returning (validated items, errors)."""
+    if not isinstance(data, list):
+        return [], [{'index': None, 'errors': {'non_field_errors': ['Expected a list of items.']}}]
+
+    items, errors = [], []
+    for index, item in enumerate(data):
+        serializer = serializer_class(data=item)
+        if serializer.is_valid():
+            items.append(serializer.validated_data)
+        else:
+            errors.append({'index': index, 'errors': serializer.errors})
+            items.append(None)
+    return items, errors
+
+
+def check_references(items, errors):
+    """Check the users, trips, categories and currencies of `items`.
+
+    Users and trips take one query per model, categories are checked against
+    the catalog and currencies against the cached exchange rates.
+    """
+    valid = [item for item in items if item is not None]
+    users = User.objects.in_bulk({item['user'] for item in valid})
+    trips = Trip.objects.in_bulk({item['trip'] for item in valid if item.get('trip')})
+    missing_categories = set(category_catalog.missing({
+        category_id for item in valid for category_id in item.get('categories', [])
+    }))
+
+    for index, item in enumerate(items):
+        if item is None:
+            continue
+        item_errors = {}
+        if item['user'] not in users:
+            item_errors['user'] = [f'User {item["user"]} not found.']
+        if item.get('trip') and item['trip'] not in trips:
+            item_errors['trip'] = [f'Trip {item["trip"]} not found.']
+        missing = [category_id for category_id in item.get('categories', []) if category_id in missing_categories]
+        if missing:
+            item_errors['categories'] = [f'Category {category_id} not found.' for category_id in missing]
+        if item['currency'] is not None:
+            try:
+                fx.check(item['currency'], item['date'])
+            except InvalidAmount as ex:
+                item_errors['currency'] = [str(ex)]
+        if item_errors:
+            errors.append({'index': index, 'errors': item_errors})
+
+
+def sorted_errors(errors):
+    return sorted(errors, key=lambda error: -1 if error['index'] is None else error['index'])
+
+
+def category_links(expenses, items):
+    """ExpenseCategory rows linking each expense to its item's categories, each category once."""
+    return [
+        ExpenseCategory(expense_id=expense.id, category_id=category_id)
+        for expense, item in zip(expenses, items)
+        for category_id in dict.fromkeys(item.get('categories', []))
+    ]
+
+
+def sync_category_links(wanted):
+    """Make the category links of each expense in `wanted`, a {expense id: category ids} dict, match it.
+
+    The current links are read with one query; missing links are added with
+    one bulk insert and surplus ones removed with one filtered delete, and
+    nothing is written when no expense's categories changed. Returns the ids
+    of the expenses whose links changed.
+    """
+    current = defaultdict(set)
+    links = ExpenseCategory.objects.filter(expense_id__in=wanted).values_list('expense_id', 'category_id')
+    for expense_id, category_id in links:
+        current[expense_id].add(category_id)
+
+    added = []
+    removed = Q()
+    changed = set()
+    for expense_id, category_ids in wanted.items():
+        category_ids = set(category_ids)
+        for category_id in category_ids - current[expense_id]:
+            added.append(ExpenseCategory(expense_id=expense_id, category_id=category_id))
+            changed.add(expense_id)
+        stale = current[expense_id] - category_ids
+        if stale:
+            removed |= Q(expense_id=expense_id, category_id__in=stale)
+            changed.add(expense_id)
+
+    if removed:
+        ExpenseCategory.objects.filter(removed).delete()
+    if added:
+        ExpenseCategory.objects.bulk_create(added)
+    return changed
+
+
+def create_expenses(data):
+    """Create every expense in `data`, returning (new expense ids, errors)."""
+    items, errors = validate_items(data, BulkExpenseSerializer)
+    check_references(items, errors)
+    if errors:
+        return [], sorted_errors(errors)
+
+    with transaction.atomic():
+        expenses = Expense.objects.bulk_create(
+            Expense(
+                user_id=item['user'],
+                trip_id=item.get('trip'),
+                name=item['name'],
+                amount_minor=item['amount_minor'],
+                currency=item['currency'],
+                description=item['description'],
+                date=item['date'],
+            )
+            for item in items
+        )
+        ExpenseCategory.objects.bulk_create(category_links(expenses, items))
+        rollups.add(Expense.objects.filter(pk__in=[expense.id for expense in expenses]))
+        touch_trips({item.get('trip') for item in items})
+    return [expense.id for expense in expenses], []
+
+
+def update_expenses(data):
+    """Update every expense in `data` by id, returning errors.
+
+    As with a single update, an item's categories replace the expense's
+    existing ones only when a non-empty list is given.
+    """
+    items, errors = validate_items(data, BulkExpenseUpdateSerializer)
+    check_references(items, errors)
+
+    ids = [item['id'] for item in items if item is not None]
+    expenses = Expense.objects.in_bulk(ids)
+    seen = set()
+    for index, item in enumerate(items):
+        if item is None:
+            continue
+        if item['id'] not in expenses:
+            errors.append({'index': index, 'errors': {'id': [f'Expense {item["id"]} not found.']}})
+        elif item['id'] in seen:
+            errors.append({'index': index, 'errors': {'id': [f'Expense {item["id"]} is listed more than once.']}})
+        elif item['currency'] is None:
+            # Items without a currency are checked against the expense's
+            item['currency'] = expenses[item['id']].currency
+            try:
+                item['amount_minor'] = to_minor(item['amount'], item['currency'])
+                fx.check(item['currency'], item['date'])
+            except InvalidAmount as ex:
+                errors.append({'index': index, 'errors': {'amount': [str(ex)]}})
+        seen.add(item['id'])
+    if errors:
+        return sorted_errors(errors)
+
+    # bulk_update skips auto_now, so updated_at is set here
+    now = timezone.now()
+    changed = []
+    trip_ids = set()
+    for item in items:
+        expense = expenses[item['id']]
+        trip_ids.add(expense.trip_id)
+        expense.user_id = item['user']
+        expense.name = item['name']
+        expense.amount_minor = item['amount_minor']
+        expense.currency = item['currency']
+        expense.description = item['description']
+        expense.date = item['date']
+        if 'trip' in item:
+            expense.trip_id = item['trip']
+        expense.updated_at = now
+        trip_ids.add(expense.trip_id)
+        changed.append(expense)
+    recategorized = [item for item in items if item.get('categories')]
+
+    with rollups.tracking(Expense.objects.filter(pk__in=[expense.id for expense in changed])):
+        Expense.objects.bulk_update(
+            changed, ['user', 'trip', 'name', 'amount_minor', 'currency', 'description', 'date', 'updated_at']
+        )
+        sync_category_links({item['id']: item['categories'] for item in recategorized})
+        touch_trips(trip_ids)
+    return []
+
+
+def delete_expenses(data):
+    """Delete every expense whose id is in `data`, returning errors."""
+    if not isinstance(data, list):
+        return [{'index': None, 'errors': {'non_field_errors': ['Expected a list of expense ids.']}}]
+
+    errors = []
+    requested = []
+    for index, expense_id in enumerate(data):
+        if isinstance(expense_id, int) and not isinstance(expense_id, bool):
+            requested.append((index, expense_id))
+        else:
+            errors.append({'index': index, 'errors': {'id': ['A valid integer is required.']}})
+
+    ids = [expense_id for _, expense_id in requested]
+    existing = dict(Expense.objects.filter(pk__in=ids).values_list('pk', 'trip_id'))
+    for index, expense_id in requested:
+        if expense_id not in existing:
+            errors.append({'index': index, 'errors': {'id': [f'Expense {expense_id} not found.']}})
+    if errors:
+        return sorted_errors(errors)
+
+    with transaction.atomic():
+        delete_expense_rows(Expense.objects.filter(pk__in=ids))
+        touch_trips(existing.values())
+    return []
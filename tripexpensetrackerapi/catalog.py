@@ -0,0 +1,167 @@
+"""Process-local copy of the Category table.
+
+Categories are few and rarely change, but almost every expense request
+validates or displays them. The catalog loads them once per process and
+serves lookups from memory. Whenever a category is created, renamed or
+deleted (see signals.py) a new version stamp is written to the shared
+Django cache; every process compares its stamp with the shared one before a
+lookup and reloads when they differ. With a cache backend shared between
+workers (file-based, memcached, ...) all processes notice the change.
+A request reads the shared stamp once, on its first lookup
+(`catalog_middleware` keeps it for the rest of the request), so serializing
+many categories costs one cache read; outside requests every lookup reads
+it. A lookup of an id the catalog lacks reloads it at most once per stamp.
+
+Async views take a `snapshot()` of the names and fingerprint once, after any
+reload has run in a worker thread, and pass it along; nothing they call can
+then trigger a synchronous query from the event loop.
+"""
+import threading
+import uuid
+from contextvars import ContextVar
+from asgiref.sync import sync_to_async
+from django.core.cache import cache
+from tripexpensetrackerapi.models import Category
+
+VERSION_KEY = 'category-catalog-version'
+
+# The stamps the request being served has read, {key: stamp}; None outside requests
+request_stamps = ContextVar('catalog_request_stamps', default=None)
+# Tells "not reloaded for a miss yet" apart from any stamp
+NOT_RECHECKED = object()
+
+
+def current_stamp(key):
+    """The shared stamp under `key`, creating one if there is none.
+
+    A stamp the cache has evicted is replaced by a fresh one rather than read
+    as None, so whatever was cached under an older stamp, or under none, can
+    never match again.
+    """
+    stamp = cache.get(key)
+    if stamp is None:
+        cache.add(key, uuid.uuid4().hex, None)
+        stamp = cache.get(key)
+    return stamp
+
+
+async def acurrent_stamp(key):
+    """Async current_stamp()."""
+    stamp = await cache.aget(key)
+    if stamp is None:
+        await cache.aadd(key, uuid.uuid4().hex, None)
+        stamp = await cache.aget(key)
+    return stamp
+
+
+def read_stamp(key=VERSION_KEY):
+    """The shared stamp under `key`, read once per request."""
+    stamps = request_stamps.get()
+    if stamps is None:
+        return current_stamp(key)
+    if key not in stamps:
+        stamps[key] = current_stamp(key)
+    return stamps[key]
+
+
+async def aread_stamp(key=VERSION_KEY):
+    """read_stamp() for async views, through the cache's async API."""
+    stamps = request_stamps.get()
+    if stamps is None:
+        return await acurrent_stamp(key)
+    if key not in stamps:
+        stamps[key] = await acurrent_stamp(key)
+    return stamps[key]
+
+
+def publish_stamp(key=VERSION_KEY):
+    """Write a new stamp under `key`, which the current request also sees from then on."""
+    stamp = uuid.uuid4().hex
+    cache.set(key, stamp, None)
+    stamps = request_stamps.get()
+    if stamps is not None:
+        stamps[key] = stamp
+    return stamp
+
+
+class CategoryCatalog:
+    """Category names by id, reloaded when the shared version stamp changes."""
+
+    def __init__(self):
+        self._names = None
+        self._fingerprint = None
+        self._version = None
+        self._loaded = None
+        self._rechecked = NOT_RECHECKED
+        self._lock = threading.Lock()
+
+    def names(self):
+        """Return a {category id: name} dict ordered by id."""
+        return self._names_at(read_stamp())
+
+    def _names_at(self, version):
+        names = self._names
+        if names is None or version != self._version:
+            names = self.reload(version)
+        return names
+
+    def _names_with(self, category_ids):
+        """names(), reloaded once per stamp if it lacks any of `category_ids`."""
+        version = read_stamp()
+        names = self._names_at(version)
+        if any(category_id not in names for category_id in category_ids) and self._rechecked != version:
+            # The category may have been created before this process saw the new stamp; later misses are real
+            self._rechecked = version
+            names = self.reload(version)
+        return names
+
+    def reload(self, version=None):
+        return self.load(version)[0]
+
+    def load(self, version=None):
+        """Read every category, returning (names, fingerprint)."""
+        with self._lock:
+            rows = list(Category.objects.order_by('id').values_list('id', 'name', 'updated_at'))
+            names = {pk: name for pk, name, _ in rows}
+            fingerprint = (len(rows), max((updated_at for _, _, updated_at in rows), default=None))
+            self._names, self._fingerprint, self._version = names, fingerprint, version
+            # Replaced as a whole so the event loop can read it without taking the lock
+            self._loaded = (version, names, fingerprint)
+            return names, fingerprint
+
+    async def snapshot(self):
+        """Return (names, fingerprint) for an async view, reloading in a worker thread if stale."""
+        version = await aread_stamp()
+        loaded = self._loaded
+        if loaded is None or loaded[0] != version:
+            return await sync_to_async(self.load)(version)
+        return loaded[1], loaded[2]
+
+    def name(self, category_id):
+        """Return the name of a category, or None if it does not exist."""
+        category_id = int(category_id)
+        return self._names_with([category_id]).get(category_id)
+
+    def missing(self, category_ids):
+        """Return the ids in `category_ids` that are not categories."""
+        category_ids = [int(category_id) for category_id in category_ids]
+        names = self._names_with(category_ids)
+        return [category_id for category_id in category_ids if category_id not in names]
+
+    def fingerprint(self):
+        """Return (category count, latest updated_at), which changes whenever a category does."""
+        self.names()
+        return self._fingerprint
+
+    def rows(self):
+        """Return every category as an {'id', 'name'} dict, ordered by id."""
+        return [{'id': pk, 'name': name} for pk, name in self.names().items()]
+
+    def invalidate(self):
+        """Publish a new version stamp so every process reloads its catalog."""
+        publish_stamp()
+        self._names = None
+        self._loaded = None
+
+
+category_catalog = CategoryCatalog()
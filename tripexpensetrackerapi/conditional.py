@@ -0,0 +1,54 @@
+"""ETag / Last-Modified support for conditional GETs.
+
+Views compute validators from `updated_at` values: on a conditional request
+they first run one cheap query for just those values and return 304 without
+serializing anything when the client's copy is current. Otherwise the same
+validators are computed from the rows they loaded anyway and attached to the
+full response. Every ETag also covers the category catalog, since category
+names appear in trip and expense payloads.
+"""
+import calendar
+import hashlib
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date, quote_etag
+from tripexpensetrackerapi.catalog import category_catalog
+
+
+def make_etag(*parts, fingerprint=None):
+    """A strong ETag derived from `parts` and the category catalog's state.
+
+    Async views pass the catalog `fingerprint` from their snapshot.
+    """
+    if fingerprint is None:
+        fingerprint = category_catalog.fingerprint()
+    digest = hashlib.sha1(repr((parts, fingerprint)).encode()).hexdigest()
+    return quote_etag(digest)
+
+
+def page_validators(request, versions, has_next, fingerprint=None):
+    """ETag and Last-Modified for one page of (id, updated_at) rows."""
+    etag = make_etag(request.get_full_path(), versions, has_next, fingerprint=fingerprint)
+    last_modified = max((updated_at for _, updated_at in versions), default=None)
+    return etag, last_modified
+
+
+def is_conditional(request):
+    """Whether the client sent validators worth checking before doing any work."""
+    return 'HTTP_IF_NONE_MATCH' in request.META or 'HTTP_IF_MODIFIED_SINCE' in request.META
+
+
+def not_modified(request, etag, last_modified):
+    """Return a 304 response if the client's copy is current, else None."""
+    timestamp = calendar.timegm(last_modified.utctimetuple()) if last_modified else None
+    response = get_conditional_response(request, etag=etag, last_modified=timestamp)
+    if response is not None:
+        set_validators(response, etag, last_modified)
+    return response
+
+
+def set_validators(response, etag, last_modified):
+    """Attach the ETag and Last-Modified headers to `response` and return it."""
+    response['ETag'] = etag
+    if last_modified:
+        response['Last-Modified'] = http_date(calendar.timegm(last_modified.utctimetuple()))
+    return response
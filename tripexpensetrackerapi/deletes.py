@@ -0,0 +1,88 @@
+"""Set-based deletes for expenses and trips.
+
+Deleting model instances one by one runs a cascade collector per instance,
+and even a queryset `delete()` of expenses loads every expense so it can
+cascade to their category links. Here the links are deleted first with one
+statement filtered by a subquery, which leaves nothing for the expenses to
+cascade to, so the expenses go with one more statement.
+
+These deletes fire no signals; callers bump `updated_at` (and with it the
+response cache) through timestamps.py. The monthly rollups are updated here.
+"""
+import logging
+import threading
+from django.conf import settings
+from django.db import connections, transaction
+from tripexpensetrackerapi import rollups
+from tripexpensetrackerapi.models import Trip, Expense, ExpenseCategory
+from tripexpensetrackerapi.timestamps import touch_trips
+
+logger = logging.getLogger(__name__)
+
+
+def delete_expense_rows(expenses):
+    """Delete the expenses in the `expenses` queryset, and their category links, with two DELETE statements."""
+    with transaction.atomic():
+        rollups.remove(expenses)
+        ExpenseCategory.objects.filter(expense__in=expenses.values('id')).delete()
+        # Nothing references the expenses any more, but delete() would still load them to look for cascades
+        delete_rows(expenses)
+
+
+def delete_rows(queryset):
+    """Delete the rows of `queryset` with one DELETE statement, without loading them or running cascades."""
+    connection = connections[queryset.db]
+    meta = queryset.model._meta
+    sql, params = queryset.values('pk').query.get_compiler(connection=connection).as_sql()
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f'DELETE FROM {connection.ops.quote_name(meta.db_table)} '
+            f'WHERE {connection.ops.quote_name(meta.pk.column)} IN ({sql})',
+            params,
+        )
+        return cursor.rowcount
+
+
+def delete_trip(trip):
+    """Delete a trip and everything in it inside one transaction."""
+    with transaction.atomic():
+        delete_expense_rows(Expense.objects.filter(trip_id=trip.id))
+        trip.delete()
+
+
+def purge_trip(trip_id, chunk_size=None):
+    """Delete a trip's expenses in chunks of `chunk_size`, one short transaction each, then the trip.
+
+    Each transaction holds the SQLite write lock only briefly, so other
+    writers get in between chunks. Returns the number of expenses deleted.
+    """
+    chunk_size = chunk_size or getattr(settings, 'TRIP_PURGE_CHUNK_SIZE', 1000)
+    deleted = 0
+    while True:
+        with transaction.atomic():
+            ids = list(Expense.objects.filter(trip_id=trip_id).order_by('id').values_list('id', flat=True)[:chunk_size])
+            if not ids:
+                break
+            delete_expense_rows(Expense.objects.filter(pk__in=ids))
+            touch_trips([trip_id])
+        deleted += len(ids)
+
+    trip = Trip.objects.filter(pk=trip_id).first()
+    if trip is not None:
+        delete_trip(trip)
+    return deleted
+
+
+def run_in_background(target, *args):
+    """Run `target(*args)` in a daemon thread that closes its database connections when done."""
+    def run():
+        try:
+            target(*args)
+        except Exception:
+            logger.exception('Background %s%r failed', target.__name__, args)
+        finally:
+            connections.close_all()
+
+    thread = threading.Thread(target=run, daemon=True)
+    thread.start()
+    return thread
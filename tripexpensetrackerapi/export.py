@@ -0,0 +1,99 @@
+import csv
+from collections import defaultdict
+from itertools import islice
+from django.core.serializers.json import DjangoJSONEncoder
+from rest_framework.negotiation import BaseContentNegotiation
+from tripexpensetrackerapi.catalog import category_catalog
+from tripexpensetrackerapi.models import ExpenseCategory
+from tripexpensetrackerapi.money import format_amount
+
+# Rows fetched from the database cursor, and written to the client, per batch
+CHUNK_SIZE = 2000
+
+EXPORT_COLUMNS = ('id', 'name', 'amount', 'currency', 'date', 'trip', 'categories')
+
+
+class IgnoreClientContentNegotiation(BaseContentNegotiation):
+    """Skip Accept header checks for views that build their own streaming response."""
+
+    def select_parser(self, request, parsers):
+        return parsers[0]
+
+    def select_renderer(self, request, renderers, format_suffix=None):
+        return (renderers[0], renderers[0].media_type)
+
+
+def export_chunks(expenses, chunk_size=None):
+    """Yield lists of plain expense rows, each with its trip and category names.
+
+    Expenses are read with a chunked database iterator over `values()`, and
+    category links are fetched with one query per chunk (names come from the
+    category catalog), so memory stays
+    bounded by `chunk_size` however many rows are exported.
+    """
+    chunk_size = chunk_size or CHUNK_SIZE
+    rows = (
+        expenses.order_by('id')
+        .values('id', 'name', 'amount_minor', 'currency', 'date', 'trip__name')
+        .iterator(chunk_size=chunk_size)
+    )
+    while True:
+        chunk = list(islice(rows, chunk_size))
+        if not chunk:
+            return
+
+        category_names = defaultdict(list)
+        links = (
+            ExpenseCategory.objects.filter(expense_id__in=[row['id'] for row in chunk])
+            .order_by('id')
+            .values_list('expense_id', 'category_id')
+        )
+        names = category_catalog.names()
+        for expense_id, category_id in links:
+            category_names[expense_id].append(names.get(category_id))
+
+        yield [
+            {
+                'id': row['id'],
+                'name': row['name'],
+                'amount': format_amount(row['amount_minor'], row['currency']),
+                'currency': row['currency'],
+                'date': row['date'],
+                'trip': row['trip__name'],
+                'categories': category_names[row['id']],
+            }
+            for row in chunk
+        ]
+
+
+def ndjson_stream(chunks):
+    """Render row chunks as newline-delimited JSON."""
+    encoder = DjangoJSONEncoder(separators=(',', ':'))
+    for chunk in chunks:
+        yield ''.join(encoder.encode(row) + '\n' for row in chunk)
+
+
+class _Echo:
+    """File-like object whose write() returns what was written, for csv.writer."""
+
+    def write(self, value):
+        return value
+
+
+def csv_stream(chunks):
+    """Render row chunks as CSV with a header row; categories are joined with '; '."""
+    writer = csv.writer(_Echo())
+    yield writer.writerow(EXPORT_COLUMNS)
+    for chunk in chunks:
+        yield ''.join(
+            writer.writerow([
+                row['id'],
+                row['name'],
+                row['amount'],
+                row['currency'],
+                row['date'],
+                row['trip'] or '',
+                '; '.join(row['categories']),
+            ])
+            for row in chunk
+        )
@@ -0,0 +1,164 @@
+"""Plain-dict serialization for the list endpoints.
+
+ModelSerializer builds field objects and calls `to_representation` for every
+field of every instance, which for a page of trips with their expenses costs
+more than the queries. These functions read `values()` rows instead, group
+category links with one query per page, and build the dicts directly. Their
+output renders to exactly the same JSON as ExpenseSerializer, TripSerializer
+and ExpenseCategorySerializer (tests.FastSerializerTests compares them);
+keep the two in step when a serializer changes.
+
+The list views use them when settings.FAST_LIST_SERIALIZERS is on. Like
+the serializers, they render and query only what the request's fieldset
+(fieldsets.py) asks for.
+"""
+from collections import defaultdict
+from django.conf import settings
+from tripexpensetrackerapi import fx
+from tripexpensetrackerapi.catalog import category_catalog
+from tripexpensetrackerapi.fieldsets import EXPENSE, TRIP, Fieldset
+from tripexpensetrackerapi.metrics import timed_function
+from tripexpensetrackerapi.models import Expense, ExpenseCategory
+from tripexpensetrackerapi.money import format_amount
+
+USER_FIELDS = ('user_id', 'user__name', 'user__uid')
+EXPENSE_CATEGORY_FIELDS = ('id', 'category_id', 'expense__name')
+
+
+def enabled():
+    return getattr(settings, 'FAST_LIST_SERIALIZERS', True)
+
+
+def expense_columns(keys):
+    # Pagination and validators always need date and updated_at, and category links render the expense's name
+    columns = ['id', 'date', 'updated_at', 'trip_id']
+    columns += [name for name in ('name', 'description') if name in keys]
+    if 'amount' in keys:
+        columns.append('amount_minor')
+    if 'amount' in keys or 'currency' in keys:
+        columns.append('currency')
+    if 'categories' in keys and 'name' not in keys:
+        columns.append('name')
+    if 'user' in keys:
+        columns += USER_FIELDS
+    return columns
+
+
+def expense_values(expenses, fieldset=None):
+    """The columns of `expenses` that expense_dicts() reads for `fieldset`, as a values() queryset."""
+    return expenses.values(*expense_columns((fieldset or Fieldset(EXPENSE)).keys(EXPENSE)))
+
+
+def trip_values(trips, fieldset=None):
+    """The columns of `trips` that trip_dicts() reads for `fieldset`, as a values() queryset.
+
+    `trips` must be annotated with `total` when the fieldset asks for it.
+    """
+    keys = (fieldset or Fieldset(TRIP)).keys(TRIP)
+    columns = ['id', 'date', 'updated_at']
+    columns += [name for name in ('name', 'description', 'total') if name in keys]
+    if 'user_details' in keys:
+        columns += USER_FIELDS
+    return trips.values(*columns)
+
+
+def expense_category_values(expense_categories):
+    """The columns of `expense_categories` that expense_category_dicts() reads, as a values() queryset."""
+    return expense_categories.values(*EXPENSE_CATEGORY_FIELDS)
+
+
+def user_dict(row):
+    return {'id': row['user_id'], 'name': row['user__name'], 'uid': row['user__uid']}
+
+
+def category_links(expense_ids):
+    """{expense id: [(link id, category id), ...]} for `expense_ids`, in link order, with one query."""
+    links = defaultdict(list)
+    rows = (
+        ExpenseCategory.objects.filter(expense_id__in=expense_ids)
+        .order_by('id')
+        .values_list('id', 'expense_id', 'category_id')
+    )
+    for link_id, expense_id, category_id in rows:
+        links[expense_id].append((link_id, category_id))
+    return links
+
+
+def field_value(row, name):
+    if name == 'amount':
+        return format_amount(row['amount_minor'], row['currency'])
+    if name == 'total':
+        return fx.format_home(row[name])
+    if name == 'date':
+        return row[name].isoformat()
+    return row[name]
+
+
+def expense_dict(row, links, names, keys):
+    expense = {}
+    for name in keys:
+        if name == 'user':
+            expense[name] = user_dict(row)
+        elif name == 'categories':
+            expense[name] = [
+                {'id': link_id, 'expense_name': row['name'], 'category_name': names.get(category_id)}
+                for link_id, category_id in links
+            ]
+        else:
+            expense[name] = field_value(row, name)
+    return expense
+
+
+@timed_function('serialize')
+def expense_dicts(rows, fieldset=None):
+    """Render expense_values() rows as ExpenseSerializer would, with one query for their categories if included."""
+    keys = (fieldset or Fieldset(EXPENSE)).keys(EXPENSE)
+    links = category_links([row['id'] for row in rows]) if 'categories' in keys else {}
+    names = category_catalog.names()
+    return [expense_dict(row, links.get(row['id'], ()), names, keys) for row in rows]
+
+
+@timed_function('serialize')
+def trip_dicts(rows, fieldset=None):
+    """Render trip_values() rows as TripSerializer would.
+
+    Embedded expenses cost one query, and their categories one more.
+    """
+    fieldset = fieldset or Fieldset(TRIP)
+    keys = fieldset.keys(TRIP)
+    expense_keys = fieldset.keys(EXPENSE)
+    expenses = defaultdict(list)
+    links = {}
+    if 'expense_details' in keys:
+        trip_expenses = Expense.objects.filter(trip_id__in=[row['id'] for row in rows]).order_by('id')
+        for expense in trip_expenses.values(*expense_columns(expense_keys)):
+            expenses[expense['trip_id']].append(expense)
+        if 'categories' in expense_keys:
+            links = category_links([expense['id'] for trip_expenses in expenses.values() for expense in trip_expenses])
+    names = category_catalog.names()
+
+    trips = []
+    for row in rows:
+        trip = {}
+        for name in keys:
+            if name == 'user_details':
+                trip[name] = user_dict(row)
+            elif name == 'expense_details':
+                trip[name] = [
+                    expense_dict(expense, links.get(expense['id'], ()), names, expense_keys)
+                    for expense in expenses[row['id']]
+                ]
+            else:
+                trip[name] = field_value(row, name)
+        trips.append(trip)
+    return trips
+
+
+@timed_function('serialize')
+def expense_category_dicts(rows):
+    """Render expense_category_values() rows as ExpenseCategorySerializer would."""
+    names = category_catalog.names()
+    return [
+        {'id': row['id'], 'expense_name': row['expense__name'], 'category_name': names.get(row['category_id'])}
+        for row in rows
+    ]
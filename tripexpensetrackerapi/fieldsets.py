@@ -0,0 +1,129 @@
+"""Sparse fieldsets (`?fields=`) and opt-in embedding (`?include=`) for trips and expenses.
+
+`?fields=id,name,date` limits a trip or expense to the listed fields, and
+`?include=expenses,categories,user` picks the relations embedded in it:
+`user` is a trip's `user_details` and an expense's `user`, `expenses` a
+trip's `expense_details`, and `categories` the categories of every expense
+in the response. Once either parameter is given, only the relations named
+in `include` are embedded; a request with neither gets the full payload.
+`fields` applies to the requested resource; expenses embedded in a trip
+keep all of their own fields.
+
+Trips also offer `total`, the sum of their expenses' amounts in the home
+currency, which is only computed when `fields` asks for it.
+
+Views build their querysets from the fieldset, so relations that are left
+out are neither queried nor serialized.
+"""
+
+
+class InvalidFieldset(Exception):
+    """Raised when `fields` or `include` names something the resource does not have."""
+
+
+class Spec:
+    """The fields a resource renders, in output order.
+
+    `relations` maps each embedded relation's field to its `include` name,
+    `optional` fields are only rendered when asked for, and `includes` lists
+    every `include` name the resource's endpoints accept.
+    """
+
+    def __init__(self, fields, relations, includes, optional=()):
+        self.fields = fields
+        self.relations = relations
+        self.includes = includes
+        self.optional = optional
+        self.scalars = tuple(name for name in fields if name not in relations)
+        self.defaults = tuple(name for name in self.scalars if name not in optional)
+
+
+EXPENSE = Spec(
+    fields=('id', 'name', 'user', 'amount', 'currency', 'description', 'date', 'categories'),
+    relations={'user': 'user', 'categories': 'categories'},
+    includes=('user', 'categories'),
+)
+
+TRIP = Spec(
+    fields=('id', 'name', 'date', 'description', 'total', 'user_details', 'expense_details'),
+    relations={'user_details': 'user', 'expense_details': 'expenses'},
+    includes=('user', 'expenses', 'categories'),
+    optional=('total',),
+)
+
+
+class Fieldset:
+    """The fields and relations one request asked for, for the resource described by `spec`.
+
+    `fields` and `include` are None when the request did not restrict them.
+    """
+
+    def __init__(self, spec, fields=None, include=None):
+        self.spec = spec
+        self.fields = fields
+        self.include = include
+
+    @property
+    def is_default(self):
+        return self.fields is None and self.include is None
+
+    @property
+    def key(self):
+        """A string identifying this fieldset in cache keys and ETags; empty for the full payload."""
+        if self.is_default:
+            return ''
+        return f"fields={','.join(self.fields or ())}&include={','.join(sorted(self.include or ()))}"
+
+    def includes(self, relation):
+        return self.include is None or relation in self.include
+
+    def keys(self, spec=None):
+        """The fields rendered for `spec` (by default the requested resource), in output order."""
+        spec = spec or self.spec
+        wanted = self.fields if spec is self.spec and self.fields is not None else spec.defaults
+        return tuple(
+            name for name in spec.fields
+            if name in wanted or (name in spec.relations and self.includes(spec.relations[name]))
+        )
+
+
+def split(value):
+    if not value:
+        return None
+    return [name.strip() for name in value.split(',') if name.strip()]
+
+
+def parse_fieldset(request, spec):
+    """Read the `fields` and `include` query parameters of `request` for the resource described by `spec`."""
+    fields = split(request.query_params.get('fields'))
+    include = split(request.query_params.get('include'))
+    if fields is None and include is None:
+        return Fieldset(spec)
+
+    unknown = [name for name in fields or () if name not in spec.scalars]
+    if unknown:
+        raise InvalidFieldset(f"Unknown field '{unknown[0]}', expected some of {', '.join(spec.scalars)}")
+    unknown = [name for name in include or () if name not in spec.includes]
+    if unknown:
+        raise InvalidFieldset(f"Unknown include '{unknown[0]}', expected some of {', '.join(spec.includes)}")
+
+    return Fieldset(
+        spec,
+        fields=tuple(name for name in spec.scalars if name in fields) if fields is not None else None,
+        include=frozenset(include or ()),
+    )
+
+
+class SparseFieldsMixin:
+    """Serializer mixin rendering only the fields of the fieldset in `context['fieldset']`.
+
+    Without one the serializer renders its resource's default fields.
+    """
+
+    spec = None
+
+    def get_fields(self):
+        fields = super().get_fields()
+        fieldset = self.context.get('fieldset') or Fieldset(self.spec)
+        keys = fieldset.keys(self.spec)
+        return {name: field for name, field in fields.items() if name in keys}
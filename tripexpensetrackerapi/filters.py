@@ -0,0 +1,96 @@
+"""Server-side filtering and ordering for the expense list.
+
+Query params: userId, tripId, dateFrom and dateTo (inclusive ISO dates),
+categoryId (one or more comma-separated ids; an expense matches if it has
+any of them), currency, minAmount and maxAmount (inclusive), and ordering,
+one of ORDERINGS. Amounts in different currencies cannot be compared
+without converting them, which no index could serve, so minAmount,
+maxAmount and the amount orderings apply within one currency: `currency`,
+or the home currency without one, and only expenses in it are listed.
+Every ordering ends in `id`, in the same direction, so keyset pagination
+has a unique position.
+
+Each filter is backed by an index (see the Expense and ExpenseCategory
+models); `bench_expense_filters` checks the query plan of every combination.
+"""
+from datetime import date
+from tripexpensetrackerapi.models import ExpenseCategory
+from tripexpensetrackerapi.money import home_currency, parse_currency, to_minor
+
+ORDERINGS = {
+    'date': ('date', 'id'),
+    '-date': ('-date', '-id'),
+    'amount': ('amount_minor', 'id'),
+    '-amount': ('-amount_minor', '-id'),
+}
+AMOUNT_ORDERINGS = ('amount', '-amount')
+
+
+class InvalidFilter(Exception):
+    """Raised when a filter or ordering parameter has a value that cannot be used."""
+
+
+def parse(params, name, convert):
+    value = params.get(name)
+    if value in (None, ''):
+        return None
+    try:
+        return convert(value)
+    except ValueError as ex:
+        raise InvalidFilter(f"Invalid value for '{name}': {value}") from ex
+
+
+def parse_ids(value):
+    return [int(pk) for pk in value.split(',') if pk.strip()]
+
+
+def filter_expenses(expenses, params):
+    """Apply the filters in `params` (the request's query params) to the `expenses` queryset."""
+    user_id = parse(params, 'userId', int)
+    if user_id is not None:
+        expenses = expenses.filter(user_id=user_id)
+    trip_id = parse(params, 'tripId', int)
+    if trip_id is not None:
+        expenses = expenses.filter(trip_id=trip_id)
+
+    date_from = parse(params, 'dateFrom', date.fromisoformat)
+    if date_from is not None:
+        expenses = expenses.filter(date__gte=date_from)
+    date_to = parse(params, 'dateTo', date.fromisoformat)
+    if date_to is not None:
+        expenses = expenses.filter(date__lte=date_to)
+
+    category_ids = parse(params, 'categoryId', parse_ids)
+    if category_ids:
+        # A subquery rather than a join, so an expense in several of the categories is listed once
+        expenses = expenses.filter(
+            id__in=ExpenseCategory.objects.filter(category_id__in=category_ids).values('expense_id')
+        )
+
+    currency = parse(params, 'currency', parse_currency)
+    if currency is None and (
+        params.get('minAmount') or params.get('maxAmount') or params.get('ordering') in AMOUNT_ORDERINGS
+    ):
+        # Raw amounts of different currencies are not comparable
+        currency = home_currency()
+    if currency is not None:
+        expenses = expenses.filter(currency=currency)
+
+    def parse_amount(value):
+        return to_minor(value, currency)
+
+    min_amount = parse(params, 'minAmount', parse_amount)
+    if min_amount is not None:
+        expenses = expenses.filter(amount_minor__gte=min_amount)
+    max_amount = parse(params, 'maxAmount', parse_amount)
+    if max_amount is not None:
+        expenses = expenses.filter(amount_minor__lte=max_amount)
+    return expenses
+
+
+def expense_ordering(params):
+    """The keyset ordering requested by the `ordering` param, oldest first by default."""
+    ordering = params.get('ordering') or 'date'
+    if ordering not in ORDERINGS:
+        raise InvalidFilter(f"Invalid ordering '{ordering}', expected one of {', '.join(ORDERINGS)}")
+    return ORDERINGS[ordering]
@@ -0,0 +1,185 @@
+"""Conversion of expense amounts to the home currency, in integer arithmetic.
+
+An FxRate gives the value of one minor unit of a currency in minor units of
+settings.HOME_CURRENCY, times RATE_SCALE, from its date until the
+currency's next rate; an expense converts at the rate in effect on its date.
+`home_value()` is that conversion as an SQL expression, the amount times the
+rate, still scaled by RATE_SCALE. Totals sum the scaled values in the
+database and `scaled_to_minor()` divides once at the end, so nothing is
+rounded per row and no Decimal is built per row. With RATE_SCALE at a
+million, sums stay within 64-bit integers up to about 9.2 trillion minor
+units of the home currency.
+
+Expenses can only be recorded in a currency that has a rate on or before
+their date (`check`), and a rate cannot be deleted while that would leave
+an expense without one (`check_deletion`, see signals.py), so the SQL
+lookup always finds one. `rates` caches
+those lookups in memory by date; like the category catalog it compares a
+version stamp in the shared Django cache first, and `rates_changed()`
+publishes a new stamp and touches the trips whose totals a rate change
+affects.
+"""
+from datetime import date
+from decimal import ROUND_HALF_UP, Decimal
+from django.db import transaction
+from django.db.models import ProtectedError
+from django.db.models import BigIntegerField, Case, Count, ExpressionWrapper, F, OuterRef, Subquery, Sum, Value, When
+from tripexpensetrackerapi.catalog import publish_stamp, read_stamp
+from tripexpensetrackerapi.lru import LRUCache
+from tripexpensetrackerapi.models import Expense, FxRate
+from tripexpensetrackerapi.money import InvalidAmount, exponent, format_amount, home_currency
+from tripexpensetrackerapi.timestamps import touch_trips
+
+RATE_SCALE = 10 ** 6
+VERSION_KEY = 'fx-rates-version'
+
+# Cached for dates without a rate, to tell them apart from dates not looked up yet
+NO_RATE = object()
+
+
+class MissingRate(InvalidAmount):
+    """Raised for an expense in a currency with no exchange rate on or before its date."""
+
+
+class RateInUse(ProtectedError):
+    """Raised when deleting a rate would leave expenses with no rate on or before their date."""
+
+
+def parse_day(day):
+    if isinstance(day, date):
+        return day
+    try:
+        return date.fromisoformat(str(day))
+    except ValueError as ex:
+        raise InvalidAmount(f"Invalid date '{day}'") from ex
+
+
+class RateCache:
+    """Rates by (currency, date), dropped whenever the shared version stamp changes."""
+
+    def __init__(self, max_size=10000):
+        self._rates = LRUCache(max_size=max_size)
+
+    def rate(self, currency, day):
+        """The rate in effect for `currency` on `day`, or None if it has none yet."""
+        if currency == home_currency():
+            return RATE_SCALE
+        day = parse_day(day)
+        # Entries of older versions are never looked up again and age out
+        key = (read_stamp(VERSION_KEY), currency, day)
+        rate = self._rates.get(key)
+        if rate is None:
+            rate = (
+                FxRate.objects.filter(currency=currency, date__lte=day).order_by('-date')
+                .values_list('rate', flat=True).first()
+            )
+            self._rates.set(key, NO_RATE if rate is None else rate)
+        return None if rate is NO_RATE else rate
+
+    def invalidate(self):
+        """Publish a new version stamp so every process looks its rates up again."""
+        publish_stamp(VERSION_KEY)
+        self._rates.clear()
+
+
+rates = RateCache()
+
+
+def check(currency, day):
+    """Raise MissingRate unless an expense in `currency` dated `day` can be converted."""
+    if rates.rate(currency, day) is None:
+        raise MissingRate(f'No exchange rate for {currency} on or before {day}')
+
+
+def check_deletion(currency, day):
+    """Raise RateInUse if, with `currency`'s rate from `day` deleted, some of its expenses have no rate to convert at.
+
+    Only expenses dated from `day` until the currency's first remaining rate
+    can be affected.
+    """
+    if currency == home_currency():
+        return
+    stranded = Expense.objects.filter(currency=currency, date__gte=day)
+    first = FxRate.objects.filter(currency=currency).order_by('date').values_list('date', flat=True).first()
+    if first is not None:
+        stranded = stranded.filter(date__lt=first)
+    stranded = list(stranded.order_by('date')[:10])
+    if stranded:
+        raise RateInUse(
+            f'Cannot delete the {currency} rate of {day}: expenses from {stranded[0].date} on would have no rate',
+            stranded,
+        )
+
+
+def scaled_rate(rate, currency):
+    """The FxRate.rate for `rate`, the price of one `currency` in the home currency."""
+    scaled = Decimal(str(rate)).scaleb(exponent(home_currency()) - exponent(currency)) * RATE_SCALE
+    return int(scaled.quantize(Decimal(1), rounding=ROUND_HALF_UP))
+
+
+def convert(amount_minor, currency, day):
+    """An amount in `currency` dated `day` in minor units of the home currency."""
+    rate = rates.rate(currency, day)
+    if rate is None:
+        raise MissingRate(f'No exchange rate for {currency} on or before {day}')
+    return scaled_to_minor(amount_minor * rate)
+
+
+def scaled_to_minor(value):
+    """A home_value(), or a sum of them, in minor units of the home currency, rounded half away from zero."""
+    if value is None:
+        return None
+    minor, remainder = divmod(abs(value), RATE_SCALE)
+    minor += remainder * 2 >= RATE_SCALE
+    return minor if value >= 0 else -minor
+
+
+def format_home(value):
+    """Render a home_value() sum as a home currency amount."""
+    return format_amount(scaled_to_minor(value), home_currency())
+
+
+def home_value(prefix=''):
+    """SQL for an expense's amount in minor units of the home currency, times RATE_SCALE.
+
+    `prefix` is the path from the query's model to the expense, e.g. 'expense__'.
+    """
+    rate = (
+        FxRate.objects.filter(currency=OuterRef(f'{prefix}currency'), date__lte=OuterRef(f'{prefix}date'))
+        .order_by('-date')
+        .values('rate')[:1]
+    )
+    return ExpressionWrapper(
+        F(f'{prefix}amount_minor') * Case(
+            # Home currency amounts skip the lookup
+            When(**{f'{prefix}currency': home_currency()}, then=Value(RATE_SCALE)),
+            default=Subquery(rate),
+            output_field=BigIntegerField(),
+        ),
+        output_field=BigIntegerField(),
+    )
+
+
+def totals(expenses):
+    """The home currency total of the `expenses` queryset and its totals per currency, with one query.
+
+    Returns (home total in minor units, expense count, [(currency, total in
+    its minor units, count), ...] ordered by currency).
+    """
+    rows = list(
+        expenses.order_by('currency').values('currency')
+        .annotate(total=Sum('amount_minor'), home=Sum(home_value()), count=Count('id'))
+    )
+    home = scaled_to_minor(sum(row['home'] for row in rows))
+    return home, sum(row['count'] for row in rows), [(row['currency'], row['total'], row['count']) for row in rows]
+
+
+def rates_changed(currency, since):
+    """Drop every process's cached rates and touch the trips with `currency` expenses dated on or after `since`."""
+    rates.invalidate()
+    transaction.on_commit(rates.invalidate)
+    trips = dict(
+        Expense.objects.filter(currency=currency, date__gte=since, trip__isnull=False)
+        .values_list('trip_id', 'trip__user_id').distinct()
+    )
+    touch_trips(trips.keys(), trips.values())
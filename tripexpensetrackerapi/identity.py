@@ -0,0 +1,82 @@
+"""In-process identity cache for users, keyed by uid and by id.
+
+`check_user` runs on every app launch and expense and trip writes look up
+their owner, so users are cached in bounded LRU maps with a TTL. Entries are
+dropped whenever a user is saved or deleted in this process (see signals.py);
+the TTL bounds how long other worker processes can serve a stale copy.
+
+Callers get a fresh `User` instance built from the cached field values, so a
+cached user is never shared between requests.
+"""
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS
+from tripexpensetrackerapi.lru import LRUCache
+from tripexpensetrackerapi.models import User
+
+FIELDS = ('id', 'name', 'uid')
+
+by_id = LRUCache(
+    getattr(settings, 'IDENTITY_CACHE_MAX_SIZE', 10000),
+    getattr(settings, 'IDENTITY_CACHE_TTL', 300),
+)
+by_uid = LRUCache(
+    getattr(settings, 'IDENTITY_CACHE_MAX_SIZE', 10000),
+    getattr(settings, 'IDENTITY_CACHE_TTL', 300),
+)
+
+
+def remember(user):
+    values = tuple(getattr(user, field) for field in FIELDS)
+    by_id.set(user.id, values)
+    by_uid.set(user.uid, values)
+
+
+def build(values):
+    return User.from_db(DEFAULT_DB_ALIAS, FIELDS, values)
+
+
+def get_user(pk):
+    """Return the user with primary key `pk`, raising User.DoesNotExist if there is none."""
+    pk = int(pk)
+    values = by_id.get(pk)
+    if values is None:
+        user = User.objects.get(pk=pk)
+        remember(user)
+        return user
+    return build(values)
+
+
+def find_user_by_uid(uid):
+    """Return the user with this uid, or None."""
+    values = by_uid.get(uid)
+    if values is None:
+        user = User.objects.filter(uid=uid).first()
+        if user is not None:
+            remember(user)
+        return user
+    return build(values)
+
+
+async def afind_user_by_uid(uid):
+    """find_user_by_uid() for async views."""
+    values = by_uid.get(uid)
+    if values is None:
+        user = await User.objects.filter(uid=uid).afirst()
+        if user is not None:
+            remember(user)
+        return user
+    return build(values)
+
+
+def forget_user(user):
+    """Drop a user from the cache under both its current and its cached uid."""
+    cached = by_id.get(user.id)
+    if cached is not None:
+        by_uid.delete(cached[FIELDS.index('uid')])
+    by_id.delete(user.id)
+    by_uid.delete(user.uid)
+
+
+def clear():
+    by_id.clear()
+    by_uid.clear()
@@ -0,0 +1,60 @@
+import threading
+import time
+from collections import OrderedDict
+
+
+class LRUCache:
+    """A thread-safe mapping bounded to `max_size` entries, each expiring after `ttl` seconds.
+
+    The least recently used entry is evicted when the cache is full. A `ttl`
+    of None keeps entries until they are evicted or deleted. Entries set with
+    a `cost` count as that many entries, so `max_size` can budget values of
+    very different sizes.
+    """
+
+    def __init__(self, max_size, ttl=None):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.evictions = 0
+        self.total_cost = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return default
+            value, expires, cost = entry
+            if expires is not None and expires <= time.monotonic():
+                del self._entries[key]
+                self.total_cost -= cost
+                return default
+            self._entries.move_to_end(key)
+            return value
+
+    def set(self, key, value, cost=1):
+        expires = time.monotonic() + self.ttl if self.ttl is not None else None
+        with self._lock:
+            replaced = self._entries.pop(key, None)
+            if replaced is not None:
+                self.total_cost -= replaced[2]
+            self._entries[key] = (value, expires, cost)
+            self.total_cost += cost
+            while self.total_cost > self.max_size and self._entries:
+                self.total_cost -= self._entries.popitem(last=False)[1][2]
+                self.evictions += 1
+
+    def delete(self, key):
+        with self._lock:
+            entry = self._entries.pop(key, None)
+            if entry is not None:
+                self.total_cost -= entry[2]
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.total_cost = 0
+
+    def __len__(self):
+        return len(self._entries)
@@ -0,0 +1,403 @@
+"""Benchmark cases for bench_api, one per route and method in tripexpensetracker/urls.py.
+
+A case is a function of (data, i), where `data` is the sample of seeded rows
+loaded by `load_data` and `i` numbers the request. It returns the Call to
+make; anything it creates first, and the Call's cleanup after the response,
+is not measured. Cases only write rows they created themselves, or write
+seeded rows back with the values they already have, so a run leaves the
+seeded dataset as it found it.
+"""
+from datetime import date
+from tripexpensetrackerapi.management.commands.seed_bench import CATEGORY_PREFIX, UID_PREFIX
+from tripexpensetrackerapi.models import User, Trip, Expense, Category, ExpenseCategory
+from tripexpensetrackerapi.money import format_amount
+
+# Seeded rows each case picks from, in turn
+SAMPLE_SIZE = 200
+BULK_SIZE = 10
+BENCH_NAME = 'Bench API'
+
+# Routes the runner cannot drive, with the reason
+UNCOVERED = {
+    ('trip-remove-trip-expense', 'DELETE'):
+        'the router route has no expense id; trip-remove-expense serves this action',
+}
+
+CASES = {}
+
+
+class Call:
+    """One request: `expect` lists the statuses that count as success."""
+
+    def __init__(self, method, path, data=None, expect=(200,), cleanup=None):
+        self.method = method
+        self.path = path
+        self.data = data
+        self.expect = expect
+        self.cleanup = cleanup
+
+
+def case(route, method):
+    """Register the decorated function as the case for `route` (a URL name) and `method`."""
+    def register(func):
+        CASES[func.__name__] = (route, method, func)
+        return func
+    return register
+
+
+def load_data():
+    """A picklable sample of the seeded rows, or None if nothing has been seeded."""
+    users = list(User.objects.filter(uid__startswith=UID_PREFIX).order_by('id').values('id', 'uid', 'name')[:50])
+    if not users:
+        return None
+    user_ids = [user['id'] for user in users]
+    trips = list(
+        Trip.objects.filter(user_id__in=user_ids).order_by('id')
+        .values('id', 'user_id', 'name', 'date', 'description')[:SAMPLE_SIZE]
+    )
+    expenses = list(
+        Expense.objects.filter(user_id__in=user_ids, trip__isnull=False).order_by('id')
+        .values('id', 'user_id', 'trip_id', 'name', 'amount_minor', 'currency', 'description', 'date')[:SAMPLE_SIZE]
+    )
+    links = {}
+    for expense_id, category_id in ExpenseCategory.objects.filter(
+        expense_id__in=[expense['id'] for expense in expenses]
+    ).order_by('id').values_list('expense_id', 'category_id'):
+        links.setdefault(expense_id, []).append(category_id)
+    for expense in expenses:
+        expense['categories'] = links.get(expense['id'], [])
+    return {
+        'users': users,
+        'trips': trips,
+        'expenses': expenses,
+        'categories': list(
+            Category.objects.filter(name__startswith=CATEGORY_PREFIX).order_by('id').values('id', 'name')
+        ),
+        'expense_categories': list(
+            ExpenseCategory.objects.filter(expense_id__in=[expense['id'] for expense in expenses])
+            .order_by('id').values_list('id', flat=True)
+        ),
+    }
+
+
+def pick(items, i):
+    return items[i % len(items)]
+
+
+def expense_payload(expense):
+    """The create/update payload that writes `expense` back unchanged."""
+    return {
+        'user': expense['user_id'],
+        'trip': expense['trip_id'],
+        'name': expense['name'],
+        'amount': format_amount(expense['amount_minor'], expense['currency']),
+        'currency': expense['currency'],
+        'description': expense['description'],
+        'date': expense['date'].isoformat(),
+        'categories': expense['categories'],
+    }
+
+
+def new_expense_payload(data, i):
+    trip = pick(data['trips'], i)
+    return {
+        'user': trip['user_id'],
+        'name': BENCH_NAME,
+        'amount': '12.50',
+        'description': BENCH_NAME,
+        'date': trip['date'].isoformat(),
+        'categories': [pick(data['categories'], i)['id']],
+    }
+
+
+def create_expense(data, i, on_trip=False):
+    trip = pick(data['trips'], i)
+    return Expense.objects.create(
+        user_id=trip['user_id'], trip_id=trip['id'] if on_trip else None, name=BENCH_NAME, amount_minor=1250,
+        description=BENCH_NAME, date=trip['date'],
+    )
+
+
+def delete_expenses(ids):
+    Expense.objects.filter(pk__in=ids).delete()
+
+
+def created_id(response):
+    return response.json()['id']
+
+
+# USERS
+
+@case('api-root', 'GET')
+def api_root(data, i):
+    return Call('GET', '/')
+
+
+@case('user-list', 'GET')
+def user_list(data, i):
+    return Call('GET', '/users')
+
+
+@case('user-detail', 'GET')
+def user_detail(data, i):
+    return Call('GET', f"/users/{pick(data['users'], i)['id']}")
+
+
+@case('check-user', 'POST')
+def check_user(data, i):
+    return Call('POST', '/checkuser', {'uid': pick(data['users'], i)['uid']})
+
+
+@case('register-user', 'POST')
+def register_user(data, i):
+    # An existing uid, so registering returns the user without creating one
+    user = pick(data['users'], i)
+    return Call('POST', '/register', {'uid': user['uid'], 'name': user['name']})
+
+
+@case('user-totals', 'GET')
+def user_totals(data, i):
+    return Call('GET', f"/users/{pick(data['users'], i)['id']}/totals")
+
+
+@case('user-dashboard', 'GET')
+def user_dashboard(data, i):
+    return Call('GET', f"/users/{pick(data['users'], i)['id']}/dashboard", {'months': 24})
+
+
+@case('user-analytics', 'GET')
+def user_analytics(data, i):
+    return Call('GET', f"/users/{pick(data['users'], i)['id']}/analytics")
+
+
+# TRIPS
+
+@case('trip-list', 'GET')
+def trip_list(data, i):
+    return Call('GET', '/trips', {'userId': pick(data['users'], i)['id']})
+
+
+@case('trip-list', 'POST')
+def trip_create(data, i):
+    payload = {
+        'userId': pick(data['users'], i)['id'], 'name': BENCH_NAME, 'date': '2024-01-01', 'description': BENCH_NAME,
+    }
+    return Call(
+        'POST', '/trips', payload, expect=(201,),
+        cleanup=lambda response: Trip.objects.filter(pk=created_id(response)).delete(),
+    )
+
+
+@case('trip-detail', 'GET')
+def trip_detail(data, i):
+    return Call('GET', f"/trips/{pick(data['trips'], i)['id']}")
+
+
+@case('trip-detail', 'PUT')
+def trip_update(data, i):
+    trip = pick(data['trips'], i)
+    payload = {'name': trip['name'], 'date': trip['date'].isoformat(), 'description': trip['description']}
+    return Call('PUT', f"/trips/{trip['id']}", payload, expect=(204,))
+
+
+@case('trip-detail', 'DELETE')
+def trip_delete(data, i):
+    trip = Trip.objects.create(user_id=pick(data['users'], i)['id'], name=BENCH_NAME, date=date(2024, 1, 1))
+    return Call('DELETE', f'/trips/{trip.id}', expect=(204,))
+
+
+@case('trip-summary', 'GET')
+def trip_summary(data, i):
+    return Call('GET', f"/trips/{pick(data['trips'], i)['id']}/summary")
+
+
+@case('trip-add-trip-expense', 'POST')
+def trip_add_trip_expense(data, i):
+    expense = create_expense(data, i)
+    return Call(
+        'POST', f"/trips/{pick(data['trips'], i)['id']}/add_trip_expense", {'expense': expense.id}, expect=(201,),
+        cleanup=lambda response: delete_expenses([expense.id]),
+    )
+
+
+@case('trip-add-expense', 'POST')
+def trip_add_expense(data, i):
+    expense = create_expense(data, i)
+    return Call(
+        'POST', f"/trips/{pick(data['trips'], i)['id']}/add_expense", {'expense': expense.id}, expect=(201,),
+        cleanup=lambda response: delete_expenses([expense.id]),
+    )
+
+
+@case('trip-remove-expense', 'DELETE')
+def trip_remove_expense(data, i):
+    expense = create_expense(data, i, on_trip=True)
+    return Call(
+        'DELETE', f'/trips/{expense.trip_id}/remove_trip_expense/{expense.id}', expect=(204,),
+        cleanup=lambda response: delete_expenses([expense.id]),
+    )
+
+
+# EXPENSES
+
+@case('expense-list', 'GET')
+def expense_list(data, i):
+    return Call('GET', '/expenses', {'userId': pick(data['users'], i)['id'], 'ordering': '-date'})
+
+
+@case('expense-list', 'POST')
+def expense_create(data, i):
+    return Call(
+        'POST', '/expenses', new_expense_payload(data, i), expect=(201,),
+        cleanup=lambda response: delete_expenses([created_id(response)]),
+    )
+
+
+@case('expense-detail', 'GET')
+def expense_detail(data, i):
+    return Call('GET', f"/expenses/{pick(data['expenses'], i)['id']}")
+
+
+@case('expense-detail', 'PUT')
+def expense_update(data, i):
+    expense = pick(data['expenses'], i)
+    return Call('PUT', f"/expenses/{expense['id']}", expense_payload(expense), expect=(204,))
+
+
+@case('expense-detail', 'DELETE')
+def expense_delete(data, i):
+    return Call('DELETE', f'/expenses/{create_expense(data, i).id}', expect=(204,))
+
+
+@case('expense-bulk', 'POST')
+def expense_bulk_create(data, i):
+    payload = [new_expense_payload(data, i + offset) for offset in range(BULK_SIZE)]
+    return Call(
+        'POST', '/expenses/bulk', payload, expect=(201,),
+        cleanup=lambda response: delete_expenses([expense['id'] for expense in response.json()]),
+    )
+
+
+@case('expense-bulk', 'PUT')
+def expense_bulk_update(data, i):
+    expenses = [pick(data['expenses'], i * BULK_SIZE + offset) for offset in range(BULK_SIZE)]
+    payload = [{'id': expense['id'], **expense_payload(expense)} for expense in expenses]
+    return Call('PUT', '/expenses/bulk', payload, expect=(204,))
+
+
+@case('expense-bulk', 'DELETE')
+def expense_bulk_delete(data, i):
+    ids = [create_expense(data, i + offset).id for offset in range(BULK_SIZE)]
+    return Call('DELETE', '/expenses/bulk', ids, expect=(204,))
+
+
+@case('expense-suggest', 'GET')
+def expense_suggest(data, i):
+    expense = pick(data['expenses'], i)
+    return Call('GET', '/expenses/suggest', {'userId': expense['user_id'], 'q': expense['name'][:2]})
+
+
+@case('expense-search', 'GET')
+def expense_search(data, i):
+    expense = pick(data['expenses'], i)
+    return Call('GET', '/expenses/search', {'userId': expense['user_id'], 'q': expense['name'].split()[0]})
+
+
+@case('expense-export', 'GET')
+def expense_export(data, i):
+    return Call('GET', '/expenses/export', {'tripId': pick(data['trips'], i)['id']})
+
+
+@case('expense-add-expense-category', 'POST')
+def expense_add_expense_category(data, i):
+    expense = create_expense(data, i)
+    return Call(
+        'POST', f'/expenses/{expense.id}/add_expense_category', {'category': pick(data['categories'], i)['id']},
+        expect=(201,), cleanup=lambda response: delete_expenses([expense.id]),
+    )
+
+
+@case('expense-remove-expense-category', 'DELETE')
+def expense_remove_expense_category(data, i):
+    expense = create_expense(data, i)
+    link = ExpenseCategory.objects.create(expense=expense, category_id=pick(data['categories'], i)['id'])
+    return Call(
+        'DELETE', f'/expenses/{expense.id}/remove_expense_category/{link.id}', expect=(204,),
+        cleanup=lambda response: delete_expenses([expense.id]),
+    )
+
+
+# EXPENSE CATEGORIES
+
+@case('expensecategory-list', 'GET')
+def expense_category_list(data, i):
+    return Call('GET', '/expensecategories')
+
+
+@case('expensecategory-list', 'POST')
+def expense_category_create(data, i):
+    expense = create_expense(data, i)
+    return Call(
+        'POST', '/expensecategories', {'expense': expense.id, 'category': pick(data['categories'], i)['id']},
+        expect=(201,), cleanup=lambda response: delete_expenses([expense.id]),
+    )
+
+
+@case('expensecategory-detail', 'GET')
+def expense_category_detail(data, i):
+    return Call('GET', f"/expensecategories/{pick(data['expense_categories'], i)}")
+
+
+@case('expensecategory-detail', 'PUT')
+def expense_category_update(data, i):
+    # Expense categories cannot be changed, so this measures the refusal
+    return Call('PUT', f"/expensecategories/{pick(data['expense_categories'], i)}", {}, expect=(400,))
+
+
+@case('expensecategory-detail', 'DELETE')
+def expense_category_delete(data, i):
+    expense = create_expense(data, i)
+    link = ExpenseCategory.objects.create(expense=expense, category_id=pick(data['categories'], i)['id'])
+    return Call(
+        'DELETE', f'/expensecategories/{link.id}', expect=(204,),
+        cleanup=lambda response: delete_expenses([expense.id]),
+    )
+
+
+# CATEGORIES
+
+@case('category-list', 'GET')
+def category_list(data, i):
+    return Call('GET', '/categories')
+
+
+@case('category-list', 'POST')
+def category_create(data, i):
+    return Call(
+        'POST', '/categories', {'name': f'{BENCH_NAME} {i}'}, expect=(201,),
+        cleanup=lambda response: Category.objects.get(pk=created_id(response)).delete(),
+    )
+
+
+@case('category-detail', 'GET')
+def category_detail(data, i):
+    return Call('GET', f"/categories/{pick(data['categories'], i)['id']}")
+
+
+@case('category-detail', 'PUT')
+def category_update(data, i):
+    category = pick(data['categories'], i)
+    return Call('PUT', f"/categories/{category['id']}", {'name': category['name']}, expect=(204,))
+
+
+@case('category-detail', 'DELETE')
+def category_delete(data, i):
+    category = Category.objects.create(name=f'{BENCH_NAME} {i}')
+    return Call('DELETE', f'/categories/{category.id}', expect=(204,))
+
+
+# METRICS
+
+@case('metrics', 'GET')
+def metrics(data, i):
+    return Call('GET', '/metrics')
@@ -0,0 +1,73 @@
+"""Helpers shared by the bench_* management commands."""
+import random
+import statistics
+import time
+from contextlib import contextmanager
+from datetime import date, timedelta
+from django.db import connection, transaction
+from django.test import Client
+from django.test.utils import CaptureQueriesContext, override_settings
+from tripexpensetrackerapi.models import User, Trip, Expense, Category, ExpenseCategory
+
+BATCH_SIZE = 5000
+
+
+@contextmanager
+def rolled_back():
+    """Run the block inside a transaction that is always rolled back."""
+    with transaction.atomic():
+        yield
+        transaction.set_rollback(True)
+
+
+def bench_client():
+    """An in-process client for driving the API without a test runner."""
+    return Client(SERVER_NAME='localhost')
+
+
+def allow_bench_client():
+    """Settings override letting `bench_client()` requests through host checks."""
+    return override_settings(ALLOWED_HOSTS=['localhost'])
+
+
+def seed_trip(user, expense_count, categories, rng=None, start=date(2024, 1, 1)):
+    """Create a trip with `expense_count` expenses, each in one to three random categories."""
+    rng = rng or random.Random(0)
+    trip = Trip.objects.create(user=user, name='Bench trip', date=start, description='Benchmark data')
+    for offset in range(0, expense_count, BATCH_SIZE):
+        expenses = Expense.objects.bulk_create(
+            Expense(
+                user=user,
+                trip=trip,
+                name=f'Expense {offset + i}',
+                amount=f'{rng.uniform(1, 500):.2f}',
+                description='Benchmark expense',
+                date=start + timedelta(days=rng.randrange(30)),
+            )
+            for i in range(min(BATCH_SIZE, expense_count - offset))
+        )
+        ExpenseCategory.objects.bulk_create(
+            ExpenseCategory(expense=expense, category=category)
+            for expense in expenses
+            for category in rng.sample(categories, rng.randint(1, min(3, len(categories))))
+        )
+    return trip
+
+
+def seed_basics(category_count=8):
+    """Create a bench user and a set of categories."""
+    user = User.objects.create(name='Bench user', uid=f'bench-{time.time_ns()}')
+    categories = [Category.objects.create(name=f'Bench category {i}') for i in range(category_count)]
+    return user, categories
+
+
+def measure(func, repeat):
+    """Call `func` `repeat` times, returning (median seconds, queries per call, last result)."""
+    timings = []
+    result = None
+    with CaptureQueriesContext(connection) as queries:
+        for _ in range(repeat):
+            started = time.perf_counter()
+            result = func()
+            timings.append(time.perf_counter() - started)
+    return statistics.median(timings), len(queries) // repeat, result
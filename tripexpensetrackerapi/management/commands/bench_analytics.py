@@ -0,0 +1,93 @@
+import random
+from datetime import date, timedelta
+from django.core.management.base import BaseCommand, CommandError
+from django.db import reset_queries
+from tripexpensetrackerapi import analytics, fx
+from tripexpensetrackerapi.management.commands._bench import BATCH_SIZE, measure, rolled_back, seed_basics
+from tripexpensetrackerapi.models import Expense, ExpenseCategory, FxRate
+from tripexpensetrackerapi.money import home_currency
+
+START = date(2024, 1, 1)
+DAYS = 365
+# A share of the expenses is in a foreign currency, so loading converts them
+FOREIGN = 'EUR'
+FOREIGN_SHARE = 0.2
+TARGET_MS = 100
+
+
+class Command(BaseCommand):
+    help = (
+        'Time loading a user\'s expenses into NumPy columns, which is linear in their number, and computing a '
+        'request\'s analytics (percentiles per category, daily trend and anomalies) from loaded columns, which '
+        f'should stay under {TARGET_MS} ms. Seeded data is rolled back.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sizes', default='10000,100000,1000000', help='Comma-separated expense counts')
+        parser.add_argument('--repeat', type=int, default=5, help='Computations per measurement')
+
+    def handle(self, *args, **options):
+        try:
+            sizes = sorted(int(size) for size in options['sizes'].split(','))
+        except ValueError as ex:
+            raise CommandError('--sizes must be comma-separated whole numbers') from ex
+        self.stdout.write(
+            f"{'expenses':>10} {'load ms':>10} {'load ms/100k':>13} {'compute ms':>11} {'queries':>8}"
+        )
+        rng = random.Random(0)
+        with rolled_back():
+            user, categories = seed_basics()
+            self.seed_rates(rng)
+            seeded = 0
+            for size in sizes:
+                self.seed(rng, user, categories, seeded, size)
+                seeded = size
+                # Seeding can fill the query log, which would leave no room to count the load's queries
+                reset_queries()
+                load_seconds, queries, data = measure(lambda: analytics.load(user.id), 1)
+                seconds, _, _ = measure(lambda: self.compute(data), options['repeat'])
+                self.stdout.write(
+                    f'{size:>10} {load_seconds * 1000:>10.1f} {load_seconds * 1e8 / size:>13.1f} '
+                    f'{seconds * 1000:>11.3f} {queries:>8}'
+                )
+            if seconds * 1000 > TARGET_MS:
+                self.stdout.write(f'Computing {seeded} expenses took more than {TARGET_MS} ms')
+        # Neither cache is rolled back with the rates
+        fx.rates.invalidate()
+        analytics.clear()
+
+    def compute(self, data):
+        analytics.percentiles(data, analytics.DEFAULT_PERCENTILES)
+        analytics.trend(data, START + timedelta(days=DAYS - 1), analytics.DEFAULT_DAYS, analytics.DEFAULT_WINDOW)
+        analytics.anomalies(data, analytics.DEFAULT_ANOMALIES)
+
+    def seed_rates(self, rng):
+        # Overwrites any existing rates of those days until the rollback
+        FxRate.objects.bulk_create(
+            (
+                FxRate(currency=FOREIGN, date=START + timedelta(days=day),
+                       rate=fx.scaled_rate(f'{1.08 * rng.uniform(0.97, 1.03):.6f}', FOREIGN))
+                for day in range(DAYS)
+            ),
+            update_conflicts=True, unique_fields=['currency', 'date'], update_fields=['rate'],
+        )
+
+    def seed(self, rng, user, categories, start, end):
+        for offset in range(start, end, BATCH_SIZE):
+            expenses = Expense.objects.bulk_create(
+                Expense(
+                    user=user,
+                    name='Analytics expense',
+                    currency=FOREIGN if rng.random() < FOREIGN_SHARE else home_currency(),
+                    # Log-normal, like real spending, with the odd very large expense
+                    amount_minor=int(rng.lognormvariate(7, 1)) + 1,
+                    description='Benchmark expense',
+                    date=START + timedelta(days=rng.randrange(DAYS)),
+                )
+                for _ in range(min(BATCH_SIZE, end - offset))
+            )
+            ExpenseCategory.objects.bulk_create(
+                ExpenseCategory(expense=expense, category=category)
+                for expense in expenses
+                for category in rng.sample(categories, rng.randint(1, 2))
+            )
@@ -0,0 +1,294 @@
+import json
+import logging
+import multiprocessing
+import platform
+import re
+import resource
+import statistics
+import sys
+import time
+from datetime import datetime, timezone
+import django
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, connections
+from django.test.utils import override_settings
+from django.urls import URLResolver, get_resolver
+from tripexpensetrackerapi.management.commands._api_cases import CASES, UNCOVERED, load_data
+from tripexpensetrackerapi.management.commands._bench import allow_bench_client, bench_client
+from tripexpensetrackerapi.models import User, Trip, Expense
+
+SERVER_TIMING_QUERIES = re.compile(r'desc="(\d+) queries"')
+METHODS = ('get', 'post', 'put', 'patch', 'delete')
+
+# Sample of seeded rows, set in each worker process before it runs any case
+_worker_data = None
+
+
+def url_routes(patterns=None):
+    """(URL name, method) for every named route in the URLconf except the admin's."""
+    found = set()
+    for pattern in get_resolver().url_patterns if patterns is None else patterns:
+        if isinstance(pattern, URLResolver):
+            if pattern.app_name != 'admin':
+                found |= url_routes(pattern.url_patterns)
+            continue
+        if not pattern.name:
+            continue
+        actions = getattr(pattern.callback, 'actions', None)
+        cls = getattr(pattern.callback, 'cls', None)
+        if actions:
+            # Serving a GET adds `head` to a ViewSet's actions
+            methods = [method for method in actions if method in METHODS]
+        elif cls is not None:
+            methods = [method for method in METHODS if hasattr(cls, method)]
+        else:
+            methods = ['get']
+        found |= {(pattern.name, method.upper()) for method in methods}
+    return found
+
+
+def peak_rss_mb():
+    """This process's peak resident set size so far, in MB."""
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports kilobytes, macOS bytes
+    return peak / (1024 * 1024 if sys.platform == 'darwin' else 1024)
+
+
+def send(client, call):
+    if call.method == 'GET':
+        response = client.get(call.path, call.data or {})
+    else:
+        body = json.dumps(call.data) if call.data is not None else ''
+        response = client.generic(call.method, call.path, body, content_type='application/json')
+    if response.streaming:
+        # A streamed export does its work as it is consumed
+        b''.join(response.streaming_content)
+    return response
+
+
+def run_requests(name, count, offset, warmup, data=None):
+    """Make `warmup` unmeasured then `count` measured requests of case `name`.
+
+    Returns (latencies in seconds, queries per request, errors, peak RSS in MB).
+    """
+    data = data or _worker_data
+    func = CASES[name][2]
+    client = bench_client()
+    latencies = []
+    queries = []
+    errors = 0
+    for n in range(warmup + count):
+        # With several processes writing, SQLite can refuse a setup, request or cleanup as locked
+        try:
+            call = func(data, offset + n)
+            started = time.perf_counter()
+            response = send(client, call)
+            elapsed = time.perf_counter() - started
+            if call.cleanup and response.status_code in call.expect:
+                call.cleanup(response)
+        except Exception:
+            errors += n >= warmup
+            continue
+        if n < warmup:
+            continue
+        if response.status_code not in call.expect:
+            errors += 1
+            continue
+        latencies.append(elapsed)
+        match = SERVER_TIMING_QUERIES.search(response.get('Server-Timing', ''))
+        if match:
+            queries.append(int(match.group(1)))
+    return latencies, queries, errors, peak_rss_mb()
+
+
+def start_worker(data):
+    global _worker_data
+    _worker_data = data
+
+
+def percentile(sorted_values, fraction):
+    """The `fraction` percentile of `sorted_values`, interpolating between neighbours."""
+    position = (len(sorted_values) - 1) * fraction
+    low = int(position)
+    high = min(low + 1, len(sorted_values) - 1)
+    return sorted_values[low] + (sorted_values[high] - sorted_values[low]) * (position - low)
+
+
+def summarize(route, method, parts):
+    """Combine the run_requests() results of every worker into one route's figures."""
+    latencies = sorted(latency for part in parts for latency in part[0])
+    queries = [count for part in parts for count in part[1]]
+    result = {
+        'route': route,
+        'method': method,
+        'requests': len(latencies),
+        'errors': sum(part[2] for part in parts),
+        'p50_ms': None,
+        'p95_ms': None,
+        'p99_ms': None,
+        # Each worker's requests over its time spent in requests, so setups and cleanups do not count
+        'rps': round(sum(len(part[0]) / sum(part[0]) for part in parts if part[0]), 1),
+        'queries': round(statistics.mean(queries), 2) if queries else None,
+        'peak_rss_mb': round(max(part[3] for part in parts), 1),
+    }
+    if latencies:
+        for key, fraction in (('p50_ms', 0.5), ('p95_ms', 0.95), ('p99_ms', 0.99)):
+            result[key] = round(percentile(latencies, fraction) * 1000, 3)
+    return result
+
+
+def change(old, new):
+    """Percent change from `old` to `new`, or None if either is missing."""
+    if old in (None, 0) or new is None:
+        return None
+    return (new - old) / old * 100
+
+
+class Command(BaseCommand):
+    help = (
+        'Benchmark every route in the URLconf through the Django test client, in process or in parallel worker '
+        'processes, against data created by seed_bench. Reports p50/p95/p99 latency, requests/s, SQL queries per '
+        'request and peak RSS, writes the results as JSON with --output and compares them with --baseline.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requests', type=int, default=50, help='Measured requests per route')
+        parser.add_argument('--warmup', type=int, default=2, help='Unmeasured requests per route and process')
+        parser.add_argument('--processes', type=int, default=1,
+                            help='Worker processes sharing the requests (1 runs in this process)')
+        parser.add_argument('--only', help='Only run cases whose name matches this regular expression')
+        parser.add_argument('--no-response-cache', action='store_true', help='Run with the response cache off')
+        parser.add_argument('--output', help='Write the results to this JSON file')
+        parser.add_argument('--baseline', help='Compare with results saved by an earlier --output')
+        parser.add_argument('--threshold', type=float, default=10.0,
+                            help='Percent slower p95 or fewer requests/s that counts as a regression')
+        parser.add_argument('--fail-on-regression', action='store_true',
+                            help='Exit with an error if the comparison with --baseline finds a regression')
+
+    def handle(self, *args, **options):
+        data = load_data()
+        if data is None:
+            raise CommandError('No seeded data found; run `manage.py seed_bench` first')
+        baseline = self.load_baseline(options['baseline']) if options['baseline'] else None
+
+        covered = {(route, method) for route, method, _ in CASES.values()}
+        for route, method in sorted(url_routes() - covered - set(UNCOVERED)):
+            self.stderr.write(f'No benchmark case for {method} {route}')
+
+        names = [name for name in CASES if not options['only'] or re.search(options['only'], name)]
+        overrides = {'SERVER_TIMING_HEADER': True}
+        if options['no_response_cache']:
+            overrides['RESPONSE_CACHE_TIMEOUT'] = 0
+
+        routes = {}
+        self.stdout.write(
+            f"{'case':>32} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} {'req/s':>9} {'queries':>8} {'errors':>7}"
+        )
+        # Expected 4xx responses would otherwise log a warning each
+        request_logger = logging.getLogger('django.request')
+        level = request_logger.level
+        request_logger.setLevel(logging.ERROR)
+        with allow_bench_client(), override_settings(**overrides):
+            pool = self.start_pool(options['processes'], data)
+            try:
+                for name in names:
+                    routes[name] = self.run_case(name, data, pool, options)
+                    self.report(name, routes[name])
+            finally:
+                if pool is not None:
+                    pool.close()
+                    pool.join()
+                request_logger.setLevel(level)
+
+        results = {'meta': self.meta(options), 'routes': routes}
+        if options['output']:
+            with open(options['output'], 'w') as file:
+                json.dump(results, file, indent=2)
+            self.stdout.write(f"Wrote {options['output']}")
+        if baseline is not None:
+            regressions = self.compare(baseline, results, options['threshold'])
+            if regressions and options['fail_on_regression']:
+                raise CommandError(f"{len(regressions)} regression(s): {', '.join(regressions)}")
+
+    def load_baseline(self, path):
+        try:
+            with open(path) as file:
+                return json.load(file)
+        except (OSError, ValueError) as ex:
+            raise CommandError(f'Could not read baseline {path}: {ex}') from ex
+
+    def start_pool(self, processes, data):
+        if processes <= 1:
+            return None
+        if connection.vendor == 'sqlite' and connection.is_in_memory_db():
+            raise CommandError('Worker processes need a database file; run with --processes 1')
+        # Forked workers must open their own connections rather than share the parent's
+        connections.close_all()
+        return multiprocessing.get_context('fork').Pool(processes, start_worker, (data,))
+
+    def run_case(self, name, data, pool, options):
+        route, method, _ = CASES[name]
+        if pool is None:
+            parts = [run_requests(name, options['requests'], 0, options['warmup'], data)]
+        else:
+            processes = options['processes']
+            share, extra = divmod(options['requests'], processes)
+            shares = [share + (k < extra) for k in range(processes)]
+            # Each worker starts at a different offset so they pick different rows
+            offsets = [sum(shares[:k]) + k * options['warmup'] for k in range(processes)]
+            parts = pool.starmap(
+                run_requests, [(name, share, offset, options['warmup']) for share, offset in zip(shares, offsets)],
+                chunksize=1,
+            )
+            parts = [(*part[:3], max(part[3], peak_rss_mb())) for part in parts]
+        return summarize(route, method, parts)
+
+    def report(self, name, result):
+        def ms(value):
+            return f'{value:>9.2f}' if value is not None else f"{'-':>9}"
+        queries = f"{result['queries']:>8.1f}" if result['queries'] is not None else f"{'-':>8}"
+        self.stdout.write(
+            f"{name:>32} {ms(result['p50_ms'])} {ms(result['p95_ms'])} {ms(result['p99_ms'])} "
+            f"{result['rps']:>9.1f} {queries} {result['errors']:>7}"
+        )
+
+    def meta(self, options):
+        return {
+            'time': datetime.now(timezone.utc).isoformat(),
+            'requests': options['requests'],
+            'warmup': options['warmup'],
+            'processes': max(1, options['processes']),
+            'response_cache': not options['no_response_cache'],
+            'python': platform.python_version(),
+            'django': django.get_version(),
+            'dataset': {'users': User.objects.count(), 'trips': Trip.objects.count(),
+                        'expenses': Expense.objects.count()},
+            'peak_rss_mb': round(peak_rss_mb(), 1),
+        }
+
+    def compare(self, baseline, results, threshold):
+        """Print the change in each metric since `baseline`; return the names of cases that regressed."""
+        meta = baseline.get('meta', {})
+        self.stdout.write(f"\nCompared with {meta.get('time', 'baseline')}:")
+        for key in ('processes', 'requests', 'response_cache', 'dataset'):
+            if meta.get(key) != results['meta'][key]:
+                self.stderr.write(f"The baseline ran with {key} {meta.get(key)}, this run with {results['meta'][key]}")
+        self.stdout.write(f"{'case':>32} {'p50':>8} {'p95':>8} {'p99':>8} {'req/s':>8} {'queries':>12}")
+        regressions = []
+        for name, new in results['routes'].items():
+            old = baseline.get('routes', {}).get(name)
+            if old is None:
+                self.stdout.write(f'{name:>32} (not in baseline)')
+                continue
+            deltas = {key: change(old.get(key), new.get(key)) for key in ('p50_ms', 'p95_ms', 'p99_ms', 'rps')}
+            cells = ' '.join(
+                f'{delta:>+7.1f}%' if delta is not None else f"{'-':>8}" for delta in deltas.values()
+            )
+            self.stdout.write(f"{name:>32} {cells} {old.get('queries')!s:>5} -> {new.get('queries')!s:<5}")
+            if (deltas['p95_ms'] or 0) > threshold or (deltas['rps'] or 0) < -threshold or \
+                    round(new.get('queries') or 0) > round(old.get('queries') or 0) or \
+                    new['errors'] > old.get('errors', 0):
+                regressions.append(name)
+        if regressions:
+            self.stdout.write(f"Regressed: {', '.join(regressions)}")
+        return regressions
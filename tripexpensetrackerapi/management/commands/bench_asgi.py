@@ -0,0 +1,106 @@
+import asyncio
+import statistics
+import time
+from concurrent.futures import ThreadPoolExecutor
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.test import AsyncClient
+from django.test.utils import override_settings
+from tripexpensetrackerapi.management.commands._bench import (
+    bench_client, seed_basics, seed_trip,
+)
+from tripexpensetrackerapi.models import Category
+
+
+def percentile(timings, fraction):
+    timings = sorted(timings)
+    return timings[min(len(timings) - 1, int(len(timings) * fraction))]
+
+
+class Command(BaseCommand):
+    help = (
+        'Compare WSGI (sync ViewSets, one thread per concurrent client) with ASGI (async views on one event loop) '
+        'for the read endpoints, reporting requests/s and p50/p99 latency. The benchmark data is committed '
+        'so worker threads can see it, and deleted afterwards.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requests', type=int, default=200, help='Requests per endpoint and concurrency level')
+        parser.add_argument('--concurrency', type=int, nargs='+', default=[1, 10, 50],
+                            help='Concurrent clients')
+        parser.add_argument('--expenses', type=int, default=100, help='Expenses in the benchmark trip')
+        parser.add_argument('--response-cache', action='store_true',
+                            help='Leave the trip response cache on (by default every request rebuilds its response)')
+
+    def handle(self, *args, **options):
+        user, categories = seed_basics()
+        try:
+            trip = seed_trip(user, options['expenses'], categories)
+            urls = (
+                ('trip', f'/trips/{trip.id}'),
+                ('trips', f'/trips?userId={user.id}'),
+                ('expenses', '/expenses'),
+                ('categories', '/categories'),
+            )
+            cache_timeout = {} if options['response_cache'] else {'RESPONSE_CACHE_TIMEOUT': 0}
+            self.stdout.write(
+                f"{'endpoint':>10} {'clients':>8} {'server':>6} {'req/s':>9} {'p50 ms':>9} {'p99 ms':>9}"
+            )
+            # AsyncClient sends Host: testserver
+            with override_settings(ALLOWED_HOSTS=['localhost', 'testserver'], **cache_timeout):
+                for name, url in urls:
+                    for concurrency in options['concurrency']:
+                        for server, run in (('wsgi', self.run_wsgi), ('asgi', self.run_asgi)):
+                            elapsed, timings = run(url, options['requests'], concurrency)
+                            self.stdout.write(
+                                f'{name:>10} {concurrency:>8} {server:>6} {len(timings) / elapsed:>9.0f} '
+                                f'{statistics.median(timings) * 1000:>9.2f} {percentile(timings, 0.99) * 1000:>9.2f}'
+                            )
+        finally:
+            user.delete()
+            Category.objects.filter(pk__in=[category.pk for category in categories]).delete()
+
+    def run_wsgi(self, url, requests, concurrency):
+        """Drive the WSGI handler from `concurrency` threads, each with its own client and connection."""
+        def client_loop(count):
+            client = bench_client()
+            timings = []
+            try:
+                for _ in range(count):
+                    started = time.perf_counter()
+                    self.check_status(client.get(url), url)
+                    timings.append(time.perf_counter() - started)
+            finally:
+                connection.close()
+            return timings
+
+        started = time.perf_counter()
+        with ThreadPoolExecutor(concurrency) as pool:
+            results = list(pool.map(client_loop, self.split(requests, concurrency)))
+        return time.perf_counter() - started, [timing for timings in results for timing in timings]
+
+    def run_asgi(self, url, requests, concurrency):
+        """Drive the ASGI handler from `concurrency` tasks on one event loop."""
+        async def client_loop(count):
+            client = AsyncClient()
+            timings = []
+            for _ in range(count):
+                started = time.perf_counter()
+                self.check_status(await client.get(url), url)
+                timings.append(time.perf_counter() - started)
+            return timings
+
+        async def run():
+            return await asyncio.gather(*(client_loop(count) for count in self.split(requests, concurrency)))
+
+        started = time.perf_counter()
+        results = asyncio.run(run())
+        return time.perf_counter() - started, [timing for timings in results for timing in timings]
+
+    @staticmethod
+    def split(requests, concurrency):
+        return [requests // concurrency + (i < requests % concurrency) for i in range(concurrency)]
+
+    def check_status(self, response, url):
+        if response.status_code != 200:
+            self.stderr.write(f'{url} returned {response.status_code}')
@@ -0,0 +1,76 @@
+import itertools
+import re
+import time
+from django.core.management.base import BaseCommand, CommandError
+from tripexpensetrackerapi import fast_serializers
+from tripexpensetrackerapi.filters import ORDERINGS, expense_ordering, filter_expenses
+from tripexpensetrackerapi.management.commands._bench import rolled_back, seed_basics, seed_trip
+from tripexpensetrackerapi.models import Expense
+
+# A table scan line of SQLite's EXPLAIN QUERY PLAN output, e.g. "SCAN tripexpensetrackerapi_expense"
+FULL_SCAN = re.compile(r'\bSCAN (TABLE )?\w+$')
+
+
+class Command(BaseCommand):
+    help = (
+        'Run EXPLAIN QUERY PLAN for the expense list query under every combination of filters and every ordering, '
+        'reporting the plan and timing of each, and fail if any of them scans a whole table. Seeded data is '
+        'rolled back.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--trips', type=int, default=20, help='Benchmark trips')
+        parser.add_argument('--expenses', type=int, default=500, help='Expenses per trip')
+        parser.add_argument('--page-size', type=int, default=50, help='Rows per page')
+        parser.add_argument('--verbose-plans', action='store_true', help='Print every query plan')
+
+    def handle(self, *args, **options):
+        failures = []
+        with rolled_back():
+            user, categories = seed_basics()
+            trips = [seed_trip(user, options['expenses'], categories) for _ in range(options['trips'])]
+            filters = {
+                'user': {'userId': user.id},
+                'trip': {'tripId': trips[0].id},
+                'dates': {'dateFrom': '2024-01-05', 'dateTo': '2024-01-10'},
+                'category': {'categoryId': f'{categories[0].id},{categories[1].id}'},
+                'amount': {'minAmount': '100', 'maxAmount': '200'},
+            }
+
+            self.stdout.write(f"{'filters':>36} {'ordering':>8} {'ms':>8} {'rows':>6} {'sorts':>6}  index")
+            for count in range(len(filters) + 1):
+                for names in itertools.combinations(filters, count):
+                    for ordering in ORDERINGS:
+                        params = {'ordering': ordering}
+                        for name in names:
+                            params.update(filters[name])
+                        problem = self.explain(','.join(names) or '-', params, options)
+                        if problem:
+                            failures.append(problem)
+
+        if failures:
+            raise CommandError('Queries without an index:\n' + '\n'.join(failures))
+
+    def explain(self, label, params, options):
+        """Explain and time the page query for `params`; return a description of it if it scans a table."""
+        expenses = filter_expenses(fast_serializers.expense_values(Expense.objects.all()), params)
+        expenses = expenses.order_by(*expense_ordering(params))[:options['page_size'] + 1]
+
+        plan = expenses.explain()
+        started = time.perf_counter()
+        rows = len(list(expenses))
+        elapsed = time.perf_counter() - started
+
+        lines = [line.strip(' -|`') for line in plan.splitlines()]
+        indexes = sorted({match for line in lines for match in re.findall(r'INDEX (\w+)', line)})
+        sorts = sum('TEMP B-TREE' in line for line in lines)
+        self.stdout.write(
+            f"{label:>36} {params['ordering']:>8} {elapsed * 1000:>8.2f} {rows:>6} {sorts:>6}  {','.join(indexes)}"
+        )
+        if options['verbose_plans']:
+            self.stdout.write(plan)
+
+        scans = [line for line in lines if FULL_SCAN.search(line)]
+        if scans:
+            return f"{label} ordering={params['ordering']}: {'; '.join(scans)}"
+        return None
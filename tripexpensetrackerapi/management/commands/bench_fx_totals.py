@@ -0,0 +1,99 @@
+import random
+from datetime import date, timedelta
+from decimal import ROUND_HALF_UP, Decimal
+from django.core.management.base import BaseCommand, CommandError
+from tripexpensetrackerapi import fx
+from tripexpensetrackerapi.management.commands._bench import BATCH_SIZE, measure, rolled_back, seed_basics
+from tripexpensetrackerapi.models import Expense, FxRate, Trip
+from tripexpensetrackerapi.money import exponent, from_minor, home_currency
+from tripexpensetrackerapi.views.trip_view import trip_total
+
+# Prices of one unit of each currency in the home currency, moved a little each day
+CURRENCIES = {'EUR': 1.08, 'GBP': 1.27, 'JPY': 0.0067, 'KWD': 3.25}
+START = date(2024, 1, 1)
+
+
+class Command(BaseCommand):
+    help = (
+        'Compare computing the home currency total of a user\'s expenses in Python, per row, with the integer '
+        'SQL conversion in fx.totals() and the per-trip totals of the trip list. Seeded data is rolled back.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--expenses', type=int, default=1000000, help='Benchmark expenses')
+        parser.add_argument('--trips', type=int, default=100, help='Trips the expenses are spread over')
+        parser.add_argument('--days', type=int, default=90, help='Days of exchange rates')
+        parser.add_argument('--repeat', type=int, default=3, help='Runs per measurement')
+
+    def handle(self, *args, **options):
+        with rolled_back():
+            user, _ = seed_basics(category_count=0)
+            self.seed(user, options)
+            expenses = Expense.objects.filter(user=user)
+            approaches = (
+                ('python decimal', lambda: self.python_decimal(expenses)),
+                ('python minor', lambda: self.python_minor(expenses)),
+                ('sql totals', lambda: fx.totals(expenses)[0]),
+                ('sql per trip', lambda: fx.scaled_to_minor(sum(
+                    Trip.objects.filter(user=user).annotate(total=trip_total()).values_list('total', flat=True)
+                ))),
+            )
+            self.stdout.write(f"{'approach':>16} {'ms':>10} {'queries':>8} {'total':>18}")
+            results = set()
+            for name, func in approaches:
+                seconds, queries, total = measure(func, options['repeat'])
+                results.add(total)
+                self.stdout.write(f'{name:>16} {seconds * 1000:>10.2f} {queries:>8} {total:>18}')
+        # The cache is not rolled back with the rates
+        fx.rates.invalidate()
+        if len(results) > 1:
+            raise CommandError(f'The approaches disagree: {sorted(results)}')
+
+    def seed(self, user, options):
+        rng = random.Random(0)
+        # Replaced by the benchmark's own rates until the rollback
+        # Overwrites any existing rates of those days; rates expenses convert at cannot be deleted
+        FxRate.objects.bulk_create(
+            (
+                FxRate(currency=currency, date=START + timedelta(days=day),
+                       rate=fx.scaled_rate(f'{price * rng.uniform(0.97, 1.03):.6f}', currency))
+                for currency, price in CURRENCIES.items()
+                for day in range(options['days'])
+            ),
+            update_conflicts=True, unique_fields=['currency', 'date'], update_fields=['rate'],
+        )
+        trips = Trip.objects.bulk_create(
+            Trip(user=user, name=f'FX trip {n}', date=START, description='Benchmark data')
+            for n in range(options['trips'])
+        )
+        currencies = [home_currency(), *CURRENCIES]
+        count = options['expenses']
+        for offset in range(0, count, BATCH_SIZE):
+            Expense.objects.bulk_create(
+                Expense(
+                    user=user,
+                    trip=trips[n % len(trips)],
+                    name='FX expense',
+                    currency=currencies[n % len(currencies)],
+                    amount_minor=rng.randrange(100, 50000),
+                    description='Benchmark expense',
+                    date=START + timedelta(days=rng.randrange(options['days'])),
+                )
+                for n in range(offset, min(offset + BATCH_SIZE, count))
+            )
+        fx.rates.invalidate()
+
+    def python_decimal(self, expenses):
+        """Decimal amounts times Decimal rates, summed in Python: what storing Decimal amounts would need."""
+        total = Decimal(0)
+        for amount_minor, currency, day in expenses.values_list('amount_minor', 'currency', 'date').iterator():
+            rate = Decimal(fx.rates.rate(currency, day)) / fx.RATE_SCALE
+            total += from_minor(amount_minor, currency) * rate.scaleb(exponent(currency))
+        return int(total.to_integral_value(rounding=ROUND_HALF_UP))
+
+    def python_minor(self, expenses):
+        """The same integer arithmetic as the SQL, row by row in Python."""
+        return fx.scaled_to_minor(sum(
+            amount_minor * fx.rates.rate(currency, day)
+            for amount_minor, currency, day in expenses.values_list('amount_minor', 'currency', 'date').iterator()
+        ))
@@ -0,0 +1,73 @@
+import random
+from datetime import date, timedelta
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.db.models import Q
+from tripexpensetrackerapi import search
+from tripexpensetrackerapi.management.commands._bench import BATCH_SIZE, measure, rolled_back
+from tripexpensetrackerapi.management.commands.seed_bench import DESTINATIONS, ITEMS
+from tripexpensetrackerapi.models import Expense, User
+
+# (label, search query, the words a LIKE scan looks for)
+QUERIES = (
+    ('word', 'hotel', ['hotel']),
+    ('prefix', 'tax*', ['tax']),
+    ('phrase', '"rental car"', ['rental car']),
+    ('two words', 'dinner kyoto', ['dinner', 'kyoto']),
+    ('no match', 'zeppelin', ['zeppelin']),
+)
+
+
+class Command(BaseCommand):
+    help = (
+        'Compare searching a user\'s expenses through the FTS5 index with a LIKE scan of names and descriptions. '
+        'Seeded data is rolled back.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--expenses', type=int, default=1000000, help='Benchmark expenses')
+        parser.add_argument('--users', type=int, default=100, help='Users the expenses are spread over')
+        parser.add_argument('--page-size', type=int, default=50, help='Rows per page')
+        parser.add_argument('--repeat', type=int, default=5, help='Searches per measurement')
+
+    def handle(self, *args, **options):
+        if not search.supported(connection):
+            raise CommandError('Search needs a SQLite database')
+        size = options['page_size']
+        self.stdout.write(f"{'query':>12} {'method':>6} {'ms':>10} {'rows':>6}")
+        with rolled_back():
+            user = self.seed(options)
+            for label, text, words in QUERIES:
+                query = search.parse_query(text)
+                fts = lambda: [row['id'] for row in search.search(user.id, query, size)]
+                like = lambda: self.like(user, words, size)
+                for method, func in (('fts', fts), ('like', like)):
+                    seconds, _, ids = measure(func, options['repeat'])
+                    self.stdout.write(f'{label:>12} {method:>6} {seconds * 1000:>10.2f} {len(ids):>6}')
+
+    def seed(self, options):
+        rng = random.Random(0)
+        users = User.objects.bulk_create(
+            User(name=f'Search user {n}', uid=f'bench-search-{n}') for n in range(options['users'])
+        )
+        count = options['expenses']
+        for offset in range(0, count, BATCH_SIZE):
+            # Inserting runs the search triggers, so this also builds the index
+            Expense.objects.bulk_create(
+                Expense(
+                    user=users[n % len(users)],
+                    name=rng.choice(ITEMS),
+                    amount_minor=rng.randrange(100, 50000),
+                    description=f'{rng.choice(ITEMS)} in {rng.choice(DESTINATIONS)}',
+                    date=date(2024, 1, 1) + timedelta(days=rng.randrange(365)),
+                )
+                for n in range(offset, min(offset + BATCH_SIZE, count))
+            )
+        return users[0]
+
+    def like(self, user, words, size):
+        """The first page of the user's expenses containing every word, as a search without the index would."""
+        condition = Q()
+        for word in words:
+            condition &= Q(name__icontains=word) | Q(description__icontains=word)
+        return list(Expense.objects.filter(condition, user=user).order_by('id').values_list('id', flat=True)[:size])
@@ -0,0 +1,43 @@
+from django.core.management.base import BaseCommand
+from django.test.utils import override_settings
+from tripexpensetrackerapi.management.commands._bench import (
+    allow_bench_client, bench_client, measure, rolled_back, seed_basics, seed_trip,
+)
+
+
+class Command(BaseCommand):
+    help = (
+        'Compare the fast list serializers with the DRF serializers on the list endpoints, reporting rows/s. '
+        'Seeded data is rolled back.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--trips', type=int, default=200, help='Benchmark trips')
+        parser.add_argument('--expenses', type=int, default=5, help='Expenses per trip')
+        parser.add_argument('--page-size', type=int, default=200, help='Rows per page requested')
+        parser.add_argument('--repeat', type=int, default=5, help='Requests per measurement')
+
+    def handle(self, *args, **options):
+        client = bench_client()
+        size = options['page_size']
+        self.stdout.write(f"{'endpoint':>18} {'serializer':>10} {'ms':>10} {'queries':>8} {'rows/s':>10}")
+        with allow_bench_client(), rolled_back(), override_settings(RESPONSE_CACHE_TIMEOUT=0):
+            user, categories = seed_basics()
+            for _ in range(options['trips']):
+                seed_trip(user, options['expenses'], categories)
+            urls = (
+                ('trips', f'/trips?userId={user.id}&page_size={size}'),
+                ('expenses', f'/expenses?page_size={size}'),
+                ('expensecategories', f'/expensecategories?page_size={size}'),
+            )
+            for endpoint, url in urls:
+                for name, fast in (('drf', False), ('fast', True)):
+                    with override_settings(FAST_LIST_SERIALIZERS=fast):
+                        seconds, queries, response = measure(lambda: client.get(url), options['repeat'])
+                    if response.status_code != 200:
+                        self.stderr.write(f'{url} returned {response.status_code}')
+                        continue
+                    rows = len(response.data['results'])
+                    self.stdout.write(
+                        f'{endpoint:>18} {name:>10} {seconds * 1000:>10.2f} {queries:>8} {rows / seconds:>10.0f}'
+                    )
@@ -0,0 +1,65 @@
+import random
+from datetime import date, timedelta
+from django.db.models import Count
+from django.core.management.base import BaseCommand
+from tripexpensetrackerapi import suggestions
+from tripexpensetrackerapi.management.commands._bench import BATCH_SIZE, measure, rolled_back, seed_basics
+from tripexpensetrackerapi.management.commands.seed_bench import DESTINATIONS, ITEMS
+from tripexpensetrackerapi.models import Expense, ExpenseCategory
+
+PREFIXES = ('t', 'ta', 'hotel', 'hotel night k', 'zz')
+
+
+class Command(BaseCommand):
+    help = (
+        'Compare typeahead suggestions from the in-memory prefix index, cold and warm, with a LIKE prefix query '
+        'per keystroke. Seeded data is rolled back.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--expenses', type=int, default=100000, help='Expenses of the benchmark user')
+        parser.add_argument('--repeat', type=int, default=200, help='Lookups per measurement')
+
+    def handle(self, *args, **options):
+        self.stdout.write(f"{'prefix':>16} {'method':>6} {'ms':>10} {'queries':>8}")
+        with rolled_back():
+            user = self.seed(options)
+            suggestions.clear()
+            seconds, queries, _ = measure(lambda: suggestions.suggest(user.id, ''), 1)
+            self.stdout.write(f"{'(build)':>16} {'index':>6} {seconds * 1000:>10.3f} {queries:>8}")
+            for prefix in PREFIXES:
+                for method, func in (
+                    ('index', lambda: suggestions.suggest(user.id, prefix)),
+                    ('like', lambda: self.like(user, prefix)),
+                ):
+                    repeat = options['repeat'] if method == 'index' else max(1, options['repeat'] // 20)
+                    seconds, queries, _ = measure(func, repeat)
+                    self.stdout.write(f'{prefix:>16} {method:>6} {seconds * 1000:>10.3f} {queries:>8}')
+        suggestions.clear()
+
+    def seed(self, options):
+        rng = random.Random(0)
+        user, categories = seed_basics()
+        count = options['expenses']
+        for offset in range(0, count, BATCH_SIZE):
+            expenses = Expense.objects.bulk_create(
+                Expense(
+                    user=user,
+                    name=f'{rng.choice(ITEMS)} {rng.choice(DESTINATIONS)}',
+                    amount_minor=rng.randrange(100, 50000),
+                    description='Benchmark expense',
+                    date=date(2024, 1, 1) + timedelta(days=rng.randrange(365)),
+                )
+                for _ in range(min(BATCH_SIZE, count - offset))
+            )
+            ExpenseCategory.objects.bulk_create(
+                ExpenseCategory(expense=expense, category=rng.choice(categories)) for expense in expenses
+            )
+        return user
+
+    def like(self, user, prefix):
+        """The user's most used names starting with `prefix`, as a query per keystroke would find them."""
+        return list(
+            Expense.objects.filter(user=user, name__istartswith=prefix).values('name')
+            .annotate(count=Count('id')).order_by('-count', 'name')[:suggestions.DEFAULT_LIMIT]
+        )
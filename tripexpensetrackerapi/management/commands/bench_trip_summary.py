@@ -0,0 +1,30 @@
+from django.core.management.base import BaseCommand
+from django.test.utils import override_settings
+from tripexpensetrackerapi.management.commands._bench import (
+    allow_bench_client, bench_client, measure, rolled_back, seed_basics, seed_trip,
+)
+
+
+class Command(BaseCommand):
+    help = 'Compare GET /trips/<pk>/summary with serializing the full trip. Seeded data is rolled back.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sizes', type=int, nargs='+', default=[10, 1000, 100000],
+                            help='Expenses per benchmark trip')
+        parser.add_argument('--repeat', type=int, default=3, help='Requests per measurement')
+
+    def handle(self, *args, **options):
+        client = bench_client()
+        self.stdout.write(f"{'expenses':>10} {'endpoint':>8} {'ms':>10} {'queries':>8} {'bytes':>12}")
+        # Without the response cache, so every repeat serializes the full trip again
+        with allow_bench_client(), rolled_back(), override_settings(RESPONSE_CACHE_TIMEOUT=0):
+            user, categories = seed_basics()
+            for size in options['sizes']:
+                trip = seed_trip(user, size, categories)
+                for endpoint, url in (('summary', f'/trips/{trip.id}/summary'), ('full', f'/trips/{trip.id}')):
+                    seconds, queries, response = measure(lambda: client.get(url), options['repeat'])
+                    if response.status_code != 200:
+                        self.stderr.write(f'{url} returned {response.status_code}')
+                    self.stdout.write(
+                        f'{size:>10} {endpoint:>8} {seconds * 1000:>10.2f} {queries:>8} {len(response.content):>12}'
+                    )
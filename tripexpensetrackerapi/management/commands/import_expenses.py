@@ -0,0 +1,166 @@
+import csv
+import time
+from datetime import datetime
+from decimal import Decimal, InvalidOperation
+from itertools import islice
+from pathlib import Path
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from tripexpensetrackerapi import fx, rollups
+from tripexpensetrackerapi.bulk import category_links
+from tripexpensetrackerapi.models import Trip, Expense, User, Category, ExpenseCategory, ImportCheckpoint
+from tripexpensetrackerapi.money import exponent, parse_currency, to_minor
+from tripexpensetrackerapi.timestamps import touch_trips
+
+
+def chunked(iterable, size):
+    """Yield lists of up to `size` items from `iterable`."""
+    iterator = iter(iterable)
+    while True:
+        chunk = list(islice(iterator, size))
+        if not chunk:
+            return
+        yield chunk
+
+
+class CategoryLookup:
+    """Maps category names to ids, loading existing categories once and creating missing ones once."""
+
+    def __init__(self):
+        self.ids = None
+
+    def get(self, name):
+        if self.ids is None:
+            self.ids = {category_name.lower(): pk for pk, category_name in Category.objects.values_list('id', 'name')}
+        key = name.lower()
+        if key not in self.ids:
+            self.ids[key] = Category.objects.create(name=name).id
+        return self.ids[key]
+
+
+class Command(BaseCommand):
+    help = (
+        'Import expenses for a user (and optionally a trip) from a CSV file with a header row. '
+        'Rows are written in bulk batches inside chunked transactions, and progress is saved '
+        'with each transaction so an interrupted import resumes where it left off.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('csv_path', help='CSV file to import')
+        parser.add_argument('--user', type=int, required=True, help='Id of the user the expenses belong to')
+        parser.add_argument('--trip', type=int, help='Id of the trip to add the expenses to')
+        parser.add_argument('--batch-size', type=int, default=1000, help='Rows per bulk insert')
+        parser.add_argument('--transaction-batches', type=int, default=10, help='Bulk inserts per transaction')
+        parser.add_argument('--name-column', default='name')
+        parser.add_argument('--amount-column', default='amount')
+        parser.add_argument('--date-column', default='date')
+        parser.add_argument('--description-column', default='description')
+        parser.add_argument('--category-column', default='categories',
+                            help="Column of category names, several separated by ';'")
+        parser.add_argument('--date-format', default='%Y-%m-%d', help='strptime format of the date column')
+        parser.add_argument('--currency', type=parse_currency, default=parse_currency(None),
+                            help='Currency of the amounts (the home currency by default)')
+        parser.add_argument('--negate', action='store_true',
+                            help='Flip the sign of amounts, for statements that list spending as negative')
+        parser.add_argument('--restart', action='store_true', help='Ignore any saved progress for this file')
+
+    def handle(self, *args, **options):
+        path = Path(options['csv_path']).resolve()
+        if not path.is_file():
+            raise CommandError(f'{path} does not exist')
+        try:
+            user = User.objects.get(pk=options['user'])
+            trip = Trip.objects.get(pk=options['trip']) if options['trip'] else None
+        except (User.DoesNotExist, Trip.DoesNotExist) as ex:
+            raise CommandError(str(ex)) from ex
+
+        self.options = options
+        self.categories = CategoryLookup()
+        checkpoint, _ = ImportCheckpoint.objects.get_or_create(source=str(path), user=user, trip=trip)
+        if options['restart']:
+            checkpoint.rows_committed = 0
+            checkpoint.completed = False
+            checkpoint.save()
+        elif checkpoint.completed:
+            self.stdout.write(f'{path} was already imported ({checkpoint.rows_committed} rows); use --restart to import it again')
+            return
+        elif checkpoint.rows_committed:
+            self.stdout.write(f'Resuming after row {checkpoint.rows_committed}')
+
+        started = time.perf_counter()
+        imported = skipped = 0
+        with open(path, newline='', encoding='utf-8-sig') as csv_file:
+            reader = csv.DictReader(csv_file)
+            rows = islice(reader, checkpoint.rows_committed, None)
+            chunk_size = options['batch_size'] * options['transaction_batches']
+
+            for chunk in chunked(rows, chunk_size):
+                items = []
+                for offset, row in enumerate(chunk, start=checkpoint.rows_committed + 1):
+                    item = self.parse_row(row, offset)
+                    if item is None:
+                        skipped += 1
+                    else:
+                        items.append(item)
+
+                with transaction.atomic():
+                    for batch in chunked(items, options['batch_size']):
+                        for item in batch:
+                            item['categories'] = [self.categories.get(name) for name in item['category_names']]
+                        expenses = Expense.objects.bulk_create(
+                            Expense(
+                                user=user,
+                                trip=trip,
+                                name=item['name'],
+                                amount_minor=item['amount_minor'],
+                                currency=options['currency'],
+                                description=item['description'],
+                                date=item['date'],
+                            )
+                            for item in batch
+                        )
+                        ExpenseCategory.objects.bulk_create(category_links(expenses, batch))
+                        rollups.add(Expense.objects.filter(pk__in=[expense.pk for expense in expenses]))
+                    if trip is not None:
+                        touch_trips([trip.id])
+                    checkpoint.rows_committed += len(chunk)
+                    checkpoint.save(update_fields=['rows_committed'])
+
+                imported += len(items)
+                rate = imported / (time.perf_counter() - started)
+                self.stdout.write(f'{checkpoint.rows_committed} rows committed ({rate:.0f} rows/s)')
+
+        checkpoint.completed = True
+        checkpoint.save(update_fields=['completed'])
+        elapsed = time.perf_counter() - started
+        self.stdout.write(self.style.SUCCESS(
+            f'Imported {imported} expenses in {elapsed:.1f}s ({imported / elapsed if elapsed else 0:.0f} rows/s), '
+            f'skipped {skipped} invalid rows'
+        ))
+
+    def parse_row(self, row, row_number):
+        """Turn a CSV row into expense fields, or report it and return None if it is invalid."""
+        options = self.options
+        try:
+            name = (row.get(options['name_column']) or '').strip()[:51]
+            if not name:
+                raise ValueError('missing name')
+            amount = Decimal(row[options['amount_column']].strip().replace(',', '').lstrip('$'))
+            if options['negate']:
+                amount = -amount
+            currency = options['currency']
+            amount_minor = to_minor(amount.quantize(Decimal(1).scaleb(-exponent(currency))), currency)
+            date = datetime.strptime(row[options['date_column']].strip(), options['date_format']).date()
+            fx.check(currency, date)
+        except (KeyError, AttributeError, ValueError, InvalidOperation) as ex:
+            self.stderr.write(f'Skipping row {row_number}: {ex!r}')
+            return None
+
+        categories = row.get(options['category_column']) or ''
+        return {
+            'name': name,
+            'amount_minor': amount_minor,
+            'description': (row.get(options['description_column']) or '').strip(),
+            'date': date,
+            'category_names': [category.strip() for category in categories.split(';') if category.strip()],
+        }
@@ -0,0 +1,43 @@
+import pstats
+import statistics
+from collections import defaultdict
+from django.core.management.base import BaseCommand, CommandError
+from tripexpensetrackerapi.profiling import profile_files
+
+SORT_KEYS = ('cumulative', 'tottime', 'ncalls')
+
+
+class Command(BaseCommand):
+    help = (
+        'Summarize the request profiles collected by the profiling middleware: the profiles per view with their '
+        'median duration and query count, then the hottest functions across all of them.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dir', help='Profile directory (default: settings.PROFILE_DIR)')
+        parser.add_argument('--view', help='Only profiles of this view, e.g. TripView.retrieve')
+        parser.add_argument('--sort', choices=SORT_KEYS, default='cumulative', help='Order of the function list')
+        parser.add_argument('--limit', type=int, default=25, help='Functions to list')
+
+    def handle(self, *args, **options):
+        files = [
+            (path, tags) for path, tags in profile_files(options['dir'])
+            if not options['view'] or tags['view'] == options['view']
+        ]
+        if not files:
+            raise CommandError('No profiles found')
+
+        by_view = defaultdict(list)
+        for _, tags in files:
+            by_view[(tags['view'], tags['method'])].append(tags)
+        self.stdout.write(f"{'view':>36} {'method':>7} {'profiles':>9} {'median ms':>10} {'median queries':>15}")
+        for (view, method), tags in sorted(by_view.items()):
+            self.stdout.write(
+                f'{view:>36} {method:>7} {len(tags):>9} '
+                f"{statistics.median(int(t['ms']) for t in tags):>10.0f} "
+                f"{statistics.median(int(t['queries']) for t in tags):>15.0f}"
+            )
+        self.stdout.write('')
+
+        stats = pstats.Stats(*(str(path) for path, _ in files), stream=self.stdout)
+        stats.strip_dirs().sort_stats(options['sort']).print_stats(options['limit'])
@@ -0,0 +1,9 @@
+from django.core.management.base import BaseCommand
+from tripexpensetrackerapi.profiling import make_token
+
+
+class Command(BaseCommand):
+    help = 'Print a signed X-Profile header value that has a request profiled (see profiling.py).'
+
+    def handle(self, *args, **options):
+        self.stdout.write(make_token())
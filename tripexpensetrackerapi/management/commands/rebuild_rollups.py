@@ -0,0 +1,25 @@
+import time
+from django.core.management.base import BaseCommand
+from tripexpensetrackerapi import rollups
+from tripexpensetrackerapi.models import User
+
+
+class Command(BaseCommand):
+    help = (
+        'Recompute the monthly spending rollups from the expenses, for every user or only those given. '
+        'Run it to repair rollups after writes that bypassed the application, e.g. a restored database.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--user', type=int, action='append', dest='users', help='User id to rebuild (repeatable)')
+        parser.add_argument('--batch-size', type=int, default=500, help='Users rebuilt per transaction')
+
+    def handle(self, *args, **options):
+        started = time.perf_counter()
+        user_ids = options['users'] or list(User.objects.order_by('id').values_list('id', flat=True))
+        rows = 0
+        for offset in range(0, len(user_ids), options['batch_size']):
+            rows += rollups.rebuild(user_ids[offset:offset + options['batch_size']])
+        self.stdout.write(
+            f'Wrote {rows} rollup rows for {len(user_ids)} users in {time.perf_counter() - started:.2f}s'
+        )
@@ -0,0 +1,25 @@
+import time
+from django.core.management.base import BaseCommand, CommandError
+from django.db import DEFAULT_DB_ALIAS, connections, transaction
+from tripexpensetrackerapi import search
+from tripexpensetrackerapi.models import Expense
+
+
+class Command(BaseCommand):
+    help = (
+        'Re-create the expense search index and its triggers if they are missing, then re-index every expense. '
+        'Run it after a migration that rebuilt the expense table or to backfill a restored database.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--database', default=DEFAULT_DB_ALIAS, help='Database alias to rebuild')
+
+    def handle(self, *args, **options):
+        connection = connections[options['database']]
+        if not search.supported(connection):
+            raise CommandError(f"Search needs a SQLite database; {options['database']} is {connection.vendor}")
+        started = time.perf_counter()
+        with transaction.atomic(using=options['database']):
+            search.rebuild(connection)
+        count = Expense.objects.using(options['database']).count()
+        self.stdout.write(f'Indexed {count} expenses in {time.perf_counter() - started:.2f}s')
@@ -0,0 +1,139 @@
+import random
+import time
+from datetime import date, timedelta
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from tripexpensetrackerapi import rollups
+from tripexpensetrackerapi.deletes import delete_expense_rows
+from tripexpensetrackerapi.management.commands._bench import BATCH_SIZE
+from tripexpensetrackerapi.models import User, Trip, Expense, Category, ExpenseCategory
+
+# Seeded users' uids and categories' names start with these, so --clear can find them
+UID_PREFIX = 'seed-'
+CATEGORY_PREFIX = 'Seed: '
+
+CATEGORIES = (
+    'Food', 'Lodging', 'Transport', 'Fuel', 'Activities', 'Groceries', 'Shopping', 'Coffee',
+    'Tickets', 'Parking', 'Tips', 'Fees', 'Health', 'Gifts', 'Laundry', 'Other',
+)
+DESTINATIONS = (
+    'Lisbon', 'Kyoto', 'Denver', 'Oaxaca', 'Reykjavik', 'Nashville', 'Hanoi', 'Vienna',
+    'Cape Town', 'Montreal', 'Seoul', 'Tucson', 'Edinburgh', 'Lima', 'Austin', 'Krakow',
+)
+ITEMS = (
+    'Dinner', 'Lunch', 'Breakfast', 'Hotel night', 'Taxi', 'Train', 'Gas', 'Museum',
+    'Snacks', 'Souvenirs', 'Bus pass', 'Tour', 'Pharmacy', 'Drinks', 'Ferry', 'Rental car',
+)
+
+
+def zipf_weights(count, skew):
+    """Weights for `count` ranks where rank r is 1 / r**skew as likely as the first."""
+    return [1 / rank ** skew for rank in range(1, count + 1)]
+
+
+class Command(BaseCommand):
+    help = (
+        'Generate a reproducible benchmark dataset: users, their trips, the trips\' expenses, and category links '
+        'drawn from a skewed (Zipf) distribution. The same --seed always generates the same data.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=100, help='Users to create')
+        parser.add_argument('--trips-per-user', type=int, default=10, help='Trips per user')
+        parser.add_argument('--expenses-per-trip', type=int, default=50, help='Expenses per trip')
+        parser.add_argument('--categories', type=int, default=len(CATEGORIES), help='Categories to create')
+        parser.add_argument('--skew', type=float, default=1.2,
+                            help='Zipf exponent of the category distribution (0 is uniform)')
+        parser.add_argument('--seed', type=int, default=0, help='Random seed')
+        parser.add_argument('--clear', action='store_true', help='Delete previously seeded data first')
+
+    def handle(self, *args, **options):
+        started = time.perf_counter()
+        if options['clear']:
+            self.clear()
+        elif User.objects.filter(uid__startswith=f"{UID_PREFIX}{options['seed']}-").exists():
+            raise CommandError(f"Data for seed {options['seed']} already exists; pass --clear to replace it")
+
+        rng = random.Random(options['seed'])
+        with transaction.atomic():
+            categories = self.create_categories(options['categories'])
+            weights = zipf_weights(len(categories), options['skew'])
+            users = User.objects.bulk_create(
+                User(name=f'{rng.choice(DESTINATIONS)} Traveller {i}', uid=f"{UID_PREFIX}{options['seed']}-{i}")
+                for i in range(options['users'])
+            )
+            trips = 0
+            expenses = 0
+            links = 0
+            for user in users:
+                for trip in self.create_trips(rng, user, options['trips_per_user']):
+                    created, linked = self.create_expenses(
+                        rng, user, trip, options['expenses_per_trip'], categories, weights
+                    )
+                    trips += 1
+                    expenses += created
+                    links += linked
+            # Counted once at the end rather than per batch
+            rollups.rebuild([user.id for user in users])
+
+        self.stdout.write(
+            f'Seeded {len(users)} users, {trips} trips, {expenses} expenses, {links} category links and '
+            f'{len(categories)} categories in {time.perf_counter() - started:.1f}s'
+        )
+
+    def clear(self):
+        with transaction.atomic():
+            delete_expense_rows(Expense.objects.filter(user__uid__startswith=UID_PREFIX))
+            Trip.objects.filter(user__uid__startswith=UID_PREFIX).delete()
+            User.objects.filter(uid__startswith=UID_PREFIX).delete()
+            Category.objects.filter(name__startswith=CATEGORY_PREFIX).delete()
+
+    def create_categories(self, count):
+        names = [f'{CATEGORY_PREFIX}{CATEGORIES[i % len(CATEGORIES)]}' for i in range(count)]
+        # Numbers the names once the list runs out
+        names = [
+            name if i < len(CATEGORIES) else f'{name} {i // len(CATEGORIES) + 1}' for i, name in enumerate(names)
+        ]
+        existing = {category.name: category for category in Category.objects.filter(name__in=names)}
+        # Saved one by one so the category catalog is invalidated
+        return [existing.get(name) or Category.objects.create(name=name) for name in names]
+
+    def create_trips(self, rng, user, count):
+        trips = []
+        for _ in range(count):
+            start = date(2023, 1, 1) + timedelta(days=rng.randrange(730))
+            destination = rng.choice(DESTINATIONS)
+            trips.append(Trip(
+                user=user, name=f'{destination} {start.year}', date=start, description=f'A trip to {destination}.'
+            ))
+        return Trip.objects.bulk_create(trips)
+
+    def create_expenses(self, rng, user, trip, count, categories, weights):
+        """Create `count` expenses on `trip`, each in one to three categories; return (expenses, links)."""
+        length = rng.randint(1, 21)
+        links = 0
+        for offset in range(0, count, BATCH_SIZE):
+            expenses = Expense.objects.bulk_create(
+                Expense(
+                    user=user,
+                    trip=trip,
+                    name=rng.choice(ITEMS),
+                    # Log-normal: mostly small amounts with a long tail, median about 27
+                    amount=f'{min(rng.lognormvariate(3.3, 0.9), 9999):.2f}',
+                    description='Seeded expense',
+                    date=trip.date + timedelta(days=rng.randrange(length)),
+                )
+                for _ in range(min(BATCH_SIZE, count - offset))
+            )
+            expense_categories = []
+            for expense in expenses:
+                wanted = rng.choice((1, 1, 1, 2, 2, 3))
+                picked = set()
+                while len(picked) < min(wanted, len(categories)):
+                    picked.add(rng.choices(range(len(categories)), weights)[0])
+                expense_categories += [
+                    ExpenseCategory(expense=expense, category=categories[index]) for index in sorted(picked)
+                ]
+            ExpenseCategory.objects.bulk_create(expense_categories)
+            links += len(expense_categories)
+        return count, links
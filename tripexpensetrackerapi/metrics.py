@@ -0,0 +1,254 @@
+"""Per-request performance metrics: SQL queries, serialization and wall time by view.
+
+`metrics_middleware` gives every request a RequestMetrics in `current_metrics`.
+Every database connection runs its queries through `record_query` (installed
+in signals.py), which adds to the metrics of the request being served;
+serializers with TimedSerializerMixin, the fast serializers and the JSON
+renderer add their time, less any queries they ran, as `serialize`. When the
+request finishes its numbers go into a `Server-Timing` header (except on
+streamed responses) and into this process's per-view latency histograms,
+which the `/metrics` endpoint renders in the Prometheus text format to the
+addresses in settings.METRICS_ALLOWED_IPS. Each worker process keeps its
+own figures.
+
+Like the replica routing state, the metrics object is shared by reference
+with the worker threads async views hand their ORM calls to.
+"""
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from functools import wraps
+from django.conf import settings
+from rest_framework.renderers import JSONRenderer
+from tripexpensetrackerapi import response_cache, slow_queries
+
+# Latency histogram bucket bounds, in seconds
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+current_metrics = ContextVar('request_metrics', default=None)
+
+
+class RequestMetrics:
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.queries = 0
+        self.query_time = 0.0
+        self.timings = {}
+        self.timing = None
+
+
+def record_query(execute, sql, params, many, context):
+    """Database execute wrapper counting and timing each query for the current request."""
+    started = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        elapsed = time.perf_counter() - started
+        metrics = current_metrics.get()
+        if metrics is not None:
+            metrics.queries += 1
+            metrics.query_time += elapsed
+        slow_queries.record(sql, elapsed)
+
+
+@contextmanager
+def timed(name):
+    """Add the time spent in the block, less its queries, to the current request's `name` timing.
+
+    Nested blocks are counted once, by the outermost.
+    """
+    metrics = current_metrics.get()
+    if metrics is None or metrics.timing is not None:
+        yield
+        return
+
+    metrics.timing = name
+    started = time.perf_counter()
+    query_time = metrics.query_time
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - started - (metrics.query_time - query_time)
+        metrics.timings[name] = metrics.timings.get(name, 0.0) + elapsed
+        metrics.timing = None
+
+
+def timed_function(name):
+    """Decorator running the whole function inside `timed(name)`."""
+    def decorator(func):
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            with timed(name):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+class TimedSerializerMixin:
+    """Serializer mixin counting its representations towards the request's `serialize` timing."""
+
+    def to_representation(self, instance):
+        with timed('serialize'):
+            return super().to_representation(instance)
+
+
+class TimedJSONRenderer(JSONRenderer):
+    """JSONRenderer counting its rendering towards the request's `serialize` timing."""
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        with timed('serialize'):
+            return super().render(data, accepted_media_type, renderer_context)
+
+
+class Histogram:
+    def __init__(self, buckets=BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value):
+        for index, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[index] += 1
+                break
+        self.count += 1
+        self.sum += value
+
+
+class ViewStats:
+    """Everything recorded for one (view, method) pair."""
+
+    def __init__(self):
+        self.latency = Histogram()
+        self.statuses = {}
+        self.queries = 0
+        self.query_time = 0.0
+        self.timings = {}
+
+
+views = {}
+_views_lock = threading.Lock()
+
+
+def view_name(request):
+    """The ViewSet and action (or the function view) that served `request`."""
+    match = getattr(request, 'resolver_match', None)
+    if match is None:
+        return 'unresolved'
+    func = match.func
+    cls = getattr(func, 'cls', None)
+    if cls is not None:
+        action = (getattr(func, 'actions', None) or {}).get(request.method.lower())
+        return f'{cls.__name__}.{action}' if action else cls.__name__
+    return f"{func.__module__.rsplit('.', 1)[-1]}.{func.__name__}"
+
+
+def observe(request, response, metrics):
+    """Record a finished request and return its total time in seconds."""
+    elapsed = time.perf_counter() - metrics.started
+    with _views_lock:
+        stats = views.setdefault((view_name(request), request.method), ViewStats())
+        stats.latency.observe(elapsed)
+        stats.statuses[response.status_code] = stats.statuses.get(response.status_code, 0) + 1
+        stats.queries += metrics.queries
+        stats.query_time += metrics.query_time
+        for name, seconds in metrics.timings.items():
+            stats.timings[name] = stats.timings.get(name, 0.0) + seconds
+    return elapsed
+
+
+def server_timing(metrics, elapsed):
+    """The Server-Timing header value for a finished request, durations in milliseconds."""
+    entries = [f'db;dur={metrics.query_time * 1000:.2f};desc="{metrics.queries} queries"']
+    entries += [f'{name};dur={seconds * 1000:.2f}' for name, seconds in sorted(metrics.timings.items())]
+    entries.append(f'total;dur={elapsed * 1000:.2f}')
+    return ', '.join(entries)
+
+
+def finish(request, response, metrics):
+    elapsed = observe(request, response, metrics)
+    # A streamed body is produced after this runs, so the timings would leave most of it out
+    if getattr(settings, 'SERVER_TIMING_HEADER', True) and not response.streaming:
+        response['Server-Timing'] = server_timing(metrics, elapsed)
+    return response
+
+
+def reset():
+    """Forget everything recorded so far in this process."""
+    with _views_lock:
+        views.clear()
+    slow_queries.reset()
+
+
+def label(value):
+    return str(value).replace('\\', r'\\').replace('"', r'\"').replace('\n', r'\n')
+
+
+def labels(**values):
+    return '{' + ','.join(f'{name}="{label(value)}"' for name, value in values.items()) + '}'
+
+
+def family(name, kind, help, samples):
+    """Text lines for one metric family; `samples` are (suffix, labels dict, value) triples."""
+    lines = [f'# HELP {name} {help}', f'# TYPE {name} {kind}']
+    lines += [f'{name}{suffix}{labels(**sample_labels)} {value}' for suffix, sample_labels, value in samples]
+    return lines
+
+
+def histogram_samples(histogram, **sample_labels):
+    cumulative = 0
+    for bound, count in zip(histogram.buckets, histogram.counts):
+        cumulative += count
+        yield '_bucket', {**sample_labels, 'le': bound}, cumulative
+    yield '_bucket', {**sample_labels, 'le': '+Inf'}, histogram.count
+    yield '_sum', sample_labels, histogram.sum
+    yield '_count', sample_labels, histogram.count
+
+
+def render_prometheus():
+    """Everything recorded in this process, in the Prometheus text exposition format."""
+    with _views_lock:
+        snapshot = [
+            ({'view': view, 'method': method}, stats) for (view, method), stats in sorted(views.items())
+        ]
+        lines = family(
+            'http_request_duration_seconds', 'histogram', 'Request wall time by view and method.',
+            [sample for by, stats in snapshot for sample in histogram_samples(stats.latency, **by)],
+        )
+        lines += family(
+            'http_responses_total', 'counter', 'Responses by view, method and status.',
+            [
+                ('', {**by, 'status': code}, count)
+                for by, stats in snapshot for code, count in sorted(stats.statuses.items())
+            ],
+        )
+        lines += family(
+            'db_queries_total', 'counter', 'SQL queries run by view and method.',
+            [('', by, stats.queries) for by, stats in snapshot],
+        )
+        lines += family(
+            'db_query_seconds_total', 'counter', 'Time spent in SQL queries by view and method.',
+            [('', by, stats.query_time) for by, stats in snapshot],
+        )
+        lines += family(
+            'serialize_seconds_total', 'counter', 'Time spent serializing and rendering responses by view and method.',
+            [('', by, stats.timings.get('serialize', 0.0)) for by, stats in snapshot],
+        )
+
+    lines += family(
+        'response_cache_events_total', 'counter', 'Trip response cache lookups and waits by outcome.',
+        [('', {'event': event}, count) for event, count in response_cache.stats().items()],
+    )
+    if slow_queries.enabled():
+        top = slow_queries.top()
+        lines += family(
+            'db_query_fingerprint_seconds_total', 'counter', 'Sampled SQL time of the slowest query fingerprints.',
+            [('', {'fingerprint': sql}, seconds) for sql, _, seconds in top],
+        )
+        lines += family(
+            'db_query_fingerprint_total', 'counter', 'Sampled SQL queries of the slowest query fingerprints.',
+            [('', {'fingerprint': sql}, count) for sql, count, _ in top],
+        )
+    return '\n'.join(lines) + '\n'
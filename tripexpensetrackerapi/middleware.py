@@ -0,0 +1,109 @@
+import asyncio
+from django.conf import settings
+from django.core.handlers.asgi import ASGIRequest
+from django.utils.decorators import sync_and_async_middleware
+from tripexpensetrackerapi import metrics, profiling
+from tripexpensetrackerapi.catalog import request_stamps
+from tripexpensetrackerapi.routers import RequestRouting, current_request
+
+
+@sync_and_async_middleware
+def asgi_urlconf_middleware(get_response):
+    """Resolve requests served over ASGI with settings.ASGI_ROOT_URLCONF, which maps the read endpoints to async views."""
+
+    def use_asgi_urlconf(request):
+        if isinstance(request, ASGIRequest):
+            request.urlconf = settings.ASGI_ROOT_URLCONF
+
+    if asyncio.iscoroutinefunction(get_response):
+        async def middleware(request):
+            use_asgi_urlconf(request)
+            return await get_response(request)
+    else:
+        def middleware(request):
+            use_asgi_urlconf(request)
+            return get_response(request)
+    return middleware
+
+
+@sync_and_async_middleware
+def replica_routing_middleware(get_response):
+    """Let ReadReplicaRouter send the queries of GET and HEAD requests to read replicas."""
+
+    def routing(request):
+        return RequestRouting(read_only=request.method in ('GET', 'HEAD'))
+
+    if asyncio.iscoroutinefunction(get_response):
+        async def middleware(request):
+            token = current_request.set(routing(request))
+            try:
+                return await get_response(request)
+            finally:
+                current_request.reset(token)
+    else:
+        def middleware(request):
+            token = current_request.set(routing(request))
+            try:
+                return get_response(request)
+            finally:
+                current_request.reset(token)
+    return middleware
+
+
+@sync_and_async_middleware
+def metrics_middleware(get_response):
+    """Record each request's queries, serialization and wall time (see metrics.py)."""
+
+    if asyncio.iscoroutinefunction(get_response):
+        async def middleware(request):
+            request_metrics = metrics.RequestMetrics()
+            token = metrics.current_metrics.set(request_metrics)
+            try:
+                response = await get_response(request)
+            finally:
+                metrics.current_metrics.reset(token)
+            return metrics.finish(request, response, request_metrics)
+    else:
+        def middleware(request):
+            request_metrics = metrics.RequestMetrics()
+            token = metrics.current_metrics.set(request_metrics)
+            try:
+                response = get_response(request)
+            finally:
+                metrics.current_metrics.reset(token)
+            return metrics.finish(request, response, request_metrics)
+    return middleware
+
+
+@sync_and_async_middleware
+def profiling_middleware(get_response):
+    """Profile the requests profiling.should_profile() picks (see profiling.py)."""
+
+    if asyncio.iscoroutinefunction(get_response):
+        async def middleware(request):
+            return await profiling.arun(get_response, request)
+    else:
+        def middleware(request):
+            return profiling.run(get_response, request)
+    return middleware
+
+
+@sync_and_async_middleware
+def catalog_middleware(get_response):
+    """Let each request read the shared catalog version stamps once (see catalog.py)."""
+
+    if asyncio.iscoroutinefunction(get_response):
+        async def middleware(request):
+            token = request_stamps.set({})
+            try:
+                return await get_response(request)
+            finally:
+                request_stamps.reset(token)
+    else:
+        def middleware(request):
+            token = request_stamps.set({})
+            try:
+                return get_response(request)
+            finally:
+                request_stamps.reset(token)
+    return middleware
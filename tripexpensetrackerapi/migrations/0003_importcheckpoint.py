@@ -0,0 +1,25 @@
+# Generated by Django 4.1.3 on 2026-10-17 10:05
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tripexpensetrackerapi', '0002_alter_expense_amount'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ImportCheckpoint',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('source', models.CharField(max_length=255)),
+                ('rows_committed', models.PositiveIntegerField(default=0)),
+                ('completed', models.BooleanField(default=False)),
+                ('trip', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, to='tripexpensetrackerapi.trip')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='tripexpensetrackerapi.user')),
+            ],
+        ),
+    ]
@@ -0,0 +1,39 @@
+# Generated by Django 4.1.3 on 2026-10-17 10:06
+
+from django.db import migrations, models
+from django.db.models import Count, Min
+
+
+def merge_duplicate_users(apps, schema_editor):
+    """Keep the oldest user for each uid and move everything owned by the others onto it."""
+    User = apps.get_model('tripexpensetrackerapi', 'User')
+    owned_models = [
+        apps.get_model('tripexpensetrackerapi', name)
+        for name in ('Trip', 'Expense', 'ImportCheckpoint')
+    ]
+    duplicates = (
+        User.objects.values('uid')
+        .annotate(count=Count('id'), keep=Min('id'))
+        .filter(count__gt=1)
+    )
+    for duplicate in duplicates:
+        others = User.objects.filter(uid=duplicate['uid']).exclude(pk=duplicate['keep'])
+        for model in owned_models:
+            model.objects.filter(user__in=others).update(user_id=duplicate['keep'])
+        others.delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tripexpensetrackerapi', '0003_importcheckpoint'),
+    ]
+
+    operations = [
+        migrations.RunPython(merge_duplicate_users, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name='user',
+            name='uid',
+            field=models.CharField(max_length=51, unique=True),
+        ),
+    ]
@@ -0,0 +1,30 @@
+# Generated by Django 4.1.3 on 2026-10-17 10:55
+
+from django.db import migrations, models
+from django.db.models import Min
+
+
+def remove_duplicate_links(apps, schema_editor):
+    """Keep the oldest link for each (expense, category) pair and delete the rest in one statement."""
+    ExpenseCategory = apps.get_model('tripexpensetrackerapi', 'ExpenseCategory')
+    oldest = (
+        ExpenseCategory.objects.values('expense_id', 'category_id')
+        .annotate(keep=Min('id'))
+        .values('keep')
+    )
+    ExpenseCategory.objects.exclude(pk__in=oldest).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tripexpensetrackerapi', '0005_updated_at'),
+    ]
+
+    operations = [
+        migrations.RunPython(remove_duplicate_links, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='expensecategory',
+            constraint=models.UniqueConstraint(fields=('expense', 'category'), name='unique_expense_category'),
+        ),
+    ]
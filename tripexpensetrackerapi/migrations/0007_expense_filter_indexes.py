@@ -0,0 +1,54 @@
+# Generated by Django 4.1.3 on 2026-10-17 10:32
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tripexpensetrackerapi', '0006_unique_expense_category'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='expense',
+            name='trip',
+            field=models.ForeignKey(blank=True, db_index=False, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='expenses', to='tripexpensetrackerapi.trip'),
+        ),
+        migrations.AlterField(
+            model_name='expense',
+            name='user',
+            field=models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, to='tripexpensetrackerapi.user'),
+        ),
+        migrations.AlterField(
+            model_name='expensecategory',
+            name='category',
+            field=models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, to='tripexpensetrackerapi.category'),
+        ),
+        migrations.AlterField(
+            model_name='expensecategory',
+            name='expense',
+            field=models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, related_name='categories', to='tripexpensetrackerapi.expense'),
+        ),
+        migrations.AddIndex(
+            model_name='expense',
+            index=models.Index(fields=['user', 'date'], name='expense_user_date_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='expense',
+            index=models.Index(fields=['trip', 'date'], name='expense_trip_date_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='expense',
+            index=models.Index(fields=['date'], name='expense_date_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='expense',
+            index=models.Index(fields=['amount'], name='expense_amount_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='expensecategory',
+            index=models.Index(fields=['category', 'expense'], name='expensecategory_cat_exp_idx'),
+        ),
+    ]
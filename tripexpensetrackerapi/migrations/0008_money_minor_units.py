@@ -0,0 +1,68 @@
+from django.db import migrations, models
+from django.db.models import F
+from django.db.models.functions import Cast, Round
+import tripexpensetrackerapi.money
+
+
+def amounts_to_minor_units(apps, schema_editor):
+    # Every existing expense is in the home currency, which has cents
+    Expense = apps.get_model('tripexpensetrackerapi', 'Expense')
+    Expense.objects.update(amount_minor=Cast(Round(F('amount') * 100), models.BigIntegerField()))
+
+
+def amounts_from_minor_units(apps, schema_editor):
+    Expense = apps.get_model('tripexpensetrackerapi', 'Expense')
+    Expense.objects.update(amount=Cast(F('amount_minor'), models.FloatField()) / 100)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tripexpensetrackerapi', '0007_expense_filter_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='FxRate',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('currency', models.CharField(max_length=3)),
+                ('date', models.DateField()),
+                ('rate', models.BigIntegerField()),
+            ],
+        ),
+        migrations.AddConstraint(
+            model_name='fxrate',
+            constraint=models.UniqueConstraint(fields=('currency', 'date'), name='unique_fx_rate'),
+        ),
+        migrations.AddField(
+            model_name='expense',
+            name='currency',
+            field=models.CharField(default=tripexpensetrackerapi.money.home_currency, max_length=3),
+        ),
+        migrations.AddField(
+            model_name='expense',
+            name='amount_minor',
+            field=models.BigIntegerField(default=0),
+            preserve_default=False,
+        ),
+        # Nullable while it is dropped, so migrating backwards can re-add it before filling it in
+        migrations.AlterField(
+            model_name='expense',
+            name='amount',
+            field=models.DecimalField(decimal_places=2, max_digits=12, null=True),
+        ),
+        migrations.RunPython(amounts_to_minor_units, amounts_from_minor_units),
+        migrations.RemoveIndex(
+            model_name='expense',
+            name='expense_amount_idx',
+        ),
+        migrations.RemoveField(
+            model_name='expense',
+            name='amount',
+        ),
+        migrations.AddIndex(
+            model_name='expense',
+            index=models.Index(fields=['amount_minor'], name='expense_amount_idx'),
+        ),
+    ]
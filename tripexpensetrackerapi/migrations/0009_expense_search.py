@@ -0,0 +1,60 @@
+from django.db import migrations
+
+
+class SQLiteRunSQL(migrations.RunSQL):
+    """RunSQL that does nothing on databases other than SQLite, which have no FTS5."""
+
+    def database_forwards(self, app_label, schema_editor, from_state, to_state):
+        if schema_editor.connection.vendor == 'sqlite':
+            super().database_forwards(app_label, schema_editor, from_state, to_state)
+
+    def database_backwards(self, app_label, schema_editor, from_state, to_state):
+        if schema_editor.connection.vendor == 'sqlite':
+            super().database_backwards(app_label, schema_editor, from_state, to_state)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tripexpensetrackerapi', '0008_money_minor_units'),
+    ]
+
+    # The schema as of this migration, written out rather than taken from search.py, which may change later
+    operations = [
+        SQLiteRunSQL(
+            [
+                """CREATE VIRTUAL TABLE tripexpensetrackerapi_expense_fts USING fts5(
+                    name, description, user_id, content='tripexpensetrackerapi_expense', content_rowid='id',
+                    tokenize='unicode61 remove_diacritics 2'
+                )""",
+                """CREATE TRIGGER tripexpensetrackerapi_expense_fts_insert AFTER INSERT ON tripexpensetrackerapi_expense
+                BEGIN
+                    INSERT INTO tripexpensetrackerapi_expense_fts(rowid, name, description, user_id)
+                        VALUES (new.id, new.name, new.description, new.user_id);
+                END""",
+                """CREATE TRIGGER tripexpensetrackerapi_expense_fts_delete AFTER DELETE ON tripexpensetrackerapi_expense
+                BEGIN
+                    INSERT INTO tripexpensetrackerapi_expense_fts(
+                        tripexpensetrackerapi_expense_fts, rowid, name, description, user_id
+                    ) VALUES ('delete', old.id, old.name, old.description, old.user_id);
+                END""",
+                """CREATE TRIGGER tripexpensetrackerapi_expense_fts_update AFTER UPDATE OF name, description, user_id
+                    ON tripexpensetrackerapi_expense
+                BEGIN
+                    INSERT INTO tripexpensetrackerapi_expense_fts(
+                        tripexpensetrackerapi_expense_fts, rowid, name, description, user_id
+                    ) VALUES ('delete', old.id, old.name, old.description, old.user_id);
+                    INSERT INTO tripexpensetrackerapi_expense_fts(rowid, name, description, user_id)
+                        VALUES (new.id, new.name, new.description, new.user_id);
+                END""",
+                # Indexes the existing expenses
+                "INSERT INTO tripexpensetrackerapi_expense_fts(tripexpensetrackerapi_expense_fts) VALUES ('rebuild')",
+            ],
+            [
+                'DROP TRIGGER tripexpensetrackerapi_expense_fts_update',
+                'DROP TRIGGER tripexpensetrackerapi_expense_fts_delete',
+                'DROP TRIGGER tripexpensetrackerapi_expense_fts_insert',
+                'DROP TABLE tripexpensetrackerapi_expense_fts',
+            ],
+        ),
+    ]
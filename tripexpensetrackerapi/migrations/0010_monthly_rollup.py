@@ -0,0 +1,94 @@
+from itertools import chain
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import Case, Count, ExpressionWrapper, F, OuterRef, Subquery, Sum, Value, When
+from django.db.models.functions import TruncMonth
+import django.db.models.deletion
+
+# fx.RATE_SCALE when this migration was written
+RATE_SCALE = 10 ** 6
+
+
+def build_rollups(apps, schema_editor):
+    # Counts the expenses that already exist, converted as fx.home_value() does, with the models as of this migration
+    alias = schema_editor.connection.alias
+    Expense = apps.get_model('tripexpensetrackerapi', 'Expense')
+    ExpenseCategory = apps.get_model('tripexpensetrackerapi', 'ExpenseCategory')
+    FxRate = apps.get_model('tripexpensetrackerapi', 'FxRate')
+    MonthlyRollup = apps.get_model('tripexpensetrackerapi', 'MonthlyRollup')
+    home_currency = getattr(settings, 'HOME_CURRENCY', 'USD')
+
+    def home_value(prefix=''):
+        rate = (
+            FxRate.objects.using(alias)
+            .filter(currency=OuterRef(f'{prefix}currency'), date__lte=OuterRef(f'{prefix}date'))
+            .order_by('-date').values('rate')[:1]
+        )
+        return ExpressionWrapper(
+            F(f'{prefix}amount_minor') * Case(
+                When(**{f'{prefix}currency': home_currency}, then=Value(RATE_SCALE)),
+                default=Subquery(rate),
+                output_field=models.BigIntegerField(),
+            ),
+            output_field=models.BigIntegerField(),
+        )
+
+    totals = (
+        Expense.objects.using(alias).annotate(month=TruncMonth('date')).values('user_id', 'month')
+        .annotate(total=Sum(home_value()), count=Count('id')).order_by()
+    )
+    links = (
+        ExpenseCategory.objects.using(alias).annotate(month=TruncMonth('expense__date'))
+        .values('expense__user_id', 'month', 'category_id')
+        .annotate(total=Sum(home_value('expense__')), count=Count('id')).order_by()
+    )
+    MonthlyRollup.objects.using(alias).bulk_create(
+        chain(
+            (
+                MonthlyRollup(user_id=row['user_id'], month=row['month'], total=row['total'] or 0, count=row['count'])
+                for row in totals
+            ),
+            (
+                MonthlyRollup(
+                    user_id=row['expense__user_id'], month=row['month'], category_id=row['category_id'],
+                    total=row['total'] or 0, count=row['count'],
+                )
+                for row in links
+            ),
+        ),
+        batch_size=500,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tripexpensetrackerapi', '0009_expense_search'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='MonthlyRollup',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('month', models.DateField()),
+                ('total', models.BigIntegerField(default=0)),
+                ('count', models.IntegerField(default=0)),
+                ('category', models.ForeignKey(blank=True, db_index=False, null=True, on_delete=django.db.models.deletion.CASCADE, to='tripexpensetrackerapi.category')),
+                ('user', models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, to='tripexpensetrackerapi.user')),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='monthlyrollup',
+            index=models.Index(fields=['category'], name='monthlyrollup_category_idx'),
+        ),
+        migrations.AddConstraint(
+            model_name='monthlyrollup',
+            constraint=models.UniqueConstraint(fields=('user', 'month', 'category'), name='unique_monthly_rollup'),
+        ),
+        migrations.AddConstraint(
+            model_name='monthlyrollup',
+            constraint=models.UniqueConstraint(condition=models.Q(('category__isnull', True)), fields=('user', 'month'), name='unique_monthly_total'),
+        ),
+        migrations.RunPython(build_rollups, migrations.RunPython.noop),
+    ]
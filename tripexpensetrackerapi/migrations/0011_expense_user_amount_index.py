@@ -0,0 +1,17 @@
+# Generated by Django 4.1.3 on 2026-10-17 12:02
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tripexpensetrackerapi', '0010_monthly_rollup'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='expense',
+            index=models.Index(fields=['user', 'currency', 'amount_minor', 'date'], name='expense_user_amount_idx'),
+        ),
+    ]
@@ -3,3 +3,6 @@ from .trip import Trip
 from .expense import Expense
 from .category import Category
 from .expense_category import ExpenseCategory
+from .import_checkpoint import ImportCheckpoint
+from .fx_rate import FxRate
+from .monthly_rollup import MonthlyRollup
@@ -2,3 +2,4 @@ from django.db import models
 
 class Category(models.Model):
     name = models.CharField(max_length=51)
+    updated_at = models.DateTimeField(auto_now=True)
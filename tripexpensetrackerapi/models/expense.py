@@ -1,12 +1,47 @@
 from django.db import models
 from django.utils import timezone
+from tripexpensetrackerapi import money
 from .user import User
 from .trip import Trip
 
 class Expense(models.Model):
     name = models.CharField(max_length=51)
-    amount = models.DecimalField(max_digits=12, decimal_places=2)
+    # In minor units of `currency` (see money.py); the `amount` property reads and writes it as a Decimal
+    amount_minor = models.BigIntegerField()
+    currency = models.CharField(max_length=3, default=money.home_currency)
     description = models.TextField()
     date = models.DateField()
-    user = models.ForeignKey(User, on_delete=models.CASCADE)
-    trip = models.ForeignKey(Trip, on_delete=models.CASCADE, related_name='expenses', null=True, blank=True)
+    # Indexed by the (user, date) and (trip, date) indexes below, which also serve lookups by user or trip alone
+    user = models.ForeignKey(User, on_delete=models.CASCADE, db_index=False)
+    trip = models.ForeignKey(
+        Trip, on_delete=models.CASCADE, related_name='expenses', null=True, blank=True, db_index=False
+    )
+    # Also bumped whenever the expense's categories change
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        # Back the expense list's filters and orderings (see filters.py)
+        indexes = [
+            models.Index(fields=['user', 'date'], name='expense_user_date_idx'),
+            models.Index(fields=['trip', 'date'], name='expense_trip_date_idx'),
+            models.Index(fields=['date'], name='expense_date_idx'),
+            models.Index(fields=['amount_minor'], name='expense_amount_idx'),
+            # Amounts of one currency (see filters.py); holding every column analytics.py loads, it covers those reads
+            models.Index(fields=['user', 'currency', 'amount_minor', 'date'], name='expense_user_amount_idx'),
+        ]
+
+    @property
+    def amount(self):
+        return None if self.amount_minor is None else money.from_minor(self.amount_minor, self.currency)
+
+    @amount.setter
+    def amount(self, value):
+        # Uses the expense's current currency, so set `currency` first
+        self.amount_minor = money.to_minor(value, self.currency)
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # Remembers the trip the expense was loaded with, so moving it can bump both trips
+        instance.loaded_trip_id = instance.__dict__.get('trip_id')
+        return instance
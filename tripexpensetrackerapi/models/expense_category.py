@@ -3,5 +3,14 @@ from .expense import Expense
 from .category import Category
 
 class ExpenseCategory(models.Model):
-    expense = models.ForeignKey(Expense, on_delete=models.CASCADE, related_name='categories')
-    category = models.ForeignKey(Category, on_delete=models.CASCADE)
+    # Indexed by the unique (expense, category) constraint and the (category, expense) index
+    expense = models.ForeignKey(Expense, on_delete=models.CASCADE, related_name='categories', db_index=False)
+    category = models.ForeignKey(Category, on_delete=models.CASCADE, db_index=False)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['expense', 'category'], name='unique_expense_category'),
+        ]
+        indexes = [
+            models.Index(fields=['category', 'expense'], name='expensecategory_cat_exp_idx'),
+        ]
@@ -0,0 +1,17 @@
+from django.db import models
+
+class FxRate(models.Model):
+    """An exchange rate into the home currency, in effect from `date` until the currency's next rate.
+
+    `rate` is the value of one minor unit of `currency` in minor units of
+    settings.HOME_CURRENCY, times fx.RATE_SCALE (see fx.py).
+    """
+    currency = models.CharField(max_length=3)
+    date = models.DateField()
+    rate = models.BigIntegerField()
+
+    class Meta:
+        # Also serves looking up the latest rate on or before a date
+        constraints = [
+            models.UniqueConstraint(fields=['currency', 'date'], name='unique_fx_rate'),
+        ]
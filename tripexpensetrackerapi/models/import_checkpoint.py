@@ -0,0 +1,11 @@
+from django.db import models
+from .user import User
+from .trip import Trip
+
+class ImportCheckpoint(models.Model):
+    """How far `manage.py import_expenses` got through a file, saved with each committed batch."""
+    source = models.CharField(max_length=255)
+    user = models.ForeignKey(User, on_delete=models.CASCADE)
+    trip = models.ForeignKey(Trip, on_delete=models.CASCADE, null=True, blank=True)
+    rows_committed = models.PositiveIntegerField(default=0)
+    completed = models.BooleanField(default=False)
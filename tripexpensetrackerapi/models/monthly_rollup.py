@@ -0,0 +1,31 @@
+from django.db import models
+from .user import User
+from .category import Category
+
+class MonthlyRollup(models.Model):
+    """A user's spending in one month, in one category or (with no category) in all of them.
+
+    `total` is the month's fx.home_value() sum, the home currency amount
+    times fx.RATE_SCALE. An expense in several categories counts towards each
+    of their rows but only once towards the month's row. Kept in step with
+    the expenses by rollups.py.
+    """
+    user = models.ForeignKey(User, on_delete=models.CASCADE, db_index=False)
+    month = models.DateField()
+    category = models.ForeignKey(Category, on_delete=models.CASCADE, null=True, blank=True, db_index=False)
+    total = models.BigIntegerField(default=0)
+    count = models.IntegerField(default=0)
+
+    class Meta:
+        # The first also serves the dashboard's range of months for a user
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'month', 'category'], name='unique_monthly_rollup'),
+            # NULLs are distinct in a unique index, so the all-categories row needs its own
+            models.UniqueConstraint(
+                fields=['user', 'month'], condition=models.Q(category__isnull=True), name='unique_monthly_total',
+            ),
+        ]
+        indexes = [
+            # Lets a category's deletion cascade to its rollups without a scan
+            models.Index(fields=['category'], name='monthlyrollup_category_idx'),
+        ]
@@ -6,3 +6,5 @@ class Trip(models.Model):
     date = models.DateField()
     description = models.TextField()
     user = models.ForeignKey(User, on_delete=models.CASCADE, default=1)
+    # Also bumped whenever one of the trip's expenses or their categories change
+    updated_at = models.DateTimeField(auto_now=True)
@@ -0,0 +1,76 @@
+"""Money amounts as integers in minor units.
+
+An expense stores its amount as a whole number of its currency's minor unit
+(cents for USD, yen for JPY, fils for KWD) next to the ISO 4217 currency
+code, so sums are integer arithmetic in the database rather than Decimal
+math in Python. The API still reads and writes amounts as decimal strings
+with as many decimal places as the currency has; these helpers convert
+between the two. fx.py converts amounts to settings.HOME_CURRENCY.
+"""
+import re
+from decimal import Decimal, InvalidOperation
+from django.conf import settings
+
+# ISO 4217 currencies whose minor unit is not a hundredth of the major unit
+EXPONENTS = {
+    'BHD': 3, 'BIF': 0, 'CLP': 0, 'DJF': 0, 'GNF': 0, 'IQD': 3, 'ISK': 0, 'JOD': 3, 'JPY': 0, 'KMF': 0,
+    'KRW': 0, 'KWD': 3, 'LYD': 3, 'OMR': 3, 'PYG': 0, 'RWF': 0, 'TND': 3, 'UGX': 0, 'UYI': 0, 'VND': 0,
+    'VUV': 0, 'XAF': 0, 'XOF': 0, 'XPF': 0,
+}
+
+# The largest amount a DecimalField(max_digits=12, decimal_places=2) held, in cents
+MAX_MINOR = 10 ** 12 - 1
+
+CURRENCY_CODE = re.compile(r'^[A-Z]{3}$')
+
+
+class InvalidAmount(ValueError):
+    """Raised for an amount or currency that cannot be stored."""
+
+
+def home_currency():
+    """The currency totals are converted to, settings.HOME_CURRENCY."""
+    return getattr(settings, 'HOME_CURRENCY', 'USD')
+
+
+def exponent(currency):
+    """How many decimal places `currency` has."""
+    return EXPONENTS.get(currency, 2)
+
+
+def parse_currency(value):
+    """A currency code from a request, the home currency when it is empty."""
+    if value in (None, ''):
+        return home_currency()
+    currency = str(value).strip().upper()
+    if not CURRENCY_CODE.match(currency):
+        raise InvalidAmount(f"Invalid currency '{value}'")
+    return currency
+
+
+def to_minor(amount, currency):
+    """`amount` (a Decimal, number or decimal string) as an integer number of `currency`'s minor unit."""
+    try:
+        value = Decimal(str(amount).strip())
+    except InvalidOperation as ex:
+        raise InvalidAmount(f"Invalid amount '{amount}'") from ex
+    if not value.is_finite():
+        raise InvalidAmount(f"Invalid amount '{amount}'")
+    minor = value.scaleb(exponent(currency))
+    if minor != minor.to_integral_value():
+        raise InvalidAmount(f'{currency} amounts have at most {exponent(currency)} decimal places')
+    if abs(minor) > MAX_MINOR:
+        raise InvalidAmount(f"Amount '{amount}' is too large")
+    return int(minor)
+
+
+def from_minor(minor, currency):
+    """An integer number of `currency`'s minor unit as a Decimal amount."""
+    return Decimal(minor).scaleb(-exponent(currency))
+
+
+def format_amount(minor, currency):
+    """Render minor units the way the API does: a string with the currency's decimal places."""
+    if minor is None:
+        return None
+    return f'{from_minor(minor, currency):.{exponent(currency)}f}'
@@ -0,0 +1,159 @@
+import base64
+import json
+from django.conf import settings
+from django.core.exceptions import ValidationError
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db.models import Q
+from rest_framework.response import Response
+from rest_framework.utils.urls import replace_query_param
+
+
+class InvalidCursor(Exception):
+    """Raised when a request carries a cursor this paginator did not issue."""
+
+
+class KeysetPagination:
+    """Cursor pagination that seeks past the last row of the previous page.
+
+    `ordering` must end in a unique field so every row has a distinct
+    position. The cursor is the ordering values of the last row on the page,
+    so fetching any page is a single indexed range query instead of an
+    OFFSET scan over every row before it.
+    """
+
+    cursor_query_param = 'cursor'
+    page_size_query_param = 'page_size'
+
+    def __init__(self, ordering=('id',)):
+        self.ordering = tuple(ordering)
+        self.page_size = getattr(settings, 'PAGINATION_PAGE_SIZE', 50)
+        self.max_page_size = getattr(settings, 'PAGINATION_MAX_PAGE_SIZE', 200)
+
+    def paginate_queryset(self, queryset, request):
+        """Return the requested page of `queryset` as a list.
+
+        `queryset` may also be a values()/values_list() queryset, for callers
+        that only need a few columns of the page.
+        """
+        return self.set_page(list(self.page_queryset(queryset, request)))
+
+    async def apaginate_queryset(self, queryset, request):
+        """paginate_queryset() for async views."""
+        return self.set_page([row async for row in self.page_queryset(queryset, request)])
+
+    def page_queryset(self, queryset, request):
+        """Slice of `queryset` holding the requested page plus one row."""
+        self.request = request
+        self.size = self.get_page_size(request)
+        cursor = self.decode_cursor(request)
+
+        queryset = queryset.order_by(*self.ordering)
+        if cursor is not None:
+            try:
+                queryset = queryset.filter(self.seek_filter(cursor))
+            except (ValidationError, ValueError, TypeError) as ex:
+                raise InvalidCursor() from ex
+
+        # Fetches one extra row to learn whether there is a next page
+        return queryset[:self.size + 1]
+
+    def set_page(self, page):
+        self.has_next = len(page) > self.size
+        page = page[:self.size]
+        self.last = page[-1] if page else None
+        return page
+
+    def paginate_list(self, rows, request):
+        """Return the requested page of `rows`, an in-memory list of dicts in ascending `ordering`."""
+        self.request = request
+        size = self.get_page_size(request)
+        cursor = self.decode_cursor(request)
+
+        start = 0
+        if cursor is not None:
+            fields = [name.lstrip('-') for name in self.ordering]
+            try:
+                start = next(
+                    (index for index, row in enumerate(rows) if [row[name] for name in fields] > cursor),
+                    len(rows),
+                )
+            except TypeError as ex:
+                raise InvalidCursor() from ex
+
+        self.size = size
+        return self.set_page(rows[start:start + size + 1])
+
+    def paginate_rows(self, fetch, request):
+        """Return the requested page of rows from `fetch(cursor, limit)`, for queries the ORM cannot express.
+
+        `fetch` returns up to `limit` dicts in `ordering` that come after the
+        decoded `cursor` (None for the first page), and raises ValueError or
+        TypeError for a cursor it cannot use.
+        """
+        self.request = request
+        self.size = self.get_page_size(request)
+        cursor = self.decode_cursor(request)
+        try:
+            return self.set_page(list(fetch(cursor, self.size + 1)))
+        except (ValueError, TypeError) as ex:
+            raise InvalidCursor() from ex
+
+    def get_paginated_response(self, data):
+        """Wrap serialized page data with the link to the next page."""
+        return Response(self.get_paginated_data(data))
+
+    def get_paginated_data(self, data):
+        return {'next': self.get_next_link(), 'results': data}
+
+    def get_page_size(self, request):
+        try:
+            size = int(request.query_params[self.page_size_query_param])
+        except (KeyError, ValueError):
+            return self.page_size
+        return max(1, min(size, self.max_page_size))
+
+    def get_next_link(self):
+        if not self.has_next:
+            return None
+        url = self.request.build_absolute_uri()
+        return replace_query_param(url, self.cursor_query_param, self.encode_cursor(self.last))
+
+    def seek_filter(self, cursor):
+        """Build `(f1, f2, ...) > (v1, v2, ...)` honouring each field's direction.
+
+        The leading `f1 >= v1` bound is redundant but lets the database use an
+        index range scan on the first ordering column.
+        """
+        fields = [(name.lstrip('-'), name.startswith('-')) for name in self.ordering]
+        first, first_descending = fields[0]
+        condition = Q()
+        equal = Q()
+        for (name, descending), value in zip(fields, cursor):
+            lookup = 'lt' if descending else 'gt'
+            condition |= equal & Q(**{f'{name}__{lookup}': value})
+            equal &= Q(**{name: value})
+        bound = Q(**{f"{first}__{'lte' if first_descending else 'gte'}": cursor[0]})
+        return bound & condition
+
+    def encode_cursor(self, row):
+        values = [self.row_value(row, name.lstrip('-')) for name in self.ordering]
+        payload = json.dumps(values, cls=DjangoJSONEncoder, separators=(',', ':'))
+        return base64.urlsafe_b64encode(payload.encode()).decode()
+
+    def decode_cursor(self, request):
+        encoded = request.query_params.get(self.cursor_query_param)
+        if not encoded:
+            return None
+        try:
+            values = json.loads(base64.urlsafe_b64decode(encoded.encode()))
+        except (ValueError, TypeError) as ex:
+            raise InvalidCursor() from ex
+        if not isinstance(values, list) or len(values) != len(self.ordering):
+            raise InvalidCursor()
+        return values
+
+    @staticmethod
+    def row_value(row, name):
+        if isinstance(row, dict):
+            return row[name]
+        return getattr(row, name)
@@ -0,0 +1,155 @@
+"""Opt-in cProfile profiling of single requests.
+
+A request is profiled when it carries a valid signed `X-Profile` header
+(`manage.py profile_token` prints one; tokens expire after
+PROFILE_TOKEN_MAX_AGE seconds), or at random with probability
+PROFILE_SAMPLE_RATE, which is 0 by default. `profiling_middleware` runs the
+rest of the request under cProfile and writes the stats to PROFILE_DIR,
+keeping only the newest PROFILE_MAX_FILES files. File names carry the time,
+view, method, status, query count and duration, e.g.
+
+    20240101T120000.123456-TripView.retrieve-GET-200-7q-4012ms.prof
+
+and the response names its file in an `X-Profile-File` header.
+`manage.py profile_summary` aggregates the collected files.
+
+cProfile only sees the thread it runs in. For async views that is the event
+loop, so ORM calls handed to worker threads show up as time spent awaiting
+them, and other requests served on the loop meanwhile are included. Only
+one request per process is profiled at a time; a request that starts while
+another is being profiled is served unprofiled.
+"""
+import cProfile
+import logging
+import random
+import re
+import threading
+import time
+from datetime import datetime
+from pathlib import Path
+from django.conf import settings
+from django.core import signing
+from tripexpensetrackerapi import metrics
+
+logger = logging.getLogger(__name__)
+
+HEADER = 'HTTP_X_PROFILE'
+SALT = 'tripexpensetrackerapi.profiling'
+
+# Held while a request is profiled; Python 3.12+ allows one active profiler per process, and on older
+# versions a second one would silently take over the first's thread
+_active = threading.Lock()
+
+FILE_NAME = re.compile(
+    r'^(?P<time>\d{8}T\d{6}\.\d{6})-(?P<view>.+)-(?P<method>[A-Z]+)-(?P<status>\d{3})'
+    r'-(?P<queries>\d+)q-(?P<ms>\d+)ms\.prof$'
+)
+
+
+def make_token():
+    """A value for the `X-Profile` header, valid for PROFILE_TOKEN_MAX_AGE seconds."""
+    return signing.TimestampSigner(salt=SALT).sign('profile')
+
+
+def valid_token(token):
+    try:
+        signing.TimestampSigner(salt=SALT).unsign(token, max_age=getattr(settings, 'PROFILE_TOKEN_MAX_AGE', 3600))
+    except signing.BadSignature:
+        return False
+    return True
+
+
+def should_profile(request):
+    token = request.META.get(HEADER)
+    if token:
+        return valid_token(token)
+    rate = getattr(settings, 'PROFILE_SAMPLE_RATE', 0)
+    return rate > 0 and random.random() < rate
+
+
+def profile_dir():
+    return Path(getattr(settings, 'PROFILE_DIR', settings.BASE_DIR / 'profiles'))
+
+
+def start():
+    """Start and return a profiler, or None if another request is being profiled."""
+    if not _active.acquire(blocking=False):
+        return None
+    profiler = cProfile.Profile()
+    try:
+        profiler.enable()
+    except ValueError:
+        # Something outside this module is profiling the process
+        _active.release()
+        return None
+    return profiler
+
+
+def stop(profiler):
+    profiler.disable()
+    _active.release()
+
+
+def save(profiler, request, response, elapsed):
+    """Write the profile of a finished request to PROFILE_DIR and name its file in the response."""
+    request_metrics = metrics.current_metrics.get()
+    queries = request_metrics.queries if request_metrics is not None else 0
+    name = (
+        f"{datetime.now().strftime('%Y%m%dT%H%M%S.%f')}-{metrics.view_name(request)}-{request.method}"
+        f'-{response.status_code}-{queries}q-{round(elapsed * 1000)}ms.prof'
+    )
+    directory = profile_dir()
+    try:
+        directory.mkdir(parents=True, exist_ok=True)
+        profiler.dump_stats(directory / name)
+        rotate(directory)
+    except OSError:
+        logger.exception('Could not write profile %s', name)
+        return response
+    response['X-Profile-File'] = name
+    return response
+
+
+def rotate(directory):
+    """Delete the oldest profiles beyond PROFILE_MAX_FILES."""
+    files = sorted(path for path in directory.glob('*.prof') if FILE_NAME.match(path.name))
+    excess = len(files) - max(1, getattr(settings, 'PROFILE_MAX_FILES', 200))
+    for path in files[:max(0, excess)]:
+        path.unlink(missing_ok=True)
+
+
+def profile_files(directory=None):
+    """(path, tags) for each collected profile, oldest first; tags come from the file name."""
+    directory = Path(directory) if directory else profile_dir()
+    for path in sorted(directory.glob('*.prof')):
+        match = FILE_NAME.match(path.name)
+        if match:
+            yield path, match.groupdict()
+
+
+def run(get_response, request):
+    """Serve `request` with `get_response`, under cProfile if it should be profiled."""
+    profiler = start() if should_profile(request) else None
+    if profiler is None:
+        return get_response(request)
+
+    started = time.perf_counter()
+    try:
+        response = get_response(request)
+    finally:
+        stop(profiler)
+    return save(profiler, request, response, time.perf_counter() - started)
+
+
+async def arun(get_response, request):
+    """run() for async requests."""
+    profiler = start() if should_profile(request) else None
+    if profiler is None:
+        return await get_response(request)
+
+    started = time.perf_counter()
+    try:
+        response = await get_response(request)
+    finally:
+        stop(profiler)
+    return save(profiler, request, response, time.perf_counter() - started)
@@ -0,0 +1,271 @@
+"""Cache of serialized TripView responses, on top of Django's cache framework.
+
+Cached trip details are keyed by the trip's version and cached trip lists by
+the owning user's version. A version is a random token kept in the same
+cache; writes replace the tokens of exactly the trips (and owners) they
+touch, so stale entries are simply never looked up again and expire on their
+own. Because a lost version is replaced by a fresh token rather than reset,
+an evicted version can never resurrect an old entry.
+
+When a hot key is missing, only the worker that wins `cache.add` on a short
+lock rebuilds it; the others wait for its result instead of all serializing
+the same trip at once.
+
+Async views use the `a`-prefixed twins of these functions, which go through
+the backend's async API (`aget`, `aadd`, ...) so the event loop never waits
+on the cache.
+
+Works with any backend; use a shared one (file-based, memcached, ...) so
+every worker process sees the same versions.
+"""
+import asyncio
+import hashlib
+import threading
+import time
+import uuid
+from collections import Counter
+from django.conf import settings
+from django.core.cache import caches
+from django.db import transaction
+from tripexpensetrackerapi.lru import LRUCache
+from tripexpensetrackerapi.models import Trip
+
+# How long a worker may hold a rebuild lock, and how often waiters poll for its result
+LOCK_TIMEOUT = 10
+WAIT_INTERVAL = 0.05
+
+counters = Counter()
+_counters_lock = threading.Lock()
+
+# Keys this process stored recently, to tell evictions apart from cold misses
+_stored = LRUCache(max_size=10000)
+
+
+def get_cache():
+    return caches[getattr(settings, 'RESPONSE_CACHE_ALIAS', 'default')]
+
+
+def timeout():
+    return getattr(settings, 'RESPONSE_CACHE_TIMEOUT', 300)
+
+
+def count(name):
+    with _counters_lock:
+        counters[name] += 1
+
+
+def stats():
+    """Hit, miss, eviction and stampede-wait counts for this process."""
+    with _counters_lock:
+        return {name: counters[name] for name in ('hits', 'misses', 'evictions', 'waits')}
+
+
+def version(name):
+    """Return the current version token for `name`, creating one if there is none."""
+    cache = get_cache()
+    key = f'version:{name}'
+    token = cache.get(key)
+    if token is None:
+        cache.add(key, uuid.uuid4().hex, None)
+        token = cache.get(key)
+    return token
+
+
+async def aversion(name):
+    """Async version()."""
+    cache = get_cache()
+    key = f'version:{name}'
+    token = await cache.aget(key)
+    if token is None:
+        await cache.aadd(key, uuid.uuid4().hex, None)
+        token = await cache.aget(key)
+    return token
+
+
+def trip_key(trip_id, variant=''):
+    """Key of a trip's cached detail response; `variant` tells apart responses rendering different fields."""
+    return versioned_trip_key(trip_id, version(f'trip:{trip_id}'), variant)
+
+
+async def atrip_key(trip_id, variant=''):
+    return versioned_trip_key(trip_id, await aversion(f'trip:{trip_id}'), variant)
+
+
+def versioned_trip_key(trip_id, token, variant):
+    key = f'trip:{trip_id}:{token}'
+    if variant:
+        key += f':{hashlib.sha1(variant.encode()).hexdigest()}'
+    return key
+
+
+def trip_list_key(user_id, url):
+    return versioned_trip_list_key(user_id, version(f'user:{user_id}'), url)
+
+
+async def atrip_list_key(user_id, url):
+    return versioned_trip_list_key(user_id, await aversion(f'user:{user_id}'), url)
+
+
+def versioned_trip_list_key(user_id, token, url):
+    digest = hashlib.sha1(url.encode()).hexdigest()
+    return f'trips:user:{user_id}:{token}:{digest}'
+
+
+def get_or_build(key, build):
+    """Return the cached value for `key`, or build, store and return it.
+
+    Only one worker rebuilds a missing key at a time; others poll for its
+    result and only build it themselves if the lock holder gives up.
+    """
+    value = lookup(key)
+    if value is not None:
+        return value
+
+    acquired = acquire(key)
+    if not acquired:
+        deadline = time.monotonic() + LOCK_TIMEOUT
+        while time.monotonic() < deadline:
+            time.sleep(WAIT_INTERVAL)
+            value, waiting = poll(key)
+            if not waiting:
+                break
+        if value is not None:
+            return value
+
+    try:
+        return store(key, build())
+    finally:
+        # A worker that gave up waiting must leave the holder's lock alone
+        if acquired:
+            release(key)
+
+
+async def aget_or_build(key, build):
+    """get_or_build() for async views: `build` is a coroutine function, and waiting yields to the event loop."""
+    value = await alookup(key)
+    if value is not None:
+        return value
+
+    acquired = await aacquire(key)
+    if not acquired:
+        deadline = time.monotonic() + LOCK_TIMEOUT
+        while time.monotonic() < deadline:
+            await asyncio.sleep(WAIT_INTERVAL)
+            value, waiting = await apoll(key)
+            if not waiting:
+                break
+        if value is not None:
+            return value
+
+    try:
+        return await astore(key, await build())
+    finally:
+        # A worker that gave up waiting must leave the holder's lock alone
+        if acquired:
+            await arelease(key)
+
+
+def lookup(key):
+    """Return the cached value for `key` or None, counting the hit or miss."""
+    return counted(key, get_cache().get(key))
+
+
+async def alookup(key):
+    return counted(key, await get_cache().aget(key))
+
+
+def counted(key, value):
+    """Count a lookup of `key` that found `value` as a hit or a miss, and return `value`."""
+    if value is not None:
+        count('hits')
+        return value
+
+    count('misses')
+    stored_at = _stored.get(key)
+    if stored_at is not None and time.monotonic() - stored_at < timeout():
+        count('evictions')
+    return None
+
+
+def acquire(key):
+    """Take the rebuild lock for `key`, or count a wait and return False if another worker holds it."""
+    return counted_lock(get_cache().add(f'{key}:lock', 1, LOCK_TIMEOUT))
+
+
+async def aacquire(key):
+    return counted_lock(await get_cache().aadd(f'{key}:lock', 1, LOCK_TIMEOUT))
+
+
+def counted_lock(acquired):
+    if not acquired:
+        count('waits')
+    return acquired
+
+
+def poll(key):
+    """Return (value, still waiting) while another worker rebuilds `key`."""
+    cache = get_cache()
+    value = cache.get(key)
+    if value is not None:
+        return value, False
+    return None, cache.get(f'{key}:lock') is not None
+
+
+async def apoll(key):
+    cache = get_cache()
+    value = await cache.aget(key)
+    if value is not None:
+        return value, False
+    return None, await cache.aget(f'{key}:lock') is not None
+
+
+def store(key, value):
+    get_cache().set(key, value, timeout())
+    _stored.set(key, time.monotonic())
+    return value
+
+
+async def astore(key, value):
+    await get_cache().aset(key, value, timeout())
+    _stored.set(key, time.monotonic())
+    return value
+
+
+def release(key):
+    get_cache().delete(f'{key}:lock')
+
+
+async def arelease(key):
+    await get_cache().adelete(f'{key}:lock')
+
+
+def bump(names):
+    """Replace the version tokens for `names`, now and again when the transaction commits.
+
+    The second bump stops a reader that rebuilt an entry from the
+    not-yet-committed state from having it served afterwards.
+    """
+    names = set(names)
+    if not names:
+        return
+
+    def replace_tokens():
+        get_cache().set_many({f'version:{name}': uuid.uuid4().hex for name in names}, None)
+
+    replace_tokens()
+    transaction.on_commit(replace_tokens)
+
+
+def bump_trips(trip_ids, user_ids=None):
+    """Invalidate cached details of these trips, and the trip lists of their owners."""
+    trip_ids = {trip_id for trip_id in trip_ids if trip_id is not None}
+    if not trip_ids:
+        return
+    if user_ids is None:
+        user_ids = Trip.objects.filter(pk__in=trip_ids).values_list('user_id', flat=True)
+    bump([f'trip:{trip_id}' for trip_id in trip_ids] + [f'user:{user_id}' for user_id in set(user_ids)])
+
+
+def bump_users(user_ids):
+    """Invalidate the cached trip lists of these users."""
+    bump(f'user:{user_id}' for user_id in user_ids)
@@ -0,0 +1,165 @@
+"""Per-user monthly spending rollups, kept in step with every expense write.
+
+A MonthlyRollup row holds a user's total and expense count for a month,
+either for one category or, with no category, for all of their expenses.
+The dashboard reads these rows alone, so its cost depends on the number of
+months shown rather than on how many expenses the user has.
+
+Writers change the rollups in the same transaction as the expenses:
+`add()` counts new expenses, `delete_expense_rows()` (deletes.py) uncounts
+the expenses it deletes, and `tracking()` wraps changes to existing
+expenses or their category links, counting the difference between before
+and after. Each is a couple of grouped queries over just the rows written
+plus two upserts (INSERT ... ON CONFLICT, which SQLite and PostgreSQL
+share), however many rows they touch. Since every expense write comes
+through here, `apply()` also tells analytics.py which users' expenses
+changed. An exchange rate change rebuilds the
+months it converts (see signals.py); `manage.py rebuild_rollups` rebuilds
+everything, for repair.
+"""
+from collections import defaultdict
+from contextlib import contextmanager
+from datetime import date
+from django.db import connections, router, transaction
+from django.db.models import Count, Sum
+from django.db.models.functions import TruncMonth
+from tripexpensetrackerapi import analytics, fx
+from tripexpensetrackerapi.models import Expense, ExpenseCategory, MonthlyRollup
+
+TABLE = MonthlyRollup._meta.db_table
+# The targets of the two unique constraints on MonthlyRollup; NULL categories need the partial one
+CATEGORY_CONFLICT = '(user_id, month, category_id)'
+TOTAL_CONFLICT = '(user_id, month) WHERE category_id IS NULL'
+UPSERT = (
+    f'INSERT INTO {TABLE} (user_id, month, category_id, total, count) VALUES {{values}} '
+    f'ON CONFLICT {{conflict}} DO UPDATE SET total = {TABLE}.total + excluded.total, '
+    f'count = {TABLE}.count + excluded.count'
+)
+# Five parameters a row, well under SQLite's limit on parameters per statement
+UPSERT_BATCH_SIZE = 500
+
+
+def month_of(day):
+    return day.replace(day=1)
+
+
+def deltas(expenses):
+    """The rollup rows of the `expenses` queryset, as {(user id, month, category id or None): [total, count]}."""
+    changes = defaultdict(lambda: [0, 0])
+    expenses = expenses.order_by()
+    totals = (
+        expenses.annotate(month=TruncMonth('date')).values('user_id', 'month')
+        .annotate(total=Sum(fx.home_value()), count=Count('id'))
+    )
+    links = (
+        ExpenseCategory.objects.filter(expense__in=expenses.values('id'))
+        .annotate(month=TruncMonth('expense__date')).values('expense__user_id', 'month', 'category_id')
+        .annotate(total=Sum(fx.home_value('expense__')), count=Count('id')).order_by()
+    )
+    for row in totals:
+        # A total is None only if an expense has lost its exchange rate
+        changes[(row['user_id'], row['month'], None)] = [row['total'] or 0, row['count']]
+    for row in links:
+        changes[(row['expense__user_id'], row['month'], row['category_id'])] = [row['total'] or 0, row['count']]
+    return changes
+
+
+def difference(after, before):
+    changes = defaultdict(lambda: [0, 0])
+    for key, (total, count) in after.items():
+        changes[key] = [total, count]
+    for key, (total, count) in before.items():
+        changes[key][0] -= total
+        changes[key][1] -= count
+    return changes
+
+
+def apply(changes):
+    """Add each change to its rollup row, creating rows as needed and deleting those left with no expenses."""
+    # Even a change that leaves every rollup as it was, like a new date in the same month, changes the analytics
+    analytics.expenses_changed(user_id for user_id, _, _ in changes)
+    connection = connections[router.db_for_write(MonthlyRollup)]
+    rows = [
+        (user_id, connection.ops.adapt_datefield_value(month), category_id, total, count)
+        for (user_id, month, category_id), (total, count) in changes.items() if total or count
+    ]
+    with connection.cursor() as cursor:
+        for conflict, selected in (
+            (CATEGORY_CONFLICT, [row for row in rows if row[2] is not None]),
+            (TOTAL_CONFLICT, [row for row in rows if row[2] is None]),
+        ):
+            for offset in range(0, len(selected), UPSERT_BATCH_SIZE):
+                batch = selected[offset:offset + UPSERT_BATCH_SIZE]
+                cursor.execute(
+                    UPSERT.format(values=', '.join(['(%s, %s, %s, %s, %s)'] * len(batch)), conflict=conflict),
+                    [value for row in batch for value in row],
+                )
+    # Only a change that uncounts expenses can empty a row
+    emptied = {row[0] for row in rows if row[4] < 0}
+    if emptied:
+        MonthlyRollup.objects.filter(user_id__in=emptied, count__lte=0).delete()
+
+
+def add(expenses):
+    """Count the new expenses in the `expenses` queryset, with their category links."""
+    apply(deltas(expenses))
+
+
+def remove(expenses):
+    """Uncount the expenses in the `expenses` queryset, which are about to be deleted."""
+    apply(difference({}, deltas(expenses)))
+
+
+@contextmanager
+def tracking(expenses):
+    """Count whatever the block changes about the expenses in the `expenses` queryset or their category links.
+
+    The queryset is evaluated before and after the block, so it must select
+    the same expenses both times, e.g. by id.
+    """
+    with transaction.atomic():
+        before = deltas(expenses)
+        yield
+        apply(difference(deltas(expenses), before))
+
+
+def rebuild(user_ids=None, since=None):
+    """Recompute the rollups of `user_ids` (or every user) from the month of `since` (or the start) on.
+
+    Returns the number of rollup rows written.
+    """
+    rollups = MonthlyRollup.objects.all()
+    expenses = Expense.objects.all()
+    if user_ids is not None:
+        rollups = rollups.filter(user_id__in=user_ids)
+        expenses = expenses.filter(user_id__in=user_ids)
+    if since is not None:
+        rollups = rollups.filter(month__gte=month_of(since))
+        expenses = expenses.filter(date__gte=month_of(since))
+    with transaction.atomic():
+        rollups.delete()
+        rows = MonthlyRollup.objects.bulk_create(
+            MonthlyRollup(user_id=user_id, month=month, category_id=category_id, total=total, count=count)
+            for (user_id, month, category_id), (total, count) in deltas(expenses).items()
+        )
+    return len(rows)
+
+
+def rates_changed(currency, since):
+    """Rebuild the months that a rate for `currency` from `since` on converts."""
+    since = fx.parse_day(since)
+    user_ids = list(
+        Expense.objects.filter(currency=currency, date__gte=since).values_list('user_id', flat=True).distinct()
+    )
+    if user_ids:
+        rebuild(user_ids, since)
+
+
+def months_back(count, today):
+    """The first days of the `count` months up to and including `today`'s, oldest first."""
+    year, month = today.year, today.month
+    months = []
+    for _ in range(count):
+        months.append(date(year, month, 1))
+        year, month = (year, month - 1) if month > 1 else (year - 1, 12)
+    return months[::-1]
@@ -0,0 +1,55 @@
+"""Database router sending request reads to read replicas.
+
+`replica_routing_middleware` marks GET and HEAD requests as reads. While a
+read request is being served, queries go to a random alias from
+settings.DATABASE_READ_REPLICAS; writes always go to the primary
+('default'), and once a request has written anything the rest of it reads
+from the primary too, so it sees its own writes. Queries outside a request
+(management commands, signals fired from scripts, tests) use the primary.
+
+Replicas are copies of the primary kept in step outside Django. A lagging
+replica can serve data a few moments old, which the trip response cache may
+then keep until its next invalidation or timeout.
+"""
+import random
+from contextvars import ContextVar
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS
+
+# The routing state of the request being served, shared by reference with
+# any worker threads its async views hand ORM calls to
+current_request = ContextVar('replica_routing', default=None)
+
+
+class RequestRouting:
+    def __init__(self, read_only):
+        self.read_only = read_only
+        self.pinned = False
+
+
+def replicas():
+    return getattr(settings, 'DATABASE_READ_REPLICAS', [])
+
+
+class ReadReplicaRouter:
+    """Read replicas for read requests, the primary for everything else."""
+
+    def db_for_read(self, model, **hints):
+        routing = current_request.get()
+        aliases = replicas()
+        if routing is None or not routing.read_only or routing.pinned or not aliases:
+            return DEFAULT_DB_ALIAS
+        return random.choice(aliases)
+
+    def db_for_write(self, model, **hints):
+        routing = current_request.get()
+        if routing is not None:
+            routing.pinned = True
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # Replicas hold the same rows as the primary
+        databases = {DEFAULT_DB_ALIAS, *replicas()}
+        if obj1._state.db in databases and obj2._state.db in databases:
+            return True
+        return None
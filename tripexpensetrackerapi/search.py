@@ -0,0 +1,135 @@
+"""Full-text search over expense names and descriptions with SQLite FTS5.
+
+`TABLE` is an external-content FTS5 index over the expense table: it keeps
+only the index and reads the text back from the expense rows themselves.
+Triggers on the expense table keep it in step with every insert, update and
+delete, including bulk_create(), bulk_update() and queryset updates and
+deletes that send no signals. The index also holds each expense's user_id
+as a word, so a search matches the user's rows within the index itself and
+its cost follows the number of that user's matches, not the size of the
+table.
+
+Django rebuilds a SQLite table to alter it, which drops its triggers, so a
+migration that alters the expense table must call `install()` again
+(`manage.py rebuild_search_index` also does, then re-indexes every row).
+"""
+import re
+from django.db import connections, router
+from tripexpensetrackerapi.models import Expense
+
+TABLE = 'tripexpensetrackerapi_expense_fts'
+# Matches in an expense's name count for more than matches in its description; user_id does not count
+RANK = f'bm25({TABLE}, 2.0, 1.0, 0.0)'
+MAX_TERMS = 16
+
+TERM = re.compile(r'"([^"]*)"?|(\S+)')
+WORD = re.compile(r'\w+')
+
+SCHEMA = (
+    f"""CREATE VIRTUAL TABLE IF NOT EXISTS {TABLE} USING fts5(
+        name, description, user_id, content='tripexpensetrackerapi_expense', content_rowid='id',
+        tokenize='unicode61 remove_diacritics 2'
+    )""",
+    f"""CREATE TRIGGER IF NOT EXISTS {TABLE}_insert AFTER INSERT ON tripexpensetrackerapi_expense BEGIN
+        INSERT INTO {TABLE}(rowid, name, description, user_id) VALUES (new.id, new.name, new.description, new.user_id);
+    END""",
+    f"""CREATE TRIGGER IF NOT EXISTS {TABLE}_delete AFTER DELETE ON tripexpensetrackerapi_expense BEGIN
+        INSERT INTO {TABLE}({TABLE}, rowid, name, description, user_id)
+            VALUES ('delete', old.id, old.name, old.description, old.user_id);
+    END""",
+    f"""CREATE TRIGGER IF NOT EXISTS {TABLE}_update AFTER UPDATE OF name, description, user_id
+            ON tripexpensetrackerapi_expense BEGIN
+        INSERT INTO {TABLE}({TABLE}, rowid, name, description, user_id)
+            VALUES ('delete', old.id, old.name, old.description, old.user_id);
+        INSERT INTO {TABLE}(rowid, name, description, user_id) VALUES (new.id, new.name, new.description, new.user_id);
+    END""",
+)
+DROP = (
+    f'DROP TRIGGER IF EXISTS {TABLE}_insert',
+    f'DROP TRIGGER IF EXISTS {TABLE}_delete',
+    f'DROP TRIGGER IF EXISTS {TABLE}_update',
+    f'DROP TABLE IF EXISTS {TABLE}',
+)
+
+
+class InvalidSearch(ValueError):
+    """Raised for a search query that cannot be run."""
+
+
+def supported(connection):
+    return connection.vendor == 'sqlite'
+
+
+def install(connection):
+    """Create the index and its triggers if they are missing; a no-op on databases other than SQLite."""
+    if not supported(connection):
+        return
+    with connection.cursor() as cursor:
+        for statement in SCHEMA:
+            cursor.execute(statement)
+
+
+def uninstall(connection):
+    if not supported(connection):
+        return
+    with connection.cursor() as cursor:
+        for statement in DROP:
+            cursor.execute(statement)
+
+
+def rebuild(connection):
+    """Re-index every expense, for backfills and after restoring a database."""
+    if not supported(connection):
+        return
+    install(connection)
+    with connection.cursor() as cursor:
+        cursor.execute(f"INSERT INTO {TABLE}({TABLE}) VALUES ('rebuild')")
+
+
+def parse_query(text):
+    """Turn a user's search into an FTS5 query.
+
+    Words must all match, in any order. "Quoted words" must match as a
+    phrase, and a term ending in * matches any word it starts, e.g. `hot*`
+    finds "hotel". Everything else is taken literally, so users cannot write
+    FTS5 syntax of their own.
+    """
+    terms = []
+    for match in TERM.finditer(text or ''):
+        phrase, word = match.groups()
+        term = phrase if phrase is not None else word
+        words = WORD.findall(term)
+        if not words:
+            continue
+        prefix = phrase is None and term.endswith('*')
+        terms.append('"{}"{}'.format(' '.join(words), '*' if prefix else ''))
+    if not terms:
+        raise InvalidSearch('q must contain at least one word')
+    if len(terms) > MAX_TERMS:
+        raise InvalidSearch(f'q may have at most {MAX_TERMS} terms')
+    return ' '.join(terms)
+
+
+def search(user_id, query, size, after=None):
+    """Ids and ranks of `user_id`'s expenses matching the parse_query() `query`, best first.
+
+    Returns up to `size` {'id', 'rank'} rows ordered by rank, then id; `after`
+    is the (rank, id) of the last row of the previous page. Ranks depend on
+    the whole index, so expenses written between two pages can move rows
+    across the page boundary.
+    """
+    connection = connections[router.db_for_read(Expense)]
+    if not supported(connection):
+        raise InvalidSearch('Search needs a SQLite database')
+    # Not aliased as `rank`, which is a hidden column of every FTS5 table
+    sql = f'SELECT rowid, {RANK} AS score FROM {TABLE} WHERE {TABLE} MATCH %s'
+    # Column filters keep the user's id and the query's words apart
+    params = [f'user_id:"{int(user_id)}" AND {{name description}}: ({query})']
+    if after is not None:
+        sql += f' AND ({RANK} > %s OR ({RANK} = %s AND rowid > %s))'
+        params += [after[0], after[0], after[1]]
+    sql += ' ORDER BY score, rowid LIMIT %s'
+    params.append(size)
+    with connection.cursor() as cursor:
+        cursor.execute(sql, params)
+        return [{'id': row[0], 'rank': row[1]} for row in cursor.fetchall()]
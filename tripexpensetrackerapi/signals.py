@@ -0,0 +1,119 @@
+from django.conf import settings
+from django.db import transaction
+from django.db.backends.signals import connection_created
+from django.db.models import Q
+from django.db.models.signals import post_delete, post_save, pre_delete
+from django.dispatch import receiver
+from tripexpensetrackerapi import fx, identity, metrics, response_cache, rollups
+from tripexpensetrackerapi.catalog import category_catalog
+from tripexpensetrackerapi.models import Category, Expense, ExpenseCategory, FxRate, Trip, User
+from tripexpensetrackerapi.timestamps import touch_expenses, touch_trips
+
+
+@receiver(post_save, sender=User)
+@receiver(post_delete, sender=User)
+def forget_cached_user(sender, instance, **kwargs):
+    """Drop a changed user from the identity cache now, and again once the change commits."""
+    identity.forget_user(instance)
+    transaction.on_commit(lambda: identity.forget_user(instance))
+
+
+@receiver(post_save, sender=User)
+def bump_user_trips(sender, instance, created, **kwargs):
+    """User details appear in their trip lists and in every trip they own or have expenses in."""
+    response_cache.bump_users([instance.id])
+    if not created:
+        trips = set(
+            Trip.objects.filter(Q(user_id=instance.id) | Q(expenses__user_id=instance.id))
+            .values_list('id', 'user_id')
+        )
+        response_cache.bump_trips([trip_id for trip_id, _ in trips], [user_id for _, user_id in trips])
+
+
+@receiver(post_save, sender=Category)
+@receiver(post_delete, sender=Category)
+def invalidate_category_catalog(sender, **kwargs):
+    """Make every process reload the category catalog, now and once the change commits."""
+    category_catalog.invalidate()
+    transaction.on_commit(category_catalog.invalidate)
+
+
+def category_trips(category):
+    """(trip id, owner id) pairs for the trips with an expense in `category`."""
+    return set(
+        Expense.objects.filter(categories__category_id=category.id, trip__isnull=False)
+        .values_list('trip_id', 'trip__user_id')
+    )
+
+
+@receiver(post_save, sender=Category)
+def bump_category_trips(sender, instance, created, **kwargs):
+    """A renamed category changes the cached responses of every trip that uses it."""
+    if not created:
+        trips = category_trips(instance)
+        response_cache.bump_trips([trip_id for trip_id, _ in trips], [user_id for _, user_id in trips])
+
+
+@receiver(pre_delete, sender=Category)
+def remember_category_trips(sender, instance, **kwargs):
+    # The category's links are gone by post_delete, so the affected trips are found first
+    instance.affected_trips = category_trips(instance)
+
+
+@receiver(post_delete, sender=Category)
+def bump_deleted_category_trips(sender, instance, **kwargs):
+    trips = getattr(instance, 'affected_trips', ())
+    response_cache.bump_trips([trip_id for trip_id, _ in trips], [user_id for _, user_id in trips])
+
+
+@receiver(post_save, sender=Trip)
+@receiver(post_delete, sender=Trip)
+def bump_trip(sender, instance, **kwargs):
+    """Invalidate a created, edited or deleted trip's cached responses."""
+    response_cache.bump_trips([instance.id], [instance.user_id])
+
+
+@receiver(post_save, sender=Expense)
+def touch_expense_trips(sender, instance, **kwargs):
+    """Bump the trip a saved expense belongs to, and the one it was moved from."""
+    touch_trips({instance.trip_id, getattr(instance, 'loaded_trip_id', None)})
+    instance.loaded_trip_id = instance.trip_id
+
+
+@receiver(post_save, sender=ExpenseCategory)
+def touch_categorized_expense(sender, instance, **kwargs):
+    """Bump the expense (and its trip) a category was linked to."""
+    touch_expenses([instance.expense_id])
+
+
+@receiver(post_delete, sender=FxRate)
+def protect_converted_expenses(sender, instance, **kwargs):
+    """Refuse a rate deletion that leaves expenses unconvertible; raising here rolls the delete back."""
+    fx.check_deletion(instance.currency, instance.date)
+
+
+@receiver(post_save, sender=FxRate)
+@receiver(post_delete, sender=FxRate)
+def invalidate_fx_rates(sender, instance, **kwargs):
+    """A changed rate changes the totals of trips and the monthly rollups of expenses it converts.
+
+    The analytics notice through the rates' version stamp, which fx.rates_changed() publishes.
+    """
+    fx.rates_changed(instance.currency, instance.date)
+    rollups.rates_changed(instance.currency, instance.date)
+
+
+@receiver(connection_created)
+def tune_sqlite_connection(sender, connection, **kwargs):
+    """Apply settings.SQLITE_PRAGMAS (WAL journaling, relaxed fsync) to each new SQLite connection."""
+    if connection.vendor == 'sqlite':
+        with connection.cursor() as cursor:
+            for name, value in getattr(settings, 'SQLITE_PRAGMAS', {}).items():
+                cursor.execute(f'PRAGMA {name} = {value}')
+
+
+@receiver(connection_created)
+def instrument_connection(sender, connection, **kwargs):
+    """Count and time every query on the connection for the request metrics."""
+    if metrics.record_query not in connection.execute_wrappers:
+        connection.execute_wrappers.append(metrics.record_query)
@@ -0,0 +1,84 @@
+"""Opt-in, sampled log of SQL time by query fingerprint.
+
+A fingerprint is the SQL with its literals and placeholders replaced by `?`
+and IN lists collapsed, so the same query with different values (or a
+different number of ids) counts as one. With settings.SLOW_QUERY_LOG on, a
+SLOW_QUERY_SAMPLE_RATE fraction of all queries add their count and time to
+their fingerprint's totals, and `top()` returns the SLOW_QUERY_TOP
+fingerprints with the most total time (also exported on `/metrics`). Sampled
+queries slower than SLOW_QUERY_THRESHOLD_MS are logged one by one.
+
+Totals are per process and kept for at most MAX_FINGERPRINTS fingerprints;
+queries with new fingerprints beyond that count towards OTHER.
+"""
+import logging
+import random
+import re
+import threading
+from django.conf import settings
+from tripexpensetrackerapi.lru import LRUCache
+
+logger = logging.getLogger(__name__)
+
+MAX_FINGERPRINTS = 1000
+OTHER = '(other)'
+
+STRING = re.compile(r"'(?:[^']|'')*'")
+NUMBER = re.compile(r'(?<![\w."])-?\b\d+(?:\.\d+)?\b')
+PLACEHOLDER = re.compile(r'%s|\?')
+IN_LIST = re.compile(r'\(\s*\?(?:\s*,\s*\?)*\s*\)')
+WHITESPACE = re.compile(r'\s+')
+
+totals = {}
+_totals_lock = threading.Lock()
+
+# Fingerprints of recently seen SQL strings, which mostly repeat
+_fingerprints = LRUCache(max_size=2000)
+
+
+def enabled():
+    return getattr(settings, 'SLOW_QUERY_LOG', False)
+
+
+def fingerprint(sql):
+    """`sql` with every literal replaced by `?`, IN lists collapsed to `(...)` and whitespace normalised."""
+    cached = _fingerprints.get(sql)
+    if cached is not None:
+        return cached
+    normalized = STRING.sub('?', sql)
+    normalized = NUMBER.sub('?', normalized)
+    normalized = PLACEHOLDER.sub('?', normalized)
+    normalized = IN_LIST.sub('(...)', normalized)
+    normalized = WHITESPACE.sub(' ', normalized).strip()
+    _fingerprints.set(sql, normalized)
+    return normalized
+
+
+def record(sql, seconds):
+    """Count a query that took `seconds`, if the log is on and the query is sampled."""
+    if not enabled() or random.random() >= getattr(settings, 'SLOW_QUERY_SAMPLE_RATE', 1.0):
+        return
+
+    key = fingerprint(sql)
+    threshold = getattr(settings, 'SLOW_QUERY_THRESHOLD_MS', 100)
+    if seconds * 1000 >= threshold:
+        logger.warning('Slow query (%.1f ms): %s', seconds * 1000, key)
+
+    with _totals_lock:
+        if key not in totals and len(totals) >= MAX_FINGERPRINTS:
+            key = OTHER
+        count, total = totals.get(key, (0, 0.0))
+        totals[key] = (count + 1, total + seconds)
+
+
+def top(n=None):
+    """The `n` fingerprints with the most sampled time, as (fingerprint, count, seconds), slowest first."""
+    n = n or getattr(settings, 'SLOW_QUERY_TOP', 20)
+    with _totals_lock:
+        rows = [(key, count, seconds) for key, (count, seconds) in totals.items()]
+    return sorted(rows, key=lambda row: row[2], reverse=True)[:n]
+
+
+def reset():
+    with _totals_lock:
+        totals.clear()
@@ -0,0 +1,170 @@
+"""Typeahead suggestions for expense names, from per-user prefix indexes in memory.
+
+A user's index is built the first time they ask for suggestions, with two
+grouped queries: how often they used each expense name, and which
+categories they filed it under. Names are folded to lower case and kept in a
+sorted list, so the names starting with a prefix are one contiguous slice
+found by bisection, and a suggestion is one of the most used names of that
+slice. A lookup in a loaded index runs no query.
+
+ExpenseView.create and update adjust the loaded indexes of the users they
+change once their transaction commits. Other writes (bulk writes, deletes,
+changes made by other processes) show up when the index expires after
+settings.SUGGEST_INDEX_TTL seconds. Indexes are evicted least recently used
+first once together they hold more than settings.SUGGEST_INDEX_MAX_NAMES
+names.
+"""
+import bisect
+import heapq
+import threading
+from collections import Counter
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Count
+from tripexpensetrackerapi.catalog import category_catalog
+from tripexpensetrackerapi.lru import LRUCache
+from tripexpensetrackerapi.models import Expense, ExpenseCategory
+
+DEFAULT_LIMIT = 8
+MAX_LIMIT = 20
+CATEGORIES_PER_NAME = 3
+# Sorts after every folded name that starts with the same prefix
+LAST_CHARACTER = chr(0x10FFFF)
+
+indexes = LRUCache(
+    getattr(settings, 'SUGGEST_INDEX_MAX_NAMES', 200000),
+    getattr(settings, 'SUGGEST_INDEX_TTL', 300),
+)
+
+
+def fold(name):
+    """The form names are matched in: case-folded, with runs of whitespace collapsed."""
+    return ' '.join(name.split()).casefold()
+
+
+class Entry:
+    """The uses of one folded name: how many, under which spellings and in which categories."""
+
+    __slots__ = ('count', 'spellings', 'categories')
+
+    def __init__(self):
+        self.count = 0
+        self.spellings = Counter()
+        self.categories = Counter()
+
+    def name(self):
+        return self.spellings.most_common(1)[0][0]
+
+
+class UserIndex:
+    """One user's expense names in folded order, with their entries."""
+
+    def __init__(self):
+        self.keys = []
+        self.entries = {}
+        self.lock = threading.Lock()
+
+    def change(self, name, category_ids, delta):
+        """Count `delta` more (or, if negative, fewer) uses of `name` with `category_ids`."""
+        key = fold(name)
+        if not key:
+            return
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                if delta <= 0:
+                    return
+                entry = self.entries[key] = Entry()
+                bisect.insort(self.keys, key)
+            entry.count += delta
+            entry.spellings[name] += delta
+            for category_id in category_ids:
+                entry.categories[category_id] += delta
+            if entry.count <= 0:
+                del self.entries[key]
+                del self.keys[bisect.bisect_left(self.keys, key)]
+                return
+            # Drops spellings and categories no longer in use
+            entry.spellings = +entry.spellings
+            entry.categories = +entry.categories
+
+    def top(self, prefix, limit):
+        """The `limit` most used entries whose folded name starts with `prefix`, as (name, count, category ids)."""
+        key = fold(prefix)
+        with self.lock:
+            start = bisect.bisect_left(self.keys, key)
+            end = bisect.bisect_left(self.keys, key + LAST_CHARACTER, start)
+            best = heapq.nsmallest(
+                limit, (self.keys[n] for n in range(start, end)), key=lambda k: (-self.entries[k].count, k)
+            )
+            return [
+                (
+                    entry.name(),
+                    entry.count,
+                    [category_id for category_id, _ in entry.categories.most_common(CATEGORIES_PER_NAME)],
+                )
+                for entry in (self.entries[k] for k in best)
+            ]
+
+
+def build(user_id):
+    """Load `user_id`'s index from the database."""
+    index = UserIndex()
+    names = Expense.objects.filter(user_id=user_id).values('name').annotate(count=Count('id')).order_by()
+    for row in names:
+        index.change(row['name'], (), row['count'])
+    links = (
+        ExpenseCategory.objects.filter(expense__user_id=user_id)
+        .values('expense__name', 'category_id').annotate(count=Count('id')).order_by()
+    )
+    for row in links:
+        entry = index.entries.get(fold(row['expense__name']))
+        if entry is not None:
+            entry.categories[row['category_id']] += row['count']
+    return index
+
+
+def loaded(user_id):
+    return indexes.get(user_id) is not None
+
+
+def suggest(user_id, prefix, limit=DEFAULT_LIMIT):
+    """The user's most used expense names starting with `prefix`, with the categories they used most with each."""
+    index = indexes.get(user_id)
+    if index is None:
+        index = build(user_id)
+        # Each name counts once against the memory budget
+        indexes.set(user_id, index, cost=len(index.keys) + 1)
+    names = category_catalog.names()
+    return [
+        {
+            'name': name,
+            'count': count,
+            'categories': [
+                {'id': category_id, 'name': names[category_id]} for category_id in category_ids
+                if category_id in names
+            ],
+        }
+        for name, count, category_ids in index.top(prefix, limit)
+    ]
+
+
+def expense_changed(old, new):
+    """Move an expense's use from `old` to `new` in the loaded indexes once the current transaction commits.
+
+    Each is a (user id, name, category ids) tuple, or None for an expense
+    that is being created.
+    """
+    def apply():
+        for change, delta in ((old, -1), (new, 1)):
+            if change is None:
+                continue
+            user_id, name, category_ids = change
+            index = indexes.get(user_id)
+            if index is not None:
+                index.change(name, category_ids, delta)
+    transaction.on_commit(apply)
+
+
+def clear():
+    indexes.clear()
@@ -1,3 +1,2020 @@
-from django.test import TestCase
+import asyncio
+import csv
+import io
+import json
+import sqlite3
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+from datetime import date, timedelta
+from decimal import Decimal
+from pathlib import Path
+from unittest import mock
+import numpy as np
+from asgiref.sync import async_to_sync, sync_to_async
+from django.core.management import CommandError, call_command
+from django.core.cache import cache, caches
+from django.db import IntegrityError, connection, connections, models, router, transaction
+from django.test import AsyncClient, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from rest_framework.test import APITestCase
+from tripexpensetrackerapi import (
+    analytics, fx, identity, metrics, profiling, response_cache, rollups, search, slow_queries, suggestions,
+)
+from tripexpensetrackerapi.catalog import VERSION_KEY, category_catalog, request_stamps
+from tripexpensetrackerapi.deletes import delete_rows, purge_trip
+from tripexpensetrackerapi.lru import LRUCache
+from tripexpensetrackerapi.models import (
+    User, Trip, Expense, Category, ExpenseCategory, FxRate, ImportCheckpoint, MonthlyRollup,
+)
+from tripexpensetrackerapi.routers import RequestRouting, current_request
 
-# Create your tests here.
+
+def make_user(name='Traveller', uid=None):
+    """Create a user with a unique uid."""
+    return User.objects.create(name=name, uid=uid or f'uid-{User.objects.count() + 1}')
+
+
+def make_categories(count=3):
+    """Create `count` categories."""
+    return [Category.objects.create(name=f'Category {i}') for i in range(count)]
+
+
+def make_trip(user, expense_count=0, categories=(), start=date(2024, 1, 1)):
+    """Create a trip for `user` with `expense_count` expenses, each linked to every category."""
+    trip = Trip.objects.create(user=user, name='Trip', date=start, description='A trip.')
+    for i in range(expense_count):
+        expense = Expense.objects.create(
+            user=user,
+            trip=trip,
+            name=f'Expense {i}',
+            amount='12.50',
+            description='Something.',
+            date=start + timedelta(days=i % 30),
+        )
+        for category in categories:
+            ExpenseCategory.objects.create(expense=expense, category=category)
+    return trip
+
+
+class QueryCountTests(APITestCase):
+    """Each read endpoint costs the same number of queries however much data it returns."""
+
+    sizes = (1, 10, 50)
+
+    def setUp(self):
+        self.user = make_user()
+        self.categories = make_categories()
+        # Loads the category catalog, as the first request after a category change would
+        category_catalog.names()
+
+    def test_trip_retrieve(self):
+        for size in self.sizes:
+            trip = make_trip(self.user, size, self.categories)
+            # trip + user, expenses + users, expense categories + categories
+            with self.assertNumQueries(3):
+                response = self.client.get(f'/trips/{trip.id}')
+            self.assertEqual(len(response.data['expense_details']), size)
+            self.assertEqual(len(response.data['expense_details'][0]['categories']), len(self.categories))
+
+    def test_trip_list(self):
+        for size in self.sizes:
+            make_trip(self.user, size, self.categories)
+            with self.assertNumQueries(3):
+                response = self.client.get('/trips', {'userId': self.user.id})
+            self.assertEqual(response.status_code, 200)
+
+    def test_expense_retrieve(self):
+        trip = make_trip(self.user, 1, self.categories)
+        expense = trip.expenses.get()
+        with self.assertNumQueries(2):
+            response = self.client.get(f'/expenses/{expense.id}')
+        self.assertEqual(response.data['user']['id'], self.user.id)
+        self.assertEqual(
+            [category['category_name'] for category in response.data['categories']],
+            [category.name for category in self.categories],
+        )
+
+    def test_expense_list(self):
+        for size in self.sizes:
+            make_trip(self.user, size, self.categories)
+            with self.assertNumQueries(2):
+                response = self.client.get('/expenses')
+            self.assertEqual(response.status_code, 200)
+
+    def test_expense_create(self):
+        payload = {
+            'user': self.user.id,
+            'name': 'Lunch',
+            'amount': '9.99',
+            'description': 'Sandwich',
+            'date': '2024-01-02',
+            'categories': [category.id for category in self.categories],
+        }
+        response = self.client.post('/expenses', payload, format='json')
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(len(response.data['categories']), len(self.categories))
+
+    def test_expense_category_list(self):
+        for size in self.sizes:
+            make_trip(self.user, size, self.categories)
+            with self.assertNumQueries(1):
+                response = self.client.get('/expensecategories')
+            self.assertEqual(response.status_code, 200)
+
+    def test_expense_category_retrieve(self):
+        trip = make_trip(self.user, 1, self.categories)
+        expense_category = ExpenseCategory.objects.filter(expense__trip=trip).first()
+        with self.assertNumQueries(1):
+            response = self.client.get(f'/expensecategories/{expense_category.id}')
+        self.assertEqual(response.data['category_name'], expense_category.category.name)
+
+    def test_category_and_user_lists(self):
+        make_categories(20)
+        for i in range(20):
+            make_user(uid=f'extra-{i}')
+        # Reloads the catalog once after the categories changed, then serves it from memory
+        with self.assertNumQueries(1):
+            self.client.get('/categories')
+        with self.assertNumQueries(0):
+            response = self.client.get('/categories')
+        self.assertEqual(len(response.data['results']), 23)
+        with self.assertNumQueries(1):
+            self.client.get('/users')
+
+
+class PaginationTests(APITestCase):
+    """List endpoints return stable keyset pages with an opaque next cursor."""
+
+    def setUp(self):
+        self.user = make_user()
+        self.trip = make_trip(self.user, 25, make_categories(1))
+        # A second trip over the same dates so the (date, id) ordering has ties
+        make_trip(self.user, 25, start=self.trip.date)
+
+    def walk(self, url, params):
+        """Follow next links from `url`, returning every page's results."""
+        pages = []
+        response = self.client.get(url, params)
+        while True:
+            self.assertEqual(response.status_code, 200)
+            pages.append(response.data['results'])
+            if response.data['next'] is None:
+                return pages
+            response = self.client.get(response.data['next'])
+
+    def test_pages_cover_every_row_once_in_order(self):
+        pages = self.walk('/expenses', {'page_size': 15})
+        self.assertEqual([len(page) for page in pages], [15, 15, 15, 5])
+        rows = [row for page in pages for row in page]
+        expected = list(Expense.objects.order_by('date', 'id').values_list('id', flat=True))
+        self.assertEqual([row['id'] for row in rows], expected)
+
+    def test_every_page_costs_the_same(self):
+        first = self.client.get('/expenses', {'page_size': 5})
+        with self.assertNumQueries(2):
+            self.client.get('/expenses', {'page_size': 5})
+        with self.assertNumQueries(2):
+            self.client.get(first.data['next'])
+
+    def test_page_size_is_capped(self):
+        with self.settings(PAGINATION_MAX_PAGE_SIZE=7):
+            response = self.client.get('/expensecategories', {'page_size': 1000})
+        self.assertEqual(len(response.data['results']), 7)
+        self.assertIsNotNone(response.data['next'])
+
+    def test_trip_list_is_paginated_per_user(self):
+        earlier = make_trip(self.user, start=date(2023, 6, 1))
+        make_trip(make_user(uid='someone-else'))
+        pages = self.walk('/trips', {'userId': self.user.id, 'page_size': 2})
+        self.assertEqual(len(pages), 2)
+        self.assertEqual([trip['id'] for trip in pages[0]], [earlier.id, self.trip.id])
+
+    def test_invalid_cursor(self):
+        for cursor in ('not-a-cursor', 'WyJub3QtYS1kYXRlIiwxXQ=='):
+            response = self.client.get('/expenses', {'cursor': cursor})
+            self.assertEqual(response.status_code, 400)
+
+
+class ExportTests(APITestCase):
+    """Expenses stream out as NDJSON or CSV for a user or a trip."""
+
+    def setUp(self):
+        self.user = make_user()
+        self.categories = make_categories(2)
+        self.trip = make_trip(self.user, 3, self.categories)
+        make_trip(make_user(uid='someone-else'), 2)
+        category_catalog.names()
+
+    def content(self, response):
+        self.assertTrue(response.streaming)
+        return b''.join(response.streaming_content).decode()
+
+    def test_ndjson_for_user(self):
+        response = self.client.get('/expenses/export', {'userId': self.user.id})
+        self.assertEqual(response['Content-Type'], 'application/x-ndjson')
+        rows = [json.loads(line) for line in self.content(response).splitlines()]
+        self.assertEqual(len(rows), 3)
+        self.assertEqual(rows[0], {
+            'id': rows[0]['id'],
+            'name': 'Expense 0',
+            'amount': '12.50',
+            'currency': 'USD',
+            'date': '2024-01-01',
+            'trip': 'Trip',
+            'categories': ['Category 0', 'Category 1'],
+        })
+
+    def test_csv_for_trip(self):
+        response = self.client.get('/expenses/export', {'tripId': self.trip.id, 'output': 'csv'}, HTTP_ACCEPT='text/csv')
+        self.assertEqual(response['Content-Type'], 'text/csv')
+        rows = list(csv.reader(io.StringIO(self.content(response))))
+        self.assertEqual(rows[0], ['id', 'name', 'amount', 'currency', 'date', 'trip', 'categories'])
+        self.assertEqual(rows[1][1:], ['Expense 0', '12.50', 'USD', '2024-01-01', 'Trip', 'Category 0; Category 1'])
+        self.assertEqual(len(rows), 4)
+
+    def test_reads_in_chunks(self):
+        make_trip(self.user, 7, self.categories)
+        with mock.patch('tripexpensetrackerapi.export.CHUNK_SIZE', 4):
+            response = self.client.get('/expenses/export', {'userId': self.user.id})
+            # one expense cursor, plus one category lookup per chunk of 4 rows
+            with self.assertNumQueries(4):
+                lines = self.content(response).splitlines()
+        self.assertEqual(len(lines), 10)
+
+    def test_requires_a_filter(self):
+        self.assertEqual(self.client.get('/expenses/export').status_code, 400)
+        self.assertEqual(self.client.get('/expenses/export', {'userId': 1, 'output': 'xml'}).status_code, 400)
+
+
+class TripSummaryTests(APITestCase):
+    """Trip summaries are aggregated in the database."""
+
+    def setUp(self):
+        self.user = make_user()
+        self.food, self.taxi = make_categories(2)
+        self.trip = make_trip(self.user)
+        category_catalog.names()
+        for amount, day, categories in (
+            ('10.00', 1, [self.food]),
+            ('20.00', 1, [self.food, self.taxi]),
+            ('35.50', 2, [self.taxi]),
+        ):
+            expense = Expense.objects.create(
+                user=self.user, trip=self.trip, name='E', amount=amount,
+                description='', date=date(2024, 1, day),
+            )
+            for category in categories:
+                ExpenseCategory.objects.create(expense=expense, category=category)
+
+    def test_summary(self):
+        with self.assertNumQueries(3):
+            response = self.client.get(f'/trips/{self.trip.id}/summary')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['total'], '65.50')
+        self.assertEqual(response.data['count'], 3)
+        self.assertEqual(response.data['min'], '10.00')
+        self.assertEqual(response.data['max'], '35.50')
+        self.assertEqual(response.data['avg'], '21.83')
+        self.assertEqual(response.data['categories'], [
+            {'id': self.food.id, 'name': self.food.name, 'total': '30.00', 'count': 2},
+            {'id': self.taxi.id, 'name': self.taxi.name, 'total': '55.50', 'count': 2},
+        ])
+        self.assertEqual(response.data['days'], [
+            {'date': date(2024, 1, 1), 'total': '30.00', 'count': 2},
+            {'date': date(2024, 1, 2), 'total': '35.50', 'count': 1},
+        ])
+
+    def test_empty_trip(self):
+        trip = make_trip(self.user)
+        response = self.client.get(f'/trips/{trip.id}/summary')
+        self.assertEqual(response.data['total'], '0.00')
+        self.assertEqual(response.data['count'], 0)
+        self.assertIsNone(response.data['avg'])
+        self.assertEqual(response.data['categories'], [])
+
+    def test_missing_trip(self):
+        self.assertEqual(self.client.get('/trips/999/summary').status_code, 404)
+
+
+class BulkExpenseTests(APITestCase):
+    """Bulk expense writes validate everything up front and write in one transaction."""
+
+    def setUp(self):
+        self.user = make_user()
+        self.categories = make_categories(2)
+        self.trip = make_trip(self.user)
+        category_catalog.names()
+
+    def payload(self, count, **overrides):
+        return [
+            {
+                'user': self.user.id,
+                'trip': self.trip.id,
+                'name': f'Offline {i}',
+                'amount': '4.20',
+                'description': '',
+                'date': '2024-02-01',
+                'categories': [category.id for category in self.categories],
+                **overrides,
+            }
+            for i in range(count)
+        ]
+
+    def test_create_costs_the_same_for_any_batch_size(self):
+        counts = []
+        for size in (2, 30):
+            with CaptureQueriesContext(connection) as queries:
+                response = self.client.post('/expenses/bulk', self.payload(size), format='json')
+            self.assertEqual(response.status_code, 201)
+            self.assertEqual([expense['name'] for expense in response.data], [f'Offline {i}' for i in range(size)])
+            counts.append(len(queries))
+        self.assertEqual(counts[0], counts[1])
+        self.assertEqual(ExpenseCategory.objects.count(), 32 * len(self.categories))
+
+    def test_create_reports_errors_per_item_and_writes_nothing(self):
+        items = self.payload(3)
+        items[1]['trip'] = 999
+        items[2]['amount'] = 'lots'
+        response = self.client.post('/expenses/bulk', items, format='json')
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual([error['index'] for error in response.data['errors']], [1, 2])
+        self.assertIn('trip', response.data['errors'][0]['errors'])
+        self.assertIn('amount', response.data['errors'][1]['errors'])
+        self.assertFalse(Expense.objects.exists())
+
+    def test_update(self):
+        ids = [expense['id'] for expense in self.client.post('/expenses/bulk', self.payload(3), format='json').data]
+        items = [
+            {'id': expense_id, **item, 'name': 'Renamed', 'categories': [self.categories[0].id]}
+            for expense_id, item in zip(ids, self.payload(3))
+        ]
+        items[2]['categories'] = []
+        response = self.client.put('/expenses/bulk', items, format='json')
+        self.assertEqual(response.status_code, 204)
+        self.assertEqual(set(Expense.objects.values_list('name', flat=True)), {'Renamed'})
+        self.assertEqual(ExpenseCategory.objects.filter(expense_id=ids[0]).count(), 1)
+        # An empty category list leaves the existing categories alone
+        self.assertEqual(ExpenseCategory.objects.filter(expense_id=ids[2]).count(), 2)
+
+    def test_update_unknown_id(self):
+        response = self.client.put('/expenses/bulk', [{'id': 999, **self.payload(1)[0]}], format='json')
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('id', response.data['errors'][0]['errors'])
+
+    def test_delete(self):
+        ids = [expense['id'] for expense in self.client.post('/expenses/bulk', self.payload(3), format='json').data]
+        response = self.client.delete('/expenses/bulk', [ids[0], 999, 'x'], format='json')
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual([error['index'] for error in response.data['errors']], [1, 2])
+        self.assertEqual(Expense.objects.count(), 3)
+
+        response = self.client.delete('/expenses/bulk', ids[:2], format='json')
+        self.assertEqual(response.status_code, 204)
+        self.assertEqual(list(Expense.objects.values_list('id', flat=True)), ids[2:])
+        self.assertFalse(ExpenseCategory.objects.filter(expense_id__in=ids[:2]).exists())
+
+
+class ImportExpensesTests(TestCase):
+    """manage.py import_expenses writes batches and resumes from its checkpoint."""
+
+    def setUp(self):
+        self.user = make_user()
+        self.trip = make_trip(self.user)
+        Category.objects.create(name='Food')
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.path = Path(directory.name) / 'statement.csv'
+        self.path.write_text(
+            'date,name,amount,categories\n'
+            '2024-01-01,Coffee,3.50,food\n'
+            '2024-01-02,Train,12.00,Transport\n'
+            '2024-01-03,Dinner,40.00,Food; Business\n'
+            'yesterday,Broken,1.00,\n'
+            '2024-01-04,Taxi,"1,020.00",transport\n'
+        )
+
+    def run_import(self, *args):
+        out, err = io.StringIO(), io.StringIO()
+        call_command(
+            'import_expenses', str(self.path), '--user', str(self.user.id), '--trip', str(self.trip.id),
+            '--batch-size', '1', '--transaction-batches', '2', *args, stdout=out, stderr=err,
+        )
+        return out.getvalue(), err.getvalue()
+
+    def test_import(self):
+        out, err = self.run_import()
+        self.assertIn('Imported 4 expenses', out)
+        self.assertIn('Skipping row 4', err)
+        self.assertEqual(
+            list(self.trip.expenses.order_by('date').values_list('name', 'amount_minor', 'currency')),
+            [('Coffee', 350, 'USD'), ('Train', 1200, 'USD'), ('Dinner', 4000, 'USD'), ('Taxi', 102000, 'USD')],
+        )
+        # Category names are matched case-insensitively and missing ones are created once
+        self.assertEqual(sorted(Category.objects.values_list('name', flat=True)), ['Business', 'Food', 'Transport'])
+        self.assertEqual(ExpenseCategory.objects.filter(category__name='Transport').count(), 2)
+
+        out, _ = self.run_import()
+        self.assertIn('already imported', out)
+        self.assertEqual(Expense.objects.count(), 4)
+
+    def test_skips_amounts_that_cannot_be_stored(self):
+        self.path.write_text(
+            'date,name,amount,categories\n'
+            '2024-01-01,Huge,1e50,\n'
+            '2024-01-02,Unknown,NaN,\n'
+            '2024-01-03,Coffee,3.50,\n'
+        )
+        out, err = self.run_import()
+        self.assertIn('Imported 1 expenses', out)
+        self.assertIn('Skipping row 1', err)
+        self.assertIn('Skipping row 2', err)
+        self.assertEqual(list(Expense.objects.values_list('name', flat=True)), ['Coffee'])
+
+    def test_resumes_after_last_committed_batch(self):
+        ImportCheckpoint.objects.create(
+            source=str(self.path.resolve()), user=self.user, trip=self.trip, rows_committed=2,
+        )
+        out, _ = self.run_import()
+        self.assertIn('Resuming after row 2', out)
+        self.assertEqual(list(Expense.objects.order_by('date').values_list('name', flat=True)), ['Dinner', 'Taxi'])
+        self.assertEqual(ImportCheckpoint.objects.get().rows_committed, 5)
+
+
+class IdentityCacheTests(APITestCase):
+    """Users are unique by uid and looked up through the in-process identity cache."""
+
+    def setUp(self):
+        identity.clear()
+        self.user = make_user(uid='firebase-uid')
+
+    def test_uid_is_unique(self):
+        with self.assertRaises(IntegrityError):
+            User.objects.create(name='Copy', uid='firebase-uid')
+
+    def test_register_is_idempotent(self):
+        first = self.client.post('/register', {'name': 'New', 'uid': 'new-uid'}, format='json')
+        second = self.client.post('/register', {'name': 'New', 'uid': 'new-uid'}, format='json')
+        self.assertEqual(first.data, second.data)
+        self.assertEqual(User.objects.filter(uid='new-uid').count(), 1)
+
+    def test_check_user_is_served_from_cache(self):
+        self.client.post('/checkuser', {'uid': 'firebase-uid'}, format='json')
+        with self.assertNumQueries(0):
+            response = self.client.post('/checkuser', {'uid': 'firebase-uid'}, format='json')
+        self.assertEqual(response.data, {'id': self.user.id, 'name': self.user.name, 'uid': 'firebase-uid'})
+        self.assertEqual(self.client.post('/checkuser', {'uid': 'unknown'}, format='json').data, {'valid': False})
+
+    def test_saving_a_user_invalidates_it(self):
+        self.client.post('/checkuser', {'uid': 'firebase-uid'}, format='json')
+        self.user.uid = 'rotated-uid'
+        self.user.name = 'Renamed'
+        self.user.save()
+        self.assertEqual(self.client.post('/checkuser', {'uid': 'firebase-uid'}, format='json').data, {'valid': False})
+        self.assertEqual(self.client.post('/checkuser', {'uid': 'rotated-uid'}, format='json').data['name'], 'Renamed')
+        self.assertEqual(identity.get_user(self.user.id).name, 'Renamed')
+
+    def test_trip_create_reuses_cached_owner(self):
+        identity.get_user(self.user.id)
+        payload = {'userId': self.user.id, 'name': 'Trip', 'date': '2024-01-01', 'description': ''}
+        # insert the trip, then fetch its (empty) expenses for the response
+        with self.assertNumQueries(2):
+            response = self.client.post('/trips', payload, format='json')
+        self.assertEqual(response.data['user_details']['uid'], 'firebase-uid')
+        self.assertEqual(self.client.post('/trips', {**payload, 'userId': 999}, format='json').status_code, 404)
+
+    def test_lru_bound(self):
+        cache = LRUCache(max_size=2)
+        cache.set('a', 1)
+        cache.set('b', 2)
+        cache.get('a')
+        cache.set('c', 3)
+        self.assertIsNone(cache.get('b'))
+        self.assertEqual((cache.get('a'), cache.get('c'), cache.evictions), (1, 3, 1))
+
+
+class CategoryCatalogTests(APITestCase):
+    """Category lookups are served from the in-memory catalog and refreshed on writes."""
+
+    def setUp(self):
+        self.food, = make_categories(1)
+        category_catalog.names()
+
+    def test_category_writes_refresh_the_catalog(self):
+        response = self.client.post('/categories', {'name': 'Lodging'}, format='json')
+        lodging_id = response.data['id']
+        self.assertEqual(self.client.get(f'/categories/{lodging_id}').data['name'], 'Lodging')
+
+        self.client.put(f'/categories/{lodging_id}', {'name': 'Hotels'}, format='json')
+        self.assertEqual(self.client.get(f'/categories/{lodging_id}').data['name'], 'Hotels')
+
+        self.client.delete(f'/categories/{lodging_id}')
+        self.assertEqual(self.client.get(f'/categories/{lodging_id}').status_code, 404)
+        self.assertEqual(self.client.get('/categories').data['results'], [{'id': self.food.id, 'name': self.food.name}])
+
+    def test_other_process_changes_are_noticed_through_the_version_stamp(self):
+        # Simulates another worker renaming the category: the row changes and a new stamp is published
+        Category.objects.filter(pk=self.food.pk).update(name='Meals')
+        with self.assertNumQueries(0):
+            self.assertEqual(category_catalog.name(self.food.id), self.food.name)
+        cache.set(VERSION_KEY, 'from-another-process', None)
+        self.assertEqual(category_catalog.name(self.food.id), 'Meals')
+
+    def test_an_evicted_stamp_is_replaced_rather_than_read_as_none(self):
+        Category.objects.filter(pk=self.food.pk).update(name='Meals')
+        # As if the cache had culled the stamp published by the rename
+        cache.delete(VERSION_KEY)
+        self.assertEqual(category_catalog.name(self.food.id), 'Meals')
+        self.assertIsNotNone(cache.get(VERSION_KEY))
+
+    @override_settings(FAST_LIST_SERIALIZERS=False)
+    def test_a_request_reads_the_version_stamp_once(self):
+        expenses = make_trip(make_user(), 3).expenses.all()
+        ExpenseCategory.objects.bulk_create(
+            ExpenseCategory(expense=expense, category=self.food) for expense in expenses
+        )
+        with mock.patch('tripexpensetrackerapi.catalog.cache', wraps=cache) as shared:
+            response = self.client.get('/expensecategories')
+        self.assertEqual([row['category_name'] for row in response.data['results']], [self.food.name] * 3)
+        self.assertEqual(shared.get.call_args_list, [mock.call(VERSION_KEY)])
+
+    def test_unknown_ids_reload_once_per_version(self):
+        token = request_stamps.set({})
+        try:
+            with self.assertNumQueries(1):
+                self.assertIsNone(category_catalog.name(998))
+                self.assertIsNone(category_catalog.name(999))
+                self.assertEqual(category_catalog.missing([self.food.id, 999]), [999])
+        finally:
+            request_stamps.reset(token)
+        # A new stamp allows one more reload, which finds a category created meanwhile
+        lodging = Category.objects.create(name='Lodging')
+        cache.set(VERSION_KEY, 'from-another-process', None)
+        with self.assertNumQueries(1):
+            self.assertEqual(category_catalog.name(lodging.id), 'Lodging')
+
+    def test_validation_uses_the_catalog(self):
+        user = make_user()
+        expense = make_trip(user, 1).expenses.get()
+        # expense lookup, then get_or_create's lookup and insert in a savepoint, then finding the trip and
+        # bumping the expense's and trip's updated_at, all inside the rollup tracking (a savepoint, two grouped
+        # queries before and after and an upsert); no category query
+        with self.assertNumQueries(15):
+            response = self.client.post(f'/expenses/{expense.id}/add_expense_category', {'category': self.food.id}, format='json')
+        self.assertEqual(response.status_code, 201)
+        response = self.client.post(f'/expenses/{expense.id}/add_expense_category', {'category': 999}, format='json')
+        self.assertEqual(response.status_code, 404)
+        response = self.client.post('/expensecategories', {'expense': expense.id, 'category': 999}, format='json')
+        self.assertEqual(response.status_code, 404)
+
+
+class ConditionalGetTests(APITestCase):
+    """Trips, expenses and categories answer conditional GETs with 304 after one cheap query."""
+
+    def setUp(self):
+        self.user = make_user()
+        self.food, self.fuel = make_categories(2)
+        self.trip = make_trip(self.user, 2, [self.food])
+        self.expense = self.trip.expenses.first()
+        category_catalog.names()
+
+    def assertRevalidates(self, url, params=None, queries=1):
+        """Fetch `url`, then check that revalidating with its ETag gives a bodiless 304."""
+        response = self.client.get(url, params)
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.has_header('Last-Modified'))
+        with self.assertNumQueries(queries):
+            cached = self.client.get(url, params, HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(cached.status_code, 304)
+        self.assertEqual(cached.content, b'')
+        self.assertEqual(cached['ETag'], response['ETag'])
+        return response['ETag']
+
+    def test_unchanged_resources_are_not_modified(self):
+        self.assertRevalidates(f'/trips/{self.trip.id}')
+        self.assertRevalidates('/trips', {'userId': self.user.id})
+        self.assertRevalidates(f'/expenses/{self.expense.id}')
+        self.assertRevalidates('/expenses')
+        self.assertRevalidates('/categories', queries=0)
+        self.assertRevalidates(f'/categories/{self.food.id}', queries=0)
+
+    def test_if_modified_since(self):
+        response = self.client.get(f'/trips/{self.trip.id}')
+        cached = self.client.get(f'/trips/{self.trip.id}', HTTP_IF_MODIFIED_SINCE=response['Last-Modified'])
+        self.assertEqual(cached.status_code, 304)
+
+    def test_expense_changes_bump_the_trip(self):
+        changes = (
+            lambda: self.client.put(f'/expenses/{self.expense.id}', {
+                'user': self.user.id, 'name': 'Renamed', 'amount': '1.00', 'description': '', 'date': '2024-01-01',
+            }, format='json'),
+            lambda: self.client.post(f'/expenses/{self.expense.id}/add_expense_category', {'category': self.fuel.id}, format='json'),
+            lambda: self.client.delete(f'/expensecategories/{self.expense.categories.first().id}'),
+            lambda: self.client.delete(f'/trips/{self.trip.id}/remove_trip_expense/{self.expense.id}'),
+            lambda: self.client.post(f'/trips/{self.trip.id}/add_expense', {'expense': self.expense.id}, format='json'),
+            lambda: self.client.delete('/expenses/bulk', [self.expense.id], format='json'),
+        )
+        for change in changes:
+            trip_etag = self.client.get(f'/trips/{self.trip.id}')['ETag']
+            list_etag = self.client.get('/trips', {'userId': self.user.id})['ETag']
+            # updated_at has microsecond resolution; make sure the clock moves on
+            time.sleep(0.001)
+            self.assertLess(change().status_code, 300)
+            response = self.client.get(f'/trips/{self.trip.id}', HTTP_IF_NONE_MATCH=trip_etag)
+            self.assertEqual(response.status_code, 200)
+            response = self.client.get('/trips', {'userId': self.user.id}, HTTP_IF_NONE_MATCH=list_etag)
+            self.assertEqual(response.status_code, 200)
+
+    def test_category_rename_changes_etags(self):
+        trip_etag = self.client.get(f'/trips/{self.trip.id}')['ETag']
+        self.client.put(f'/categories/{self.food.id}', {'name': 'Meals'}, format='json')
+        response = self.client.get(f'/trips/{self.trip.id}', HTTP_IF_NONE_MATCH=trip_etag)
+        self.assertEqual(response.status_code, 200)
+
+    def test_missing_trip_is_still_not_found(self):
+        self.assertEqual(self.client.get('/trips/999', HTTP_IF_NONE_MATCH='"x"').status_code, 404)
+
+
+class FixtureTests(APITestCase):
+    """The sample data fixtures load into the current schema."""
+
+    fixtures = ['users', 'categories', 'trips', 'expenses', 'expense_categories']
+
+    def test_fixtures_load(self):
+        self.assertFalse(
+            Category.objects.filter(updated_at__isnull=True).exists()
+            or Trip.objects.filter(updated_at__isnull=True).exists()
+            or Expense.objects.filter(updated_at__isnull=True).exists()
+        )
+        response = self.client.get('/trips/1', {'fields': 'total'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['total'], '150.00')
+        response = self.client.get('/trips/1', {'fields': 'total'}, HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(response.status_code, 304)
+
+
+class ResponseCacheTests(APITestCase):
+    """Trip detail and list responses are served from the cache until a write touches them."""
+
+    def setUp(self):
+        self.user = make_user()
+        self.food, self.fuel = make_categories(2)
+        self.trip = make_trip(self.user, 3, [self.food])
+        self.expense = self.trip.expenses.first()
+        category_catalog.names()
+
+    def assertCached(self, url, params=None):
+        """Fetch `url` twice, checking that the second response costs no queries and matches the first."""
+        response = self.client.get(url, params)
+        self.assertEqual(response.status_code, 200)
+        with self.assertNumQueries(0):
+            cached = self.client.get(url, params)
+        self.assertEqual(cached.json(), response.json())
+        self.assertEqual(cached['ETag'], response['ETag'])
+        return response
+
+    def test_unchanged_trips_are_served_from_the_cache(self):
+        self.assertCached(f'/trips/{self.trip.id}')
+        self.assertCached('/trips', {'userId': self.user.id})
+        self.assertCached('/trips', {'userId': self.user.id, 'page_size': 1})
+
+    def test_writes_invalidate_exactly_the_touched_trips(self):
+        other_trip = make_trip(self.user, 1)
+        other_user = make_user('Other')
+        unrelated = make_trip(other_user, 1)
+        changes = (
+            lambda: self.client.put(f'/trips/{self.trip.id}', {'name': 'Renamed'}, format='json'),
+            lambda: self.client.post('/expenses', {
+                'user': self.user.id, 'trip': self.trip.id, 'name': 'New', 'amount': '3.00',
+                'description': '', 'date': '2024-01-02', 'categories': [],
+            }, format='json'),
+            lambda: self.client.post(f'/expenses/{self.expense.id}/add_expense_category', {'category': self.fuel.id}, format='json'),
+            lambda: self.client.delete(f'/trips/{self.trip.id}/remove_trip_expense/{self.expense.id}'),
+            lambda: self.client.post(f'/trips/{self.trip.id}/add_expense', {'expense': self.expense.id}, format='json'),
+            lambda: self.client.put(f'/categories/{self.food.id}', {'name': 'Meals'}, format='json'),
+            self.rename_user,
+        )
+        for change in changes:
+            before = self.assertCached(f'/trips/{self.trip.id}')
+            self.assertCached('/trips', {'userId': self.user.id})
+            self.assertCached(f'/trips/{unrelated.id}')
+            self.assertCached('/trips', {'userId': other_user.id})
+            response = change()
+            if response is not None:
+                self.assertLess(response.status_code, 300)
+            self.assertNotEqual(self.client.get(f'/trips/{self.trip.id}').json(), before.json())
+            with self.assertNumQueries(0):
+                self.client.get(f'/trips/{unrelated.id}')
+                self.client.get('/trips', {'userId': other_user.id})
+            self.assertEqual(self.client.get(f'/trips/{other_trip.id}').status_code, 200)
+
+    def rename_user(self):
+        # There is no user update endpoint; user details still appear in trip payloads
+        self.user.name = 'Renamed'
+        self.user.save()
+
+    def test_deleted_trips_are_not_served(self):
+        self.assertCached(f'/trips/{self.trip.id}')
+        self.client.delete(f'/trips/{self.trip.id}')
+        self.assertEqual(self.client.get(f'/trips/{self.trip.id}').status_code, 404)
+        self.assertEqual(self.client.get('/trips', {'userId': self.user.id}).json()['results'], [])
+
+    def test_stats_count_hits_and_misses(self):
+        before = response_cache.stats()
+        self.client.get(f'/trips/{self.trip.id}')
+        self.client.get(f'/trips/{self.trip.id}')
+        after = response_cache.stats()
+        self.assertEqual(after['misses'] - before['misses'], 1)
+        self.assertEqual(after['hits'] - before['hits'], 1)
+
+    def test_concurrent_misses_wait_for_one_rebuild(self):
+        key = response_cache.trip_key(self.trip.id)
+        cache.add(f'{key}:lock', 1, 5)
+        timer = threading.Timer(0.1, lambda: cache.set(key, 'built elsewhere'))
+        timer.start()
+        build = mock.Mock(return_value='built here')
+        try:
+            self.assertEqual(response_cache.get_or_build(key, build), 'built elsewhere')
+        finally:
+            timer.join()
+        build.assert_not_called()
+
+    def test_a_waiter_that_times_out_leaves_the_lock_alone(self):
+        key = response_cache.trip_key(self.trip.id)
+        cache.add(f'{key}:lock', 1, 5)
+        with mock.patch.object(response_cache, 'LOCK_TIMEOUT', 0.1):
+            self.assertEqual(response_cache.get_or_build(key, lambda: 'built here'), 'built here')
+            cache.delete(key)
+            self.assertEqual(async_to_sync(response_cache.aget_or_build)(key, sync_to_async(lambda: 'built')), 'built')
+        self.assertIsNotNone(cache.get(f'{key}:lock'))
+
+    def test_file_based_backend(self):
+        with tempfile.TemporaryDirectory() as cache_dir:
+            backend = {'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache', 'LOCATION': cache_dir}
+            with override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}, 'responses': backend},
+                                   RESPONSE_CACHE_ALIAS='responses'):
+                response = self.assertCached(f'/trips/{self.trip.id}')
+                self.assertEqual(response.json()['id'], self.trip.id)
+                self.client.put(f'/trips/{self.trip.id}', {'name': 'Renamed'}, format='json')
+                self.assertEqual(self.client.get(f'/trips/{self.trip.id}').json()['name'], 'Renamed')
+
+
+class AsyncViewTests(APITestCase):
+    """Over ASGI, the read endpoints are served by async views with the same responses as the ViewSets."""
+
+    def setUp(self):
+        self.user = make_user()
+        self.food, self.fuel = make_categories(2)
+        self.trip = make_trip(self.user, 3, [self.food, self.fuel])
+        make_trip(self.user, 1, [self.fuel])
+        self.async_client = AsyncClient()
+
+    async def test_responses_match_the_sync_views(self):
+        urls = (
+            (f'/trips/{self.trip.id}', {}),
+            ('/trips', {'userId': self.user.id}),
+            ('/trips', {'userId': self.user.id, 'page_size': 1}),
+            ('/expenses', {}),
+            ('/expenses', {'page_size': 2}),
+            ('/categories', {}),
+            ('/trips/999', {}),
+            ('/expenses', {'cursor': 'not-a-cursor'}),
+            (f'/trips/{self.trip.id}', {'fields': 'id,total', 'include': 'expenses'}),
+            ('/trips', {'userId': self.user.id, 'fields': 'id,name,date,total'}),
+            ('/expenses', {'include': 'categories'}),
+            ('/expenses', {'fields': 'nope'}),
+            ('/expenses', {'tripId': self.trip.id, 'categoryId': self.food.id, 'ordering': '-amount', 'page_size': 2}),
+            ('/expenses', {'minAmount': 'lots'}),
+        )
+        for url, params in urls:
+            expected = await sync_to_async(self.client.get)(url, params)
+            response = await self.async_client.get(url, params)
+            self.assertEqual(response.status_code, expected.status_code, url)
+            self.assertEqual(response.content, expected.content, url)
+            self.assertEqual(response.get('ETag'), expected.get('ETag'), url)
+
+    async def test_the_cache_is_not_called_from_the_event_loop(self):
+        def off_the_loop(method):
+            def checked(*args, **kwargs):
+                with self.assertRaises(RuntimeError, msg=f'cache.{method.__name__}() ran on the event loop'):
+                    asyncio.get_running_loop()
+                return method(*args, **kwargs)
+            return checked
+
+        backend = type(caches['default'])
+        with mock.patch.multiple(backend, **{
+            name: off_the_loop(getattr(backend, name)) for name in ('get', 'add', 'set', 'delete')
+        }):
+            for url in (f'/trips/{self.trip.id}', f'/trips/{self.trip.id}', '/trips', '/expenses', '/categories'):
+                response = await self.async_client.get(url, {'userId': self.user.id})
+                self.assertEqual(response.status_code, 200, url)
+
+    async def test_async_views_are_used(self):
+        for url in (f'/trips/{self.trip.id}', '/trips', '/expenses', '/categories'):
+            response = await self.async_client.get(url)
+            self.assertTrue(asyncio.iscoroutinefunction(response.resolver_match.func), url)
+        response = self.client.get('/expenses')
+        self.assertFalse(asyncio.iscoroutinefunction(response.resolver_match.func))
+
+    async def test_conditional_get(self):
+        for url in ('/expenses', f'/trips/{self.trip.id}', '/categories'):
+            response = await self.async_client.get(url)
+            # AsyncClient takes extra headers by their HTTP names
+            cached = await self.async_client.get(url, **{'If-None-Match': response['ETag']})
+            self.assertEqual(cached.status_code, 304, url)
+
+    async def test_writes_fall_back_to_the_viewsets(self):
+        response = await self.async_client.post('/trips', {
+            'userId': self.user.id, 'name': 'Async', 'date': '2024-02-01', 'description': '',
+        }, content_type='application/json')
+        self.assertEqual(response.status_code, 201)
+        response = await self.async_client.put(f'/trips/{self.trip.id}', {'name': 'Renamed'}, content_type='application/json')
+        self.assertEqual(response.status_code, 204)
+        response = await self.async_client.get(f'/trips/{self.trip.id}')
+        self.assertEqual(response.json()['name'], 'Renamed')
+
+    async def test_check_user(self):
+        response = await self.async_client.post('/checkuser', {'uid': self.user.uid}, content_type='application/json')
+        self.assertEqual(response.json(), {'id': self.user.id, 'name': self.user.name, 'uid': self.user.uid})
+        response = await self.async_client.post('/checkuser', {'uid': 'nobody'}, content_type='application/json')
+        self.assertEqual(response.json(), {'valid': False})
+
+
+@contextmanager
+def sqlite_replica(alias='replica1'):
+    """Register `alias` as a read replica: a real SQLite file holding a copy of the test database."""
+    with tempfile.TemporaryDirectory() as directory:
+        path = str(Path(directory) / 'replica.sqlite3')
+        connection.ensure_connection()
+        with sqlite3.connect(path) as target:
+            # Dumped through the test connection itself, which holds the test case's open transaction
+            target.executescript('\n'.join(connection.connection.iterdump()))
+        target.close()
+        connections.settings[alias] = {**connection.settings_dict, 'NAME': path}
+        try:
+            with override_settings(DATABASE_READ_REPLICAS=[alias]):
+                yield path
+        finally:
+            connections[alias].close()
+            del connections.settings[alias]
+            delattr(connections._connections, alias)
+
+
+class ReplicaRoutingTests(APITestCase):
+    """GET requests read from a replica; writes, and reads after them, use the primary."""
+
+    def setUp(self):
+        self.user = make_user()
+        self.replica_path = self.enterContext(sqlite_replica())
+        # A row that only the replica has, to tell which database answered
+        with sqlite3.connect(self.replica_path) as replica:
+            replica.execute(
+                f"INSERT INTO {User._meta.db_table} (id, name, uid) VALUES (9999, 'Replica only', 'replica-only')"
+            )
+
+    def test_reads_go_to_the_replica(self):
+        response = self.client.get('/users/9999')
+        self.assertEqual(response.json()['name'], 'Replica only')
+        self.assertEqual(self.client.get('/users', {'page_size': 200}).json()['results'][-1]['id'], 9999)
+        self.assertFalse(User.objects.filter(pk=9999).exists())
+
+    def test_writes_and_read_after_write_use_the_primary(self):
+        response = self.client.post('/expenses', {
+            'user': self.user.id, 'name': 'Taxi', 'amount': '10.00', 'description': '', 'date': '2024-01-01',
+        }, format='json')
+        # create reads the new expense back, which only the primary has
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.json()['name'], 'Taxi')
+        self.assertEqual(self.client.post('/checkuser', {'uid': 'replica-only'}, format='json').json(), {'valid': False})
+
+    def test_queries_outside_requests_use_the_primary(self):
+        self.assertEqual(router.db_for_read(User), 'default')
+        self.assertEqual(router.db_for_write(User), 'default')
+
+    def test_read_requests_are_pinned_to_the_primary_once_they_write(self):
+        token = current_request.set(RequestRouting(read_only=True))
+        try:
+            self.assertEqual(router.db_for_read(User), 'replica1')
+            self.assertEqual(router.db_for_write(User), 'default')
+            self.assertEqual(router.db_for_read(User), 'default')
+        finally:
+            current_request.reset(token)
+
+    def test_sqlite_connections_are_tuned(self):
+        with connections['replica1'].cursor() as cursor:
+            self.assertEqual(cursor.execute('PRAGMA journal_mode').fetchone()[0], 'wal')
+            # 1 is NORMAL
+            self.assertEqual(cursor.execute('PRAGMA synchronous').fetchone()[0], 1)
+
+
+class SetBasedDeleteTests(APITestCase):
+    """Trips and expenses are deleted with a fixed number of statements however much they contain."""
+
+    def setUp(self):
+        self.user = make_user()
+        self.categories = make_categories(2)
+        self.kept = make_trip(self.user, 2, self.categories)
+
+    def assertOnlyKeptRowsRemain(self):
+        self.assertEqual(set(Expense.objects.values_list('trip_id', flat=True)), {self.kept.id})
+        self.assertEqual(ExpenseCategory.objects.count(), 4)
+
+    def test_trip_delete_query_count_is_constant(self):
+        counts = []
+        for size in (1, 30):
+            trip = make_trip(self.user, size, self.categories)
+            with CaptureQueriesContext(connection) as queries:
+                response = self.client.delete(f'/trips/{trip.id}')
+            self.assertEqual(response.status_code, 204)
+            self.assertFalse(Trip.objects.filter(pk=trip.id).exists())
+            counts.append(len(queries))
+        self.assertEqual(counts[0], counts[1])
+        self.assertOnlyKeptRowsRemain()
+
+    def test_expense_delete(self):
+        trip = make_trip(self.user, 1, self.categories)
+        expense = trip.expenses.get()
+        response = self.client.delete(f'/expenses/{expense.id}')
+        self.assertEqual(response.status_code, 204)
+        self.assertOnlyKeptRowsRemain()
+        self.assertEqual(self.client.delete(f'/expenses/{expense.id}').status_code, 404)
+
+    def test_remove_trip_expense_checks_membership_without_loading_the_trip(self):
+        trip = make_trip(self.user, 1)
+        other = self.kept.expenses.first()
+        # trip and expense lookups only
+        with self.assertNumQueries(2):
+            response = self.client.delete(f'/trips/{trip.id}/remove_trip_expense/{other.id}')
+        self.assertEqual(response.status_code, 404)
+        expense = trip.expenses.get()
+        response = self.client.delete(f'/trips/{trip.id}/remove_trip_expense/{expense.id}')
+        self.assertEqual(response.status_code, 204)
+
+    @override_settings(TRIP_PURGE_CHUNK_SIZE=3)
+    def test_background_purge(self):
+        trip = make_trip(self.user, 10, self.categories)
+        self.client.get(f'/trips/{trip.id}')
+        # Runs the purge inline; a real background thread could not see the test's transaction
+        with mock.patch('tripexpensetrackerapi.views.trip_view.run_in_background', lambda target, *args: target(*args)):
+            response = self.client.delete(f'/trips/{trip.id}', QUERY_STRING='background=true')
+        self.assertEqual(response.status_code, 202)
+        self.assertFalse(Trip.objects.filter(pk=trip.id).exists())
+        self.assertOnlyKeptRowsRemain()
+        self.assertEqual(self.client.get(f'/trips/{trip.id}').status_code, 404)
+
+    def test_purge_commits_in_chunks(self):
+        trip = make_trip(self.user, 7, self.categories)
+        with mock.patch('tripexpensetrackerapi.deletes.touch_trips') as touch:
+            self.assertEqual(purge_trip(trip.id, chunk_size=3), 7)
+        self.assertEqual(touch.call_count, 3)
+        self.assertOnlyKeptRowsRemain()
+
+    def test_delete_rows_runs_one_statement(self):
+        trip = make_trip(self.user, 4)
+        # Filtered through a join, which the DELETE has to carry over as a subquery
+        expenses = Expense.objects.filter(trip__user=self.user, trip=trip).exclude(name='Expense 0')
+        expected = set(Expense.objects.exclude(pk__in=expenses.values('pk')).values_list('pk', flat=True))
+        with self.assertNumQueries(1):
+            self.assertEqual(delete_rows(expenses), 3)
+        self.assertEqual(set(Expense.objects.values_list('pk', flat=True)), expected)
+
+
+class CategorySyncTests(APITestCase):
+    """Expense categories are unique per expense and updated by diff."""
+
+    def setUp(self):
+        self.user = make_user()
+        self.food, self.fuel, self.hotel = make_categories(3)
+        self.expense = make_trip(self.user, 1, [self.food, self.fuel]).expenses.get()
+
+    def update(self, categories):
+        return self.client.put(f'/expenses/{self.expense.id}', {
+            'user': self.user.id, 'name': 'Dinner', 'amount': '20.00', 'description': '', 'date': '2024-01-01',
+            'categories': categories,
+        }, format='json')
+
+    def linked(self):
+        return set(self.expense.categories.values_list('category_id', flat=True))
+
+    def test_duplicate_links_are_rejected(self):
+        with self.assertRaises(IntegrityError):
+            ExpenseCategory.objects.create(expense=self.expense, category=self.food)
+
+    def test_unchanged_categories_write_no_links(self):
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(self.update([self.food.id, self.fuel.id]).status_code, 204)
+        writes = [query['sql'] for query in queries if 'expensecategory' in query['sql'] and not query['sql'].startswith('SELECT')]
+        self.assertEqual(writes, [])
+        self.assertEqual(self.linked(), {self.food.id, self.fuel.id})
+
+    def test_changed_categories_are_diffed(self):
+        kept = self.expense.categories.get(category=self.food).id
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(self.update([self.food.id, self.hotel.id, self.hotel.id]).status_code, 204)
+        link_writes = [query['sql'] for query in queries if 'expensecategory' in query['sql'] and not query['sql'].startswith('SELECT')]
+        # one delete for the removed link and one insert for the added one
+        self.assertEqual(len(link_writes), 2)
+        self.assertEqual(self.linked(), {self.food.id, self.hotel.id})
+        self.assertTrue(ExpenseCategory.objects.filter(pk=kept).exists())
+
+    def test_add_expense_category_is_idempotent(self):
+        url = f'/expenses/{self.expense.id}/add_expense_category'
+        self.assertEqual(self.client.post(url, {'category': self.hotel.id}, format='json').status_code, 201)
+        self.assertEqual(self.client.post(url, {'category': self.hotel.id}, format='json').status_code, 200)
+        response = self.client.post('/expensecategories', {'expense': self.expense.id, 'category': self.hotel.id}, format='json')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.expense.categories.filter(category=self.hotel).count(), 1)
+
+    def test_bulk_update_syncs_categories(self):
+        response = self.client.put('/expenses/bulk', [{
+            'id': self.expense.id, 'user': self.user.id, 'name': 'Dinner', 'amount': '20.00', 'description': '',
+            'date': '2024-01-01', 'categories': [self.hotel.id, self.hotel.id],
+        }], format='json')
+        self.assertEqual(response.status_code, 204)
+        self.assertEqual(self.linked(), {self.hotel.id})
+
+
+
+@override_settings(RESPONSE_CACHE_TIMEOUT=0)
+class FastSerializerTests(APITestCase):
+    """The fast list serializers render exactly what the DRF serializers do."""
+
+    def setUp(self):
+        self.user = make_user()
+        self.other = make_user('Other')
+        food, fuel, hotel = make_categories(3)
+        make_trip(self.user, 4, [hotel, food])
+        make_trip(self.user, 0)
+        make_trip(self.user, 3, [fuel])
+        make_trip(self.other, 2, [food, fuel, hotel])
+        expense = Expense.objects.filter(trip__user=self.user).first()
+        expense.amount = Decimal('7')
+        expense.description = ''
+        expense.save()
+
+    def get(self, url, fast, **params):
+        with override_settings(FAST_LIST_SERIALIZERS=fast):
+            response = self.client.get(url, params)
+        self.assertEqual(response.status_code, 200)
+        return response
+
+    def assertSameResponses(self, url, **params):
+        """Follow every page of `url` with both serializers, comparing the bodies and query counts."""
+        pages = 0
+        while url:
+            pages += 1
+            with CaptureQueriesContext(connection) as slow_queries:
+                slow = self.get(url, False, **params)
+            with CaptureQueriesContext(connection) as fast_queries:
+                fast = self.get(url, True, **params)
+            self.assertEqual(fast.content, slow.content)
+            self.assertLessEqual(len(fast_queries), len(slow_queries))
+            url, params = json.loads(fast.content)['next'], {}
+        self.assertGreater(pages, 1)
+
+    def test_expense_list(self):
+        self.assertSameResponses('/expenses', page_size=3)
+
+    def test_trip_list(self):
+        self.assertSameResponses('/trips', userId=self.user.id, page_size=2)
+
+    def test_expense_category_list(self):
+        self.assertSameResponses('/expensecategories', page_size=5)
+
+    def test_sparse_fieldsets(self):
+        for fieldset in ({'fields': 'id,name,date,total'}, {'include': 'expenses'},
+                         {'fields': 'id', 'include': 'expenses,categories'}, {'include': 'user,expenses'}):
+            self.assertSameResponses('/trips', userId=self.user.id, page_size=2, **fieldset)
+        for fieldset in ({'fields': 'id,amount'}, {'fields': 'amount', 'include': 'categories'}, {'include': 'user'}):
+            self.assertSameResponses('/expenses', page_size=3, **fieldset)
+
+    def test_disabled_uses_drf_serializers(self):
+        with mock.patch('tripexpensetrackerapi.fast_serializers.expense_dicts') as expense_dicts:
+            self.get('/expenses', False)
+        expense_dicts.assert_not_called()
+
+
+class FieldsetTests(APITestCase):
+    """`fields` and `include` trim trip and expense payloads and the queries behind them."""
+
+    def setUp(self):
+        self.user = make_user()
+        self.food, self.fuel = make_categories(2)
+        self.trip = make_trip(self.user, 3, [self.food, self.fuel])
+        self.empty = make_trip(self.user)
+        category_catalog.names()
+
+    def test_trip_overview_is_one_query(self):
+        with self.assertNumQueries(1):
+            response = self.client.get('/trips', {'userId': self.user.id, 'fields': 'id,name,date,total'})
+        self.assertEqual(
+            [dict(trip) for trip in response.data['results']],
+            [
+                {'id': self.trip.id, 'name': 'Trip', 'date': '2024-01-01', 'total': '37.50'},
+                {'id': self.empty.id, 'name': 'Trip', 'date': '2024-01-01', 'total': '0.00'},
+            ],
+        )
+
+    def test_include_embeds_only_named_relations(self):
+        with self.assertNumQueries(2):
+            response = self.client.get('/trips', {'userId': self.user.id, 'include': 'expenses'})
+        trip = response.data['results'][0]
+        self.assertEqual(list(trip), ['id', 'name', 'date', 'description', 'expense_details'])
+        self.assertEqual(list(trip['expense_details'][0]), ['id', 'name', 'amount', 'currency', 'description', 'date'])
+
+        with self.assertNumQueries(3):
+            response = self.client.get('/trips', {'userId': self.user.id, 'include': 'expenses,categories'})
+        self.assertEqual(len(response.data['results'][0]['expense_details'][0]['categories']), 2)
+
+    def test_full_include_matches_default_payload(self):
+        for fast in (True, False):
+            with override_settings(FAST_LIST_SERIALIZERS=fast):
+                default = self.client.get('/trips', {'userId': self.user.id})
+                full = self.client.get('/trips', {'userId': self.user.id, 'include': 'user,expenses,categories'})
+            self.assertEqual(full.content, default.content)
+
+    def test_expense_fields(self):
+        for fast in (True, False):
+            with override_settings(FAST_LIST_SERIALIZERS=fast), self.assertNumQueries(1):
+                response = self.client.get('/expenses', {'fields': 'id,amount'})
+            self.assertEqual(dict(response.data['results'][0]), {'id': self.trip.expenses.order_by('id')[0].id,
+                                                                 'amount': '12.50'})
+
+        expense = self.trip.expenses.first()
+        with self.assertNumQueries(2):
+            response = self.client.get(f'/expenses/{expense.id}', {'fields': 'amount', 'include': 'categories'})
+        self.assertEqual(list(response.data), ['amount', 'categories'])
+        self.assertEqual(response.data['categories'][0]['expense_name'], expense.name)
+
+    def test_trip_detail_caches_each_fieldset(self):
+        url = f'/trips/{self.trip.id}'
+        full = self.client.get(url)
+        sparse = self.client.get(url, {'fields': 'id,total'})
+        self.assertEqual(dict(sparse.data), {'id': self.trip.id, 'total': '37.50'})
+        self.assertNotEqual(sparse['ETag'], full['ETag'])
+        self.assertEqual(self.client.get(url).content, full.content)
+        self.assertEqual(self.client.get(url, {'fields': 'id,total'}).content, sparse.content)
+        cached = self.client.get(url, {'fields': 'id,total'}, HTTP_IF_NONE_MATCH=sparse['ETag'])
+        self.assertEqual(cached.status_code, 304)
+
+    def test_unknown_names_are_rejected(self):
+        for url, params in (('/trips', {'fields': 'id,secret'}), ('/expenses', {'include': 'expenses'}),
+                            (f'/trips/{self.trip.id}', {'include': 'everything'})):
+            response = self.client.get(url, {'userId': self.user.id, **params})
+            self.assertEqual(response.status_code, 400, params)
+            self.assertIn('Unknown', response.data['message'])
+
+
+class ExpenseFilterTests(APITestCase):
+    """The expense list filters and orders on the server, with an index behind every query."""
+
+    def setUp(self):
+        self.user = make_user()
+        self.other = make_user('Other')
+        self.food, self.fuel, self.hotel = make_categories(3)
+        self.trip = make_trip(self.user, 6, [self.food])
+        self.other_trip = make_trip(self.other, 4, [self.fuel, self.hotel], start=date(2024, 2, 1))
+        for i, expense in enumerate(Expense.objects.order_by('id')):
+            expense.amount = Decimal(10 * (i + 1))
+            expense.save()
+        category_catalog.names()
+
+    def ids(self, **params):
+        response = self.client.get('/expenses', params)
+        self.assertEqual(response.status_code, 200, response.data)
+        return [expense['id'] for expense in response.data['results']]
+
+    def expected(self, expenses, *ordering):
+        return list(expenses.order_by(*ordering).values_list('id', flat=True))
+
+    def test_filters(self):
+        expenses = Expense.objects.all()
+        cases = (
+            ({'userId': self.other.id}, expenses.filter(user=self.other)),
+            ({'tripId': self.trip.id}, expenses.filter(trip=self.trip)),
+            ({'dateFrom': '2024-01-03', 'dateTo': '2024-02-02'},
+             expenses.filter(date__range=(date(2024, 1, 3), date(2024, 2, 2)))),
+            ({'categoryId': f'{self.fuel.id},{self.hotel.id}'}, expenses.filter(trip=self.other_trip)),
+            ({'minAmount': '25', 'maxAmount': '70.00'}, expenses.filter(amount_minor__range=(2500, 7000))),
+            ({'userId': self.user.id, 'minAmount': '30', 'categoryId': self.food.id},
+             expenses.filter(user=self.user, amount_minor__gte=3000)),
+        )
+        for params, matching in cases:
+            self.assertEqual(self.ids(**params), self.expected(matching, 'date', 'id'), params)
+
+    def test_orderings_paginate(self):
+        orderings = (
+            ('-date', ('-date', '-id')), ('amount', ('amount_minor', 'id')), ('-amount', ('-amount_minor', '-id')),
+        )
+        for ordering, fields in orderings:
+            ids, url, params = [], '/expenses', {'ordering': ordering, 'page_size': 3}
+            while url:
+                response = self.client.get(url, params)
+                ids += [expense['id'] for expense in response.data['results']]
+                url, params = response.data['next'], {}
+            self.assertEqual(ids, self.expected(Expense.objects.all(), *fields), ordering)
+
+    def test_invalid_values_are_rejected(self):
+        for params in ({'userId': 'me'}, {'dateFrom': '2024-13-01'}, {'minAmount': 'NaN'},
+                       {'categoryId': '1,x'}, {'ordering': 'name'}):
+            response = self.client.get('/expenses', params)
+            self.assertEqual(response.status_code, 400, params)
+            self.assertIn(list(params)[0], response.data['message'])
+
+    def test_filtered_list_query_count(self):
+        with self.assertNumQueries(2):
+            self.client.get('/expenses', {'userId': self.user.id, 'categoryId': self.food.id, 'ordering': '-amount'})
+
+    def test_every_filter_combination_uses_an_index(self):
+        out = io.StringIO()
+        call_command('bench_expense_filters', trips=2, expenses=20, stdout=out)
+        # 32 filter combinations in 4 orderings, plus the header
+        self.assertEqual(len(out.getvalue().splitlines()), 129)
+
+
+class MetricsTests(APITestCase):
+    """Requests report their queries and timings in Server-Timing and on /metrics."""
+
+    def setUp(self):
+        metrics.reset()
+        self.user = make_user()
+        self.trip = make_trip(self.user, 3, make_categories(2))
+        category_catalog.names()
+
+    def timings(self, response):
+        return dict(entry.split(';', 1) for entry in response['Server-Timing'].split(', '))
+
+    def test_server_timing(self):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(f'/trips/{self.trip.id}')
+        timings = self.timings(response)
+        self.assertEqual(list(timings), ['db', 'serialize', 'total'])
+        self.assertIn(f'desc="{len(queries)} queries"', timings['db'])
+
+        with override_settings(SERVER_TIMING_HEADER=False):
+            self.assertNotIn('Server-Timing', self.client.get('/expenses'))
+
+    def test_no_server_timing_on_streamed_responses(self):
+        response = self.client.get('/expenses/export', {'userId': self.user.id})
+        self.assertTrue(response.streaming)
+        self.assertNotIn('Server-Timing', response)
+
+    def test_metrics_are_only_served_to_allowed_addresses(self):
+        self.assertEqual(self.client.get('/metrics', REMOTE_ADDR='203.0.113.7').status_code, 403)
+        with override_settings(METRICS_ALLOWED_IPS=['203.0.113.7']):
+            self.assertEqual(self.client.get('/metrics', REMOTE_ADDR='203.0.113.7').status_code, 200)
+            self.assertEqual(self.client.get('/metrics').status_code, 403)
+
+    def test_metrics_endpoint(self):
+        self.client.get(f'/trips/{self.trip.id}')
+        self.client.get(f'/trips/{self.trip.id}')
+        self.client.get('/trips/999')
+        with override_settings(FAST_LIST_SERIALIZERS=True):
+            self.client.get('/expenses')
+        async_to_sync(AsyncClient().get)('/expenses')
+
+        response = self.client.get('/metrics')
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response['Content-Type'].startswith('text/plain; version=0.0.4'))
+        body = response.content.decode()
+        self.assertIn('http_request_duration_seconds_count{view="TripView.retrieve",method="GET"} 3', body)
+        self.assertIn('http_request_duration_seconds_bucket{view="TripView.retrieve",method="GET",le="+Inf"} 3', body)
+        self.assertIn('http_responses_total{view="TripView.retrieve",method="GET",status="404"} 1', body)
+        self.assertIn('db_queries_total{view="ExpenseView.list",method="GET"} 2', body)
+        self.assertIn('http_request_duration_seconds_count{view="async_views.expense_list",method="GET"} 1', body)
+        self.assertIn('response_cache_events_total{event="hits"}', body)
+        serialize = [line for line in body.splitlines() if line.startswith('serialize_seconds_total{view="ExpenseView.list"')]
+        self.assertGreater(float(serialize[0].split()[-1]), 0)
+
+    def test_fingerprint(self):
+        sql = """SELECT "id" FROM "t" WHERE "id" IN (%s, %s, %s) AND "name" = 'O''Hara'  AND "n" > 12.5 LIMIT 21"""
+        self.assertEqual(
+            slow_queries.fingerprint(sql),
+            'SELECT "id" FROM "t" WHERE "id" IN (...) AND "name" = ? AND "n" > ? LIMIT ?',
+        )
+        self.assertEqual(slow_queries.fingerprint(sql.replace('%s, %s, %s', '%s')), slow_queries.fingerprint(sql))
+
+    def test_slow_query_log(self):
+        self.client.get('/expenses')
+        self.assertEqual(slow_queries.top(), [])
+
+        with override_settings(SLOW_QUERY_LOG=True, SLOW_QUERY_SAMPLE_RATE=1.0, SLOW_QUERY_THRESHOLD_MS=0,
+                               RESPONSE_CACHE_TIMEOUT=0):
+            with self.assertLogs('tripexpensetrackerapi.slow_queries', 'WARNING'):
+                for _ in range(3):
+                    self.client.get(f'/trips/{self.trip.id}', {'fields': 'id'})
+            top = slow_queries.top(5)
+            body = self.client.get('/metrics').content.decode()
+        trip_query = [row for row in top if row[0].startswith('SELECT "tripexpensetrackerapi_trip"."id"')]
+        self.assertEqual(trip_query[0][1], 3)
+        self.assertIn('db_query_fingerprint_total{fingerprint="SELECT', body)
+
+
+class ProfilingTests(APITestCase):
+    """Requests with a signed header, or sampled, are profiled to a bounded directory."""
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.addCleanup(self.directory.cleanup)
+        settings = override_settings(PROFILE_DIR=self.directory.name, PROFILE_MAX_FILES=3)
+        settings.enable()
+        self.addCleanup(settings.disable)
+        self.user = make_user()
+        self.trip = make_trip(self.user, 2, make_categories(1))
+
+    def profiles(self):
+        return [tags for _, tags in profiling.profile_files()]
+
+    def test_signed_header_profiles_the_request(self):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(f'/trips/{self.trip.id}', HTTP_X_PROFILE=profiling.make_token())
+        self.assertEqual(response.status_code, 200)
+        [tags] = self.profiles()
+        self.assertEqual(tags['view'], 'TripView.retrieve')
+        self.assertEqual(tags['queries'], str(len(queries)))
+        self.assertTrue(response['X-Profile-File'].endswith(f"-TripView.retrieve-GET-200-{len(queries)}q-{tags['ms']}ms.prof"))
+
+    def test_unsigned_or_expired_header_is_ignored(self):
+        response = self.client.get(f'/trips/{self.trip.id}', HTTP_X_PROFILE='profile:forged:signature')
+        self.assertNotIn('X-Profile-File', response)
+        token = profiling.make_token()
+        with override_settings(PROFILE_TOKEN_MAX_AGE=-1):
+            self.client.get(f'/trips/{self.trip.id}', HTTP_X_PROFILE=token)
+        self.client.get(f'/trips/{self.trip.id}')
+        self.assertEqual(self.profiles(), [])
+
+    def test_overlapping_requests_are_profiled_one_at_a_time(self):
+        profiling_started, request_done = threading.Event(), threading.Event()
+
+        def other_request():
+            # Stands in for a request being profiled on another worker thread
+            profiler = profiling.start()
+            profiling_started.set()
+            request_done.wait(5)
+            profiling.stop(profiler)
+
+        other = threading.Thread(target=other_request)
+        other.start()
+        profiling_started.wait(5)
+        try:
+            response = self.client.get(f'/trips/{self.trip.id}', HTTP_X_PROFILE=profiling.make_token())
+        finally:
+            request_done.set()
+            other.join()
+        self.assertEqual(response.status_code, 200)
+        self.assertNotIn('X-Profile-File', response)
+        response = self.client.get(f'/trips/{self.trip.id}', HTTP_X_PROFILE=profiling.make_token())
+        self.assertIn('X-Profile-File', response)
+
+    def test_sampling_and_rotation(self):
+        with override_settings(PROFILE_SAMPLE_RATE=1.0):
+            for _ in range(5):
+                self.client.get('/expenses')
+        profiles = self.profiles()
+        self.assertEqual(len(profiles), 3)
+        self.assertEqual({tags['view'] for tags in profiles}, {'ExpenseView.list'})
+
+    def test_summary(self):
+        token = profiling.make_token()
+        self.client.get(f'/trips/{self.trip.id}', HTTP_X_PROFILE=token)
+        self.client.get('/expenses', HTTP_X_PROFILE=token)
+        out = io.StringIO()
+        call_command('profile_summary', view='TripView.retrieve', stdout=out)
+        summary = out.getvalue()
+        self.assertRegex(summary, r'TripView.retrieve +GET +1 ')
+        self.assertNotIn('ExpenseView.list', summary)
+        self.assertIn('(retrieve)', summary)
+
+
+class BenchmarkSuiteTests(TestCase):
+    """seed_bench generates reproducible data and bench_api drives every route against it."""
+
+    def seed(self, seed=0, **options):
+        options = {'users': 3, 'trips_per_user': 2, 'expenses_per_trip': 10, 'seed': seed, **options}
+        call_command('seed_bench', stdout=io.StringIO(), **options)
+
+    def snapshot(self):
+        return list(Expense.objects.filter(user__uid__startswith='seed-').order_by('id').values_list(
+            'user__uid', 'name', 'amount_minor', 'currency', 'date', 'trip__name',
+        ))
+
+    def test_seed_is_reproducible_and_skewed(self):
+        self.seed(categories=8, skew=2)
+        first = self.snapshot()
+        links = {
+            category['category__name']: category['count'] for category in ExpenseCategory.objects.values(
+                'category__name'
+            ).annotate(count=models.Count('id'))
+        }
+        self.assertEqual(len(first), 60)
+        self.assertGreater(links['Seed: Food'], 3 * links.get('Seed: Other', links.get('Seed: Coffee', 0)))
+
+        self.seed(categories=8, skew=2, clear=True)
+        self.assertEqual(self.snapshot(), first)
+        with self.assertRaises(CommandError):
+            self.seed()
+
+    def test_bench_api_covers_every_route(self):
+        from tripexpensetrackerapi.management.commands._api_cases import CASES, UNCOVERED
+        from tripexpensetrackerapi.management.commands.bench_api import url_routes
+        covered = {(route, method) for route, method, _ in CASES.values()}
+        self.assertEqual(url_routes(), covered | set(UNCOVERED))
+
+    def test_bench_api_results_and_baseline(self):
+        with self.assertRaises(CommandError):
+            call_command('bench_api', stdout=io.StringIO())
+        self.seed()
+        before = self.snapshot()
+        with tempfile.TemporaryDirectory() as directory:
+            output = Path(directory) / 'results.json'
+            call_command('bench_api', requests=3, warmup=1, output=str(output), stdout=io.StringIO())
+            results = json.loads(output.read_text())
+            for name, result in results['routes'].items():
+                self.assertEqual(result['errors'], 0, name)
+                self.assertEqual(result['requests'], 3, name)
+                self.assertLessEqual(result['p50_ms'], result['p99_ms'], name)
+            self.assertEqual(results['routes']['trip_detail']['method'], 'GET')
+            self.assertGreater(results['routes']['expense_list']['queries'], 0)
+
+            # A baseline that was far faster and used fewer queries makes the comparison fail
+            for result in results['routes'].values():
+                result['p95_ms'] /= 100
+            results['routes']['expense_list']['queries'] = 0
+            output.write_text(json.dumps(results))
+            out = io.StringIO()
+            with self.assertRaisesRegex(CommandError, 'regression'):
+                call_command(
+                    'bench_api', requests=3, warmup=0, only='^expense_list$', baseline=str(output),
+                    fail_on_regression=True, stdout=out,
+                )
+            # Only p95 was made faster, so only its change is sure to be positive
+            self.assertRegex(out.getvalue(), r'expense_list +[-+]\d+\.\d% +\+\d')
+        self.assertEqual(self.snapshot(), before)
+
+
+class MultiCurrencyTests(APITestCase):
+    """Amounts are stored in minor units and totals are converted to the home currency in the database."""
+
+    def setUp(self):
+        self.user = make_user()
+        self.trip = make_trip(self.user)
+        for currency, day, rate in (('EUR', 1, '1.10'), ('EUR', 5, '1.20'), ('JPY', 1, '0.0067')):
+            FxRate.objects.create(currency=currency, date=date(2024, 1, day), rate=fx.scaled_rate(rate, currency))
+        for amount, currency, day in (('10.00', 'USD', 1), ('10.00', 'EUR', 2), ('10.00', 'EUR', 6), ('1000', 'JPY', 3)):
+            response = self.create(amount, currency, date(2024, 1, day))
+            self.assertEqual(response.status_code, 201, response.data)
+
+    def create(self, amount, currency, day, trip=True):
+        return self.client.post('/expenses', {
+            'user': self.user.id, 'trip': self.trip.id if trip else None, 'name': 'E', 'amount': amount,
+            'currency': currency, 'description': '', 'date': day.isoformat(),
+        }, format='json')
+
+    def test_amounts_keep_their_currency(self):
+        self.assertEqual(
+            sorted(Expense.objects.values_list('currency', 'amount_minor')),
+            [('EUR', 1000), ('EUR', 1000), ('JPY', 1000), ('USD', 1000)],
+        )
+        expense = Expense.objects.get(currency='JPY')
+        response = self.client.get(f'/expenses/{expense.id}')
+        self.assertEqual((response.data['amount'], response.data['currency']), ('1000', 'JPY'))
+        self.assertEqual(self.create('1000.5', 'JPY', date(2024, 1, 3)).status_code, 400)
+
+    def test_totals_are_converted_at_the_rate_of_each_date(self):
+        # 10.00 + 10.00 * 1.10 + 10.00 * 1.20 + 1000 * 0.0067
+        self.assertEqual(self.client.get(f'/trips/{self.trip.id}', {'fields': 'total'}).data['total'], '39.70')
+        summary = self.client.get(f'/trips/{self.trip.id}/summary').data
+        self.assertEqual((summary['currency'], summary['total'], summary['count']), ('USD', '39.70', 4))
+        self.assertEqual((summary['min'], summary['max']), ('6.70', '12.00'))
+        with self.assertNumQueries(2):
+            totals = self.client.get(f'/users/{self.user.id}/totals').data
+        self.assertEqual(totals['total'], '39.70')
+        self.assertEqual(totals['currencies'], [
+            {'currency': 'EUR', 'total': '20.00', 'count': 2},
+            {'currency': 'JPY', 'total': '1000', 'count': 1},
+            {'currency': 'USD', 'total': '10.00', 'count': 1},
+        ])
+
+    def test_currencies_without_a_rate_are_rejected(self):
+        self.assertEqual(self.create('5.00', 'GBP', date(2024, 1, 2)).status_code, 400)
+        self.assertEqual(self.create('5.00', 'EUR', date(2023, 12, 31)).status_code, 400)
+        self.assertEqual(self.create('5.00', 'EURO', date(2024, 1, 2)).status_code, 400)
+        response = self.client.post('/expenses/bulk', [{
+            'user': self.user.id, 'name': 'E', 'amount': '5.00', 'currency': 'GBP', 'description': '',
+            'date': '2024-01-02', 'categories': [],
+        }], format='json')
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('currency', response.data['errors'][0]['errors'])
+        self.assertEqual(Expense.objects.count(), 4)
+
+    def test_rates_that_expenses_convert_at_cannot_be_deleted(self):
+        # The EUR expense of January 2 has no other rate on or before its date
+        with self.assertRaises(fx.RateInUse), transaction.atomic():
+            FxRate.objects.get(currency='EUR', date=date(2024, 1, 1)).delete()
+        self.assertEqual(self.client.get(f'/users/{self.user.id}/totals').data['total'], '39.70')
+        # The expense of January 6 falls back to the rate of January 1
+        FxRate.objects.get(currency='EUR', date=date(2024, 1, 5)).delete()
+        self.assertEqual(self.client.get(f'/users/{self.user.id}/totals').data['total'], '38.70')
+        summary = self.client.get(f'/trips/{self.trip.id}/summary').data
+        self.assertEqual((summary['total'], summary['count']), ('38.70', 4))
+
+    def test_totals_of_an_invalid_user_id(self):
+        self.assertEqual(self.client.get('/users/999/totals').status_code, 404)
+        response = self.client.get('/users/abc/totals')
+        self.assertEqual(response.status_code, 500)
+        self.assertIn('message', response.data)
+
+    def test_rate_changes_update_cached_totals(self):
+        etag = self.client.get(f'/trips/{self.trip.id}', {'fields': 'total'})['ETag']
+        self.assertEqual(fx.rates.rate('EUR', date(2024, 1, 7)), fx.scaled_rate('1.20', 'EUR'))
+        time.sleep(0.001)
+        rate = FxRate.objects.get(currency='EUR', date=date(2024, 1, 5))
+        rate.rate = fx.scaled_rate('1.30', 'EUR')
+        rate.save()
+        self.assertEqual(fx.rates.rate('EUR', date(2024, 1, 7)), fx.scaled_rate('1.30', 'EUR'))
+        response = self.client.get(f'/trips/{self.trip.id}', {'fields': 'total'})
+        self.assertNotEqual(response['ETag'], etag)
+        self.assertEqual(response.data['total'], '40.70')
+
+    def test_rates_are_looked_up_again_once_their_stamp_is_evicted(self):
+        cache.delete(fx.VERSION_KEY)
+        self.assertEqual(fx.rates.rate('EUR', date(2024, 1, 7)), fx.scaled_rate('1.20', 'EUR'))
+        # Another process changes the rate, and the stamp it publishes is then culled from the cache
+        FxRate.objects.filter(currency='EUR', date=date(2024, 1, 5)).update(rate=fx.scaled_rate('1.30', 'EUR'))
+        cache.delete(fx.VERSION_KEY)
+        self.assertEqual(fx.rates.rate('EUR', date(2024, 1, 7)), fx.scaled_rate('1.30', 'EUR'))
+
+    def test_amount_filters_use_the_given_currency(self):
+        response = self.client.get('/expenses', {'userId': self.user.id, 'minAmount': '500', 'currency': 'JPY'})
+        self.assertEqual([expense['currency'] for expense in response.data['results']], ['JPY'])
+
+    def test_amounts_are_only_compared_within_one_currency(self):
+        # ¥5000 is about $33.50, but its 5000 minor units are more than the 4500 of $45.00
+        self.create('5000', 'JPY', date(2024, 1, 3))
+        self.create('40.00', 'USD', date(2024, 1, 3))
+
+        def listed(params):
+            response = self.client.get('/expenses', {'userId': self.user.id, **params})
+            self.assertEqual(response.status_code, 200, response.data)
+            return [(expense['amount'], expense['currency']) for expense in response.data['results']]
+
+        self.assertEqual(listed({'minAmount': '45'}), [])
+        self.assertEqual(listed({'minAmount': '20', 'maxAmount': '45.00'}), [('40.00', 'USD')])
+        self.assertEqual(listed({'minAmount': '2000', 'currency': 'JPY'}), [('5000', 'JPY')])
+        self.assertEqual(listed({'ordering': '-amount'}), [('40.00', 'USD'), ('10.00', 'USD')])
+        self.assertEqual(listed({'ordering': 'amount', 'currency': 'JPY'}), [('1000', 'JPY'), ('5000', 'JPY')])
+        self.assertEqual(len(listed({})), 6)
+
+    def test_bench_totals_agree(self):
+        out = io.StringIO()
+        call_command('bench_fx_totals', expenses=200, trips=3, days=10, repeat=1, stdout=out)
+        # The header and one line per approach, all with the same total
+        lines = out.getvalue().splitlines()
+        self.assertEqual(len(lines), 5)
+        self.assertEqual(len({line.split()[-1] for line in lines[1:]}), 1)
+
+
+class ExpenseSearchTests(APITestCase):
+    """Expense search runs through an FTS5 index kept in step with the expense table by triggers."""
+
+    def setUp(self):
+        self.user = make_user()
+        self.other = make_user('Other')
+        self.expenses = {}
+        for name, description in (
+            ('Hotel night', 'Two nights downtown'),
+            ('Breakfast', 'Buffet at the hotel'),
+            ('Taxi', 'Airport to hotel'),
+            ('Rental car', 'Compact'),
+            ('Car wash', 'Before returning the rental'),
+        ):
+            self.expenses[name] = Expense.objects.create(
+                user=self.user, name=name, amount_minor=100, description=description, date=date(2024, 1, 1),
+            )
+        Expense.objects.create(user=self.other, name='Hotel', amount_minor=100, description='', date=date(2024, 1, 1))
+
+    def names(self, q, **params):
+        response = self.client.get('/expenses/search', {'userId': self.user.id, 'q': q, **params})
+        self.assertEqual(response.status_code, 200, response.data)
+        return [expense['name'] for expense in response.data['results']]
+
+    def test_ranked_and_scoped_to_the_user(self):
+        names = self.names('hotel')
+        self.assertEqual(names[0], 'Hotel night')
+        self.assertEqual(sorted(names[1:]), ['Breakfast', 'Taxi'])
+        self.assertEqual(self.names(str(self.user.id)), [])
+
+    def test_prefix_and_phrase_queries(self):
+        self.assertEqual(self.names('tax*'), ['Taxi'])
+        self.assertEqual(self.names('tax'), [])
+        self.assertEqual(self.names('"rental car"'), ['Rental car'])
+        self.assertEqual(sorted(self.names('car rental')), ['Car wash', 'Rental car'])
+        # FTS5 operators are taken as plain words
+        self.assertEqual(self.names('hotel OR NEAR(taxi'), [])
+
+    def test_index_follows_every_kind_of_write(self):
+        taxi = self.expenses['Taxi']
+        taxi.name = 'Shuttle'
+        taxi.save()
+        Expense.objects.filter(pk=self.expenses['Breakfast'].pk).update(description='Buffet')
+        car = self.expenses['Rental car']
+        car.name = 'Rental van'
+        Expense.objects.bulk_update([car], ['name'])
+        Expense.objects.filter(pk=self.expenses['Hotel night'].pk).delete()
+        Expense.objects.filter(pk=self.expenses['Car wash'].pk).update(user=self.other)
+        self.assertEqual(self.names('hotel'), ['Shuttle'])
+        self.assertEqual(self.names('van'), ['Rental van'])
+        self.assertEqual(self.names('wash'), [])
+
+    def test_pages_follow_the_ranking(self):
+        expected = self.names('hotel')
+        names, url, params = [], '/expenses/search', {'userId': self.user.id, 'q': 'hotel', 'page_size': 1}
+        while url:
+            response = self.client.get(url, params)
+            self.assertEqual(response.status_code, 200)
+            names += [expense['name'] for expense in response.data['results']]
+            url, params = response.data['next'], {}
+        self.assertEqual(names, expected)
+
+    def test_fieldsets_and_invalid_requests(self):
+        response = self.client.get('/expenses/search', {'userId': self.user.id, 'q': 'taxi', 'fields': 'id,name'})
+        self.assertEqual(response.data['results'], [{'id': self.expenses['Taxi'].id, 'name': 'Taxi'}])
+        for params in ({'q': 'hotel'}, {'userId': self.user.id}, {'userId': self.user.id, 'q': '*** ""'},
+                       {'userId': self.user.id, 'q': 'hotel', 'cursor': 'bad'},
+                       {'userId': self.user.id, 'q': ' '.join(['a'] * 17)}):
+            self.assertEqual(self.client.get('/expenses/search', params).status_code, 400, params)
+
+    def test_rebuild_restores_a_lost_index(self):
+        with connection.cursor() as cursor:
+            for statement in search.DROP:
+                cursor.execute(statement)
+        Expense.objects.create(user=self.user, name='Ferry', amount_minor=100, description='', date=date(2024, 1, 2))
+        out = io.StringIO()
+        call_command('rebuild_search_index', stdout=out)
+        self.assertIn('Indexed 7 expenses', out.getvalue())
+        self.assertEqual(self.names('ferry'), ['Ferry'])
+        self.assertEqual(len(self.names('hotel')), 3)
+
+
+class SuggestionTests(APITestCase):
+    """Typeahead suggestions come from a per-user prefix index kept in memory."""
+
+    def setUp(self):
+        suggestions.clear()
+        self.user = make_user()
+        self.food, self.taxi = make_categories(2)
+        category_catalog.names()
+        for name, categories in (
+            ('Taxi', [self.taxi]), ('taxi ', [self.taxi]), ('Taxi', [self.food]), ('Tapas', [self.food]),
+            ('Train', []),
+        ):
+            self.create(name, categories)
+
+    def create(self, name, categories):
+        response = self.client.post('/expenses', {
+            'user': self.user.id, 'name': name, 'amount': '1.00', 'description': '', 'date': '2024-01-01',
+            'categories': [category.id for category in categories],
+        }, format='json')
+        self.assertEqual(response.status_code, 201)
+        return response.data['id']
+
+    def suggest(self, q, **params):
+        response = self.client.get('/expenses/suggest', {'userId': self.user.id, 'q': q, **params})
+        self.assertEqual(response.status_code, 200)
+        return [(item['name'], item['count']) for item in response.data['results']]
+
+    def test_most_used_names_for_a_prefix(self):
+        self.assertEqual(self.suggest('ta'), [('Taxi', 3), ('Tapas', 1)])
+        self.assertEqual(self.suggest('T', limit=1), [('Taxi', 3)])
+        self.assertEqual(self.suggest('x'), [])
+        response = self.client.get('/expenses/suggest', {'userId': self.user.id, 'q': 'tax'})
+        self.assertEqual(response.data['results'][0]['categories'], [
+            {'id': self.taxi.id, 'name': self.taxi.name}, {'id': self.food.id, 'name': self.food.name},
+        ])
+
+    def test_warm_lookups_run_no_queries(self):
+        self.suggest('t')
+        with self.assertNumQueries(0):
+            self.suggest('tr')
+
+    def test_creates_and_updates_adjust_a_loaded_index(self):
+        self.suggest('t')
+        with self.captureOnCommitCallbacks(execute=True):
+            expense_id = self.create('Tram', [self.taxi])
+        self.assertEqual(self.suggest('tram'), [('Tram', 1)])
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.put(f'/expenses/{expense_id}', {
+                'user': self.user.id, 'name': 'Tapas', 'amount': '1.00', 'description': '', 'date': '2024-01-01',
+                'categories': [self.food.id],
+            }, format='json')
+        self.assertEqual(response.status_code, 204)
+        with self.assertNumQueries(0):
+            self.assertEqual(self.suggest('ta'), [('Taxi', 3), ('Tapas', 2)])
+            self.assertEqual(self.suggest('tram'), [])
+        suggestions.clear()
+        self.assertEqual(self.suggest('ta'), [('Taxi', 3), ('Tapas', 2)])
+
+    def test_indexes_are_evicted_under_the_budget(self):
+        other = make_user('Other')
+        # The user's three names and the other user's empty index cost one more than this budget
+        with mock.patch.object(suggestions, 'indexes', LRUCache(max_size=4)):
+            self.suggest('t')
+            self.assertTrue(suggestions.loaded(self.user.id))
+            suggestions.suggest(other.id, 't')
+            self.assertFalse(suggestions.loaded(self.user.id))
+
+    def test_invalid_requests(self):
+        for params in ({'q': 't'}, {'userId': 'me'}, {'userId': self.user.id, 'limit': 0}):
+            self.assertEqual(self.client.get('/expenses/suggest', params).status_code, 400, params)
+
+
+class MonthlyRollupTests(APITestCase):
+    """Every expense write keeps the monthly rollups equal to a recount, and the dashboard reads only the rollups."""
+
+    def setUp(self):
+        self.user = make_user()
+        self.food, self.taxi = make_categories(2)
+        self.trip = make_trip(self.user)
+        category_catalog.names()
+        FxRate.objects.create(currency='EUR', date=date(2024, 1, 1), rate=fx.scaled_rate('1.10', 'EUR'))
+
+    def create(self, day, categories=(), amount='10.00', currency='USD', trip=None):
+        response = self.client.post('/expenses', {
+            'user': self.user.id, 'trip': trip, 'name': 'E', 'amount': amount, 'currency': currency,
+            'description': '', 'date': day, 'categories': [category.id for category in categories],
+        }, format='json')
+        self.assertEqual(response.status_code, 201, response.data)
+        return response.data['id']
+
+    def assertRollupsCounted(self):
+        """The rollup rows hold exactly what recounting the expenses gives."""
+        rows = {
+            (row.user_id, row.month, row.category_id): [row.total, row.count] for row in MonthlyRollup.objects.all()
+        }
+        self.assertEqual(rows, dict(rollups.deltas(Expense.objects.all())))
+
+    def rollup(self, month, category=None):
+        row = MonthlyRollup.objects.filter(user=self.user, month=month, category=category).first()
+        return (fx.format_home(row.total), row.count) if row else None
+
+    def test_creates_updates_and_deletes(self):
+        expense_id = self.create('2024-01-05', [self.food, self.taxi])
+        self.create('2024-01-20', [self.food], amount='5.00', currency='EUR')
+        self.assertEqual(self.rollup(date(2024, 1, 1)), ('15.50', 2))
+        self.assertEqual(self.rollup(date(2024, 1, 1), self.food), ('15.50', 2))
+        self.assertEqual(self.rollup(date(2024, 1, 1), self.taxi), ('10.00', 1))
+        self.assertRollupsCounted()
+
+        # A new month and a category swap move the expense between rows
+        response = self.client.put(f'/expenses/{expense_id}', {
+            'user': self.user.id, 'name': 'E', 'amount': '20.00', 'description': '', 'date': '2024-02-01',
+            'categories': [self.taxi.id],
+        }, format='json')
+        self.assertEqual(response.status_code, 204)
+        self.assertEqual(self.rollup(date(2024, 1, 1)), ('5.50', 1))
+        self.assertIsNone(self.rollup(date(2024, 1, 1), self.taxi))
+        self.assertEqual(self.rollup(date(2024, 2, 1), self.taxi), ('20.00', 1))
+        self.assertRollupsCounted()
+
+        self.client.post(f'/expenses/{expense_id}/add_expense_category', {'category': self.food.id}, format='json')
+        self.assertEqual(self.rollup(date(2024, 2, 1), self.food), ('20.00', 1))
+        link = ExpenseCategory.objects.get(expense_id=expense_id, category=self.taxi)
+        self.assertEqual(self.client.delete(f'/expensecategories/{link.id}').status_code, 204)
+        self.assertIsNone(self.rollup(date(2024, 2, 1), self.taxi))
+        self.assertRollupsCounted()
+
+        self.assertEqual(self.client.delete(f'/expenses/{expense_id}').status_code, 204)
+        self.assertIsNone(self.rollup(date(2024, 2, 1)))
+        self.assertRollupsCounted()
+
+    def test_moving_an_expense_to_another_users_trip(self):
+        expense_id = self.create('2024-01-05', [self.food])
+        other = make_user('Other')
+        trip = make_trip(other)
+        response = self.client.post(f'/trips/{trip.id}/add_trip_expense', {'expense': expense_id}, format='json')
+        self.assertEqual(response.status_code, 201)
+        self.assertIsNone(self.rollup(date(2024, 1, 1)))
+        self.assertEqual(MonthlyRollup.objects.get(user=other, category=self.food).count, 1)
+        self.assertRollupsCounted()
+
+    def test_trip_deletes(self):
+        for day in ('2024-01-05', '2024-02-05', '2024-02-06'):
+            self.create(day, [self.food], trip=self.trip.id)
+        kept = self.create('2024-02-07', [self.food])
+        self.assertEqual(self.client.delete(f'/trips/{self.trip.id}').status_code, 204)
+        self.assertEqual(self.rollup(date(2024, 2, 1), self.food), ('10.00', 1))
+        self.assertIsNone(self.rollup(date(2024, 1, 1)))
+        self.assertRollupsCounted()
+
+        trip = make_trip(self.user)
+        Expense.objects.filter(pk=kept).update(trip=trip)
+        self.assertEqual(purge_trip(trip.id, chunk_size=1), 1)
+        self.assertFalse(MonthlyRollup.objects.exists())
+
+    def test_bulk_writes(self):
+        items = [
+            {
+                'user': self.user.id, 'name': f'B{i}', 'amount': '1.00', 'description': '',
+                'date': f'2024-0{i + 1}-01', 'categories': [self.food.id],
+            }
+            for i in range(3)
+        ]
+        ids = [expense['id'] for expense in self.client.post('/expenses/bulk', items, format='json').data]
+        self.assertRollupsCounted()
+        items = [{'id': expense_id, **item, 'date': '2024-03-15'} for expense_id, item in zip(ids, items)]
+        items[0]['categories'] = [self.taxi.id]
+        self.assertEqual(self.client.put('/expenses/bulk', items, format='json').status_code, 204)
+        self.assertEqual(self.rollup(date(2024, 3, 1)), ('3.00', 3))
+        self.assertEqual(self.rollup(date(2024, 3, 1), self.taxi), ('1.00', 1))
+        self.assertIsNone(self.rollup(date(2024, 1, 1)))
+        self.assertRollupsCounted()
+        self.assertEqual(self.client.delete('/expenses/bulk', ids[:2], format='json').status_code, 204)
+        self.assertEqual(self.rollup(date(2024, 3, 1)), ('1.00', 1))
+        self.assertRollupsCounted()
+
+    def test_rate_changes_rebuild_the_months_they_convert(self):
+        self.create('2024-01-20', [self.food], amount='5.00', currency='EUR')
+        self.create('2024-03-20', [self.food], amount='5.00', currency='EUR')
+        FxRate.objects.create(currency='EUR', date=date(2024, 3, 1), rate=fx.scaled_rate('1.20', 'EUR'))
+        self.assertEqual(self.rollup(date(2024, 1, 1)), ('5.50', 1))
+        self.assertEqual(self.rollup(date(2024, 3, 1), self.food), ('6.00', 1))
+        self.assertRollupsCounted()
+
+    def test_rebuild(self):
+        make_trip(self.user, expense_count=5, categories=[self.food])
+        # Written without the API, so not yet counted
+        self.assertFalse(MonthlyRollup.objects.exists())
+        out = io.StringIO()
+        call_command('rebuild_rollups', user=[self.user.id], stdout=out)
+        self.assertIn('Wrote 2 rollup rows for 1 users', out.getvalue())
+        self.assertEqual(self.rollup(date(2024, 1, 1), self.food), ('62.50', 5))
+        self.assertRollupsCounted()
+
+    def test_dashboard(self):
+        first, second, third = rollups.months_back(3, date.today())
+        self.create(first.isoformat(), [self.food, self.taxi])
+        self.create(third.isoformat(), [self.taxi], amount='2.00')
+        self.create((first - timedelta(days=1)).isoformat(), [self.taxi])
+        response = self.client.get(f'/users/{self.user.id}/dashboard', {'months': 3})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['currency'], 'USD')
+        self.assertEqual(
+            [(month['month'], month['total'], month['count']) for month in response.data['months']],
+            [(f'{first:%Y-%m}', '10.00', 1), (f'{second:%Y-%m}', '0.00', 0), (f'{third:%Y-%m}', '2.00', 1)],
+        )
+        self.assertEqual(response.data['months'][0]['categories'], [
+            {'id': self.food.id, 'name': self.food.name, 'total': '10.00', 'count': 1},
+            {'id': self.taxi.id, 'name': self.taxi.name, 'total': '10.00', 'count': 1},
+        ])
+        self.assertEqual(self.client.get(f'/users/{self.user.id}/dashboard', {'months': 0}).status_code, 400)
+        self.assertEqual(self.client.get(f'/users/{self.user.id}/dashboard', {'months': 'x'}).status_code, 400)
+        self.assertEqual(self.client.get('/users/999/dashboard').status_code, 404)
+        self.assertIn('message', self.client.get('/users/abc/dashboard').data)
+
+    def test_dashboard_costs_the_same_for_any_number_of_expenses(self):
+        months = rollups.months_back(3, date.today())
+        counts = []
+        for size in (1, 20):
+            for i in range(size):
+                self.create(months[i % 3].isoformat(), [self.food])
+            with CaptureQueriesContext(connection) as queries:
+                self.assertEqual(self.client.get(f'/users/{self.user.id}/dashboard').status_code, 200)
+            counts.append(len(queries))
+        self.assertEqual(counts[0], counts[1])
+
+
+class AnalyticsTests(APITestCase):
+    """Spending analytics are computed over the user's expenses loaded as NumPy arrays."""
+
+    def setUp(self):
+        analytics.clear()
+        self.user = make_user()
+        self.food, self.taxi = make_categories(2)
+        category_catalog.names()
+        FxRate.objects.create(currency='EUR', date=date(2024, 1, 1), rate=fx.scaled_rate('1.10', 'EUR'))
+
+    def add(self, amount_minor, day=date(2024, 1, 1), categories=(), currency='USD'):
+        expense = Expense.objects.create(
+            user=self.user, name='E', amount_minor=amount_minor, currency=currency, description='', date=day,
+        )
+        for category in categories:
+            ExpenseCategory.objects.create(expense=expense, category=category)
+        return expense
+
+    def analytics(self, **params):
+        response = self.client.get(f'/users/{self.user.id}/analytics', params)
+        self.assertEqual(response.status_code, 200, response.data)
+        return response.data
+
+    def test_percentiles_per_category(self):
+        for amount in (1000, 2000, 3000, 4000):
+            self.add(amount, categories=[self.food])
+        # 11.00 in the home currency
+        self.add(1000, categories=[self.taxi], currency='EUR')
+        data = self.analytics(percentiles='50,100')
+        self.assertEqual((data['count'], data['percentiles']), (5, [50.0, 100.0]))
+        self.assertEqual(data['overall'], ['20.00', '40.00'])
+        self.assertEqual(data['categories'], [
+            {'id': self.food.id, 'name': self.food.name, 'count': 4, 'values': ['25.00', '40.00']},
+            {'id': self.taxi.id, 'name': self.taxi.name, 'count': 1, 'values': ['11.00', '11.00']},
+        ])
+
+    def test_percentiles_match_numpy(self):
+        values = np.sort(np.random.default_rng(0).lognormal(7, 1, 101))
+        points = [0, 12.5, 50, 99, 100]
+        np.testing.assert_allclose(analytics.sorted_percentiles(values, points), np.percentile(values, points))
+
+    def test_daily_trend_with_moving_average(self):
+        for amount, day in ((1000, 7), (500, 9), (300, 10), (9999, 11)):
+            self.add(amount, date(2024, 1, day))
+        data = self.analytics(until='2024-01-10', days=3, window=2)
+        self.assertEqual(data['trend'], {'window': 2, 'days': [
+            {'date': '2024-01-08', 'total': '0.00', 'average': '5.00'},
+            {'date': '2024-01-09', 'total': '5.00', 'average': '2.50'},
+            {'date': '2024-01-10', 'total': '3.00', 'average': '4.00'},
+        ]})
+
+    def test_anomalies_stand_out_from_the_users_history(self):
+        for n in range(20):
+            self.add(1000 + 50 * n)
+        outlier = self.add(100000, date(2024, 1, 2))
+        anomalies = self.analytics()['anomalies']
+        self.assertEqual([(item['id'], item['date'], item['amount']) for item in anomalies], [
+            (outlier.id, '2024-01-02', '1000.00'),
+        ])
+        self.assertGreater(anomalies[0]['score'], analytics.ANOMALY_THRESHOLD)
+        bigger = self.add(200000)
+        analytics.clear()
+        self.assertEqual([item['id'] for item in self.analytics()['anomalies']], [bigger.id, outlier.id])
+        analytics.clear()
+        self.assertEqual([item['id'] for item in self.analytics(limit=1)['anomalies']], [bigger.id])
+
+    def test_a_user_without_expenses(self):
+        data = self.analytics()
+        self.assertEqual((data['count'], data['overall'], data['categories'], data['anomalies']), (0, None, [], []))
+        self.assertEqual(len(data['trend']['days']), analytics.DEFAULT_DAYS)
+
+    def test_loaded_columns_are_cached(self):
+        self.add(1000, categories=[self.food], currency='EUR')
+        # The user check, the expenses, their links and the rates of their currencies
+        with self.assertNumQueries(4):
+            self.analytics()
+        with self.assertNumQueries(1):
+            self.assertEqual(self.analytics()['count'], 1)
+
+    def test_writes_and_rate_changes_reload_the_columns(self):
+        self.add(1000, currency='EUR')
+        self.assertEqual(self.analytics()['overall'][0], '11.00')
+        response = self.client.post('/expenses', {
+            'user': self.user.id, 'name': 'E', 'amount': '20.00', 'description': '', 'date': '2024-01-02',
+        }, format='json')
+        self.assertEqual(response.status_code, 201, response.data)
+        self.assertEqual(self.analytics(percentiles='100')['overall'], ['20.00'])
+        self.client.delete(f"/expenses/{response.data['id']}")
+        self.assertEqual(self.analytics()['count'], 1)
+
+        rate = FxRate.objects.get(currency='EUR')
+        rate.rate = fx.scaled_rate('1.20', 'EUR')
+        rate.save()
+        self.assertEqual(self.analytics()['overall'][0], '12.00')
+        # Unchanged since, so served from memory
+        with self.assertNumQueries(1):
+            self.analytics()
+
+    def test_an_evicted_stamp_reloads_the_columns(self):
+        self.add(1000)
+        response = self.client.post('/expenses', {
+            'user': self.user.id, 'name': 'E', 'amount': '20.00', 'description': '', 'date': '2024-01-02',
+        }, format='json')
+        self.assertEqual(response.status_code, 201, response.data)
+        # The response cache shares the default cache, whose culling can evict the stamp the write published
+        cache.delete(analytics.version_key(self.user.id))
+        self.assertEqual(self.analytics()['count'], 2)
+        # A write by another process, whose stamp is evicted before this one reads it
+        cache.delete(analytics.version_key(self.user.id))
+        self.assertEqual(self.analytics()['count'], 2)
+        self.add(3000)
+        cache.delete(analytics.version_key(self.user.id))
+        self.assertEqual(self.analytics()['count'], 3)
+
+    def test_dates_are_parsed_as_date_toordinal_would(self):
+        days = [date(1, 1, 1), date(1969, 12, 31), date(2000, 2, 29), date(2024, 12, 31), date(9999, 12, 31)]
+        np.testing.assert_array_equal(
+            analytics.ordinals(np.array([day.isoformat() for day in days])), [day.toordinal() for day in days]
+        )
+
+    def test_invalid_options(self):
+        for params in ({'percentiles': 'median'}, {'percentiles': '101'}, {'days': 0}, {'window': 'x'},
+                       {'until': 'soon'}, {'limit': analytics.MAX_ANOMALIES + 1}):
+            response = self.client.get(f'/users/{self.user.id}/analytics', params)
+            self.assertEqual(response.status_code, 400, params)
+        self.assertEqual(self.client.get('/users/999/analytics').status_code, 404)
+        self.assertIn('message', self.client.get('/users/abc/analytics').data)
+
+    def test_bench_analytics(self):
+        out = io.StringIO()
+        call_command('bench_analytics', sizes='400,200', repeat=1, stdout=out)
+        lines = out.getvalue().splitlines()
+        # The header and one line per size, smallest first
+        self.assertEqual([line.split()[0] for line in lines[1:]], ['200', '400'])
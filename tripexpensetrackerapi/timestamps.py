@@ -0,0 +1,30 @@
+"""Bump `updated_at` on the rows a change affects.
+
+Saving a model sets its own `updated_at`, and signals.py bumps the parent
+trip (and, for category links, the parent expense). Queryset updates, bulk
+writes and set-based deletes fire no signals, so the code doing them calls
+these helpers directly. Touching a trip also invalidates its cached
+responses.
+"""
+from django.utils import timezone
+from tripexpensetrackerapi import response_cache
+from tripexpensetrackerapi.models import Trip, Expense
+
+
+def touch_trips(trip_ids, user_ids=None):
+    """Mark trips as changed. `user_ids` are their owners, when the caller already knows them."""
+    trip_ids = {trip_id for trip_id in trip_ids if trip_id is not None}
+    if trip_ids:
+        Trip.objects.filter(pk__in=trip_ids).update(updated_at=timezone.now())
+        response_cache.bump_trips(trip_ids, user_ids)
+
+
+def touch_expenses(expense_ids):
+    """Mark expenses, and the trips they belong to, as changed."""
+    expense_ids = set(expense_ids)
+    if expense_ids:
+        trips = dict(
+            Expense.objects.filter(pk__in=expense_ids, trip__isnull=False).values_list('trip_id', 'trip__user_id')
+        )
+        Expense.objects.filter(pk__in=expense_ids).update(updated_at=timezone.now())
+        touch_trips(trips.keys(), trips.values())
@@ -4,3 +4,4 @@ from .trip_view import TripView
 from .expense_view import ExpenseView
 from .expense_category_view import ExpenseCategoryView
 from .category_view import CategoryView
+from .metrics_view import metrics
@@ -0,0 +1,193 @@
+"""Native async versions of the read-heavy endpoints, used when serving over ASGI.
+
+ASGI requests are routed through `tripexpensetracker/asgi_urls.py` (see
+middleware.py), which maps these views over the same URLs as the ViewSets.
+GET requests run here on the event loop, using the async ORM so a slow
+database wait no longer holds a worker thread; every other method is handed
+to the ViewSet in a worker thread. Responses are rendered with the JSON
+renderer the sync views use (see settings.REST_FRAMEWORK), so bodies are
+byte-for-byte those of the sync views.
+"""
+from functools import wraps
+from asgiref.sync import sync_to_async
+from django.http import HttpResponse
+from rest_framework import status
+from rest_framework.parsers import FormParser, JSONParser, MultiPartParser
+from rest_framework.request import Request
+from tripexpensetrackerapi import response_cache
+from tripexpensetrackerapi.catalog import category_catalog
+from tripexpensetrackerapi.conditional import is_conditional, make_etag, not_modified, page_validators, set_validators
+from tripexpensetrackerapi.filters import InvalidFilter, expense_ordering, filter_expenses
+from tripexpensetrackerapi.fieldsets import EXPENSE, TRIP, InvalidFieldset, parse_fieldset
+from tripexpensetrackerapi.identity import afind_user_by_uid
+from tripexpensetrackerapi.metrics import TimedJSONRenderer
+from tripexpensetrackerapi.models import Trip, Expense
+from tripexpensetrackerapi.pagination import InvalidCursor, KeysetPagination
+from tripexpensetrackerapi.views.category_view import CategoryView
+from tripexpensetrackerapi.views.expense_view import ExpenseSerializer, ExpenseView, expense_queryset
+from tripexpensetrackerapi.views.trip_view import TripSerializer, TripView, trip_queryset
+
+renderer = TimedJSONRenderer()
+
+
+def json_response(data, status=status.HTTP_200_OK):
+    """Render `data` the way a DRF Response with the JSON renderer would."""
+    return HttpResponse(renderer.render(data), status=status, content_type=renderer.media_type)
+
+
+def error_response(ex):
+    return json_response({'message': f'An error occurred: {str(ex)}'}, status.HTTP_500_INTERNAL_SERVER_ERROR)
+
+
+def async_reads(sync_view):
+    """Serve GET and HEAD with the decorated coroutine, and other methods with `sync_view` in a worker thread."""
+    fallback = sync_to_async(sync_view)
+
+    def decorator(handler):
+        @wraps(handler)
+        async def view(request, *args, **kwargs):
+            if request.method in ('GET', 'HEAD'):
+                return await handler(Request(request), *args, **kwargs)
+            return await fallback(request, *args, **kwargs)
+
+        # Set directly: Django's csrf_exempt decorator would turn the view back into a sync function
+        view.csrf_exempt = True
+        return view
+    return decorator
+
+
+@async_reads(TripView.as_view({'get': 'retrieve', 'put': 'update', 'delete': 'destroy'}))
+async def trip_detail(request, pk):
+    """Async TripView.retrieve."""
+    try:
+        fieldset = parse_fieldset(request, TRIP)
+
+        if is_conditional(request):
+            updated_at = await Trip.objects.filter(pk=pk).values_list('updated_at', flat=True).afirst()
+            if updated_at is not None:
+                _, fingerprint = await category_catalog.snapshot()
+                etag = make_etag('trip', updated_at, fieldset.key, fingerprint=fingerprint)
+                response = not_modified(request, etag, updated_at)
+                if response is not None:
+                    return response
+
+        async def build():
+            trip = await trip_queryset(fieldset).aget(pk=pk)
+            names, fingerprint = await category_catalog.snapshot()
+            return {
+                'data': TripSerializer(trip, context={'category_names': names, 'fieldset': fieldset}).data,
+                'etag': make_etag('trip', trip.updated_at, fieldset.key, fingerprint=fingerprint),
+                'last_modified': trip.updated_at,
+            }
+
+        cached = await response_cache.aget_or_build(await response_cache.atrip_key(int(pk), fieldset.key), build)
+        return set_validators(json_response(cached['data']), cached['etag'], cached['last_modified'])
+    except InvalidFieldset as e:
+        return json_response({'message': str(e)}, status.HTTP_400_BAD_REQUEST)
+    except Trip.DoesNotExist:
+        return json_response({'message': 'Trip not found'}, status.HTTP_404_NOT_FOUND)
+    except Exception as e:
+        return error_response(e)
+
+
+@async_reads(TripView.as_view({'get': 'list', 'post': 'create'}))
+async def trip_list(request):
+    """Async TripView.list."""
+    try:
+        user_id = request.query_params.get('userId', None)
+        fieldset = parse_fieldset(request, TRIP)
+        paginator = KeysetPagination(ordering=('date', 'id'))
+        trips = trip_queryset(fieldset).filter(user__id=user_id)
+
+        if is_conditional(request):
+            versions = await paginator.apaginate_queryset(trips.values_list('id', 'updated_at'), request)
+            _, fingerprint = await category_catalog.snapshot()
+            response = not_modified(request, *page_validators(request, versions, paginator.has_next, fingerprint))
+            if response is not None:
+                return response
+
+        async def build():
+            page = await paginator.apaginate_queryset(trips, request)
+            names, fingerprint = await category_catalog.snapshot()
+            versions = [(trip.id, trip.updated_at) for trip in page]
+            etag, last_modified = page_validators(request, versions, paginator.has_next, fingerprint)
+            data = TripSerializer(page, many=True, context={'category_names': names, 'fieldset': fieldset}).data
+            return {'data': paginator.get_paginated_data(data), 'etag': etag, 'last_modified': last_modified}
+
+        cached = await response_cache.aget_or_build(
+            await response_cache.atrip_list_key(user_id, request.build_absolute_uri()), build
+        )
+        return set_validators(json_response(cached['data']), cached['etag'], cached['last_modified'])
+    except InvalidCursor:
+        return json_response({'message': 'Invalid cursor'}, status.HTTP_400_BAD_REQUEST)
+    except InvalidFieldset as e:
+        return json_response({'message': str(e)}, status.HTTP_400_BAD_REQUEST)
+    except Exception as e:
+        return error_response(e)
+
+
+@async_reads(ExpenseView.as_view({'get': 'list', 'post': 'create'}))
+async def expense_list(request):
+    """Async ExpenseView.list."""
+    try:
+        fieldset = parse_fieldset(request, EXPENSE)
+        paginator = KeysetPagination(ordering=expense_ordering(request.query_params))
+
+        if is_conditional(request):
+            versions = await paginator.apaginate_queryset(
+                filter_expenses(Expense.objects.values_list('id', 'updated_at'), request.query_params), request
+            )
+            _, fingerprint = await category_catalog.snapshot()
+            response = not_modified(request, *page_validators(request, versions, paginator.has_next, fingerprint))
+            if response is not None:
+                return response
+
+        expenses = filter_expenses(expense_queryset(fieldset), request.query_params)
+        expenses = await paginator.apaginate_queryset(expenses, request)
+        names, fingerprint = await category_catalog.snapshot()
+        serializer = ExpenseSerializer(expenses, many=True, context={'category_names': names, 'fieldset': fieldset})
+        versions = [(expense.id, expense.updated_at) for expense in expenses]
+        return set_validators(
+            json_response(paginator.get_paginated_data(serializer.data)),
+            *page_validators(request, versions, paginator.has_next, fingerprint),
+        )
+    except InvalidCursor:
+        return json_response({'message': 'Invalid cursor'}, status.HTTP_400_BAD_REQUEST)
+    except (InvalidFieldset, InvalidFilter) as e:
+        return json_response({'message': str(e)}, status.HTTP_400_BAD_REQUEST)
+    except Exception as e:
+        return error_response(e)
+
+
+@async_reads(CategoryView.as_view({'get': 'list', 'post': 'create'}))
+async def category_list(request):
+    """Async CategoryView.list."""
+    try:
+        names, fingerprint = await category_catalog.snapshot()
+        paginator = KeysetPagination()
+        categories = paginator.paginate_list([{'id': pk, 'name': name} for pk, name in names.items()], request)
+
+        etag = make_etag('categories', request.get_full_path(), fingerprint=fingerprint)
+        last_modified = fingerprint[1]
+        response = not_modified(request, etag, last_modified)
+        return set_validators(
+            response or json_response(paginator.get_paginated_data(categories)), etag, last_modified
+        )
+    except InvalidCursor:
+        return json_response({'message': 'Invalid cursor'}, status.HTTP_400_BAD_REQUEST)
+    except Exception as e:
+        return error_response(e)
+
+
+async def check_user(request):
+    """Async check_user."""
+    if request.method != 'POST':
+        return json_response({'detail': f'Method "{request.method}" not allowed.'}, status.HTTP_405_METHOD_NOT_ALLOWED)
+    request = Request(request, parsers=[JSONParser(), FormParser(), MultiPartParser()])
+    user = await afind_user_by_uid(request.data['uid'])
+    if user is not None:
+        return json_response({'id': user.id, 'name': user.name, 'uid': user.uid})
+    return json_response({'valid': False})
+
+
+check_user.csrf_exempt = True
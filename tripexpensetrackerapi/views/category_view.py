@@ -2,7 +2,11 @@ from django.http import HttpResponseServerError
 from rest_framework.viewsets import ViewSet
 from rest_framework.response import Response
 from rest_framework import serializers, status
+from tripexpensetrackerapi.catalog import category_catalog
+from tripexpensetrackerapi.conditional import make_etag, not_modified, set_validators
 from tripexpensetrackerapi.models import Category
+from tripexpensetrackerapi.pagination import InvalidCursor, KeysetPagination
+from tripexpensetrackerapi.metrics import TimedSerializerMixin
 
 class CategoryView(ViewSet):
     """Category view"""
@@ -10,20 +14,32 @@ class CategoryView(ViewSet):
     def retrieve(self, request, pk):
         """Handle GET requests for a single category."""
         try:
-            category = Category.objects.get(pk=pk)
-            serializer = CategorySerializer(category)
-            return Response(serializer.data)
+            name = category_catalog.name(pk)
+            if name is None:
+                raise Category.DoesNotExist
+
+            # Validators come from the catalog, so this costs no queries either way
+            etag = make_etag('category', int(pk), name)
+            last_modified = category_catalog.fingerprint()[1]
+            response = not_modified(request, etag, last_modified)
+            return set_validators(response or Response({'id': int(pk), 'name': name}), etag, last_modified)
         except Category.DoesNotExist:
             return Response({'message': 'Category not found'}, status=status.HTTP_404_NOT_FOUND)
         except Exception as e:
             return Response({'message': f'An error occurred: {str(e)}'}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
     def list(self, request):
-        """Handle GET requests to get all categories."""
+        """Handle GET requests to get a page of categories from the in-memory catalog."""
         try:
-            categories = Category.objects.all()
-            serializer = CategorySerializer(categories, many=True)
-            return Response(serializer.data)
+            paginator = KeysetPagination()
+            categories = paginator.paginate_list(category_catalog.rows(), request)
+
+            etag = make_etag('categories', request.get_full_path())
+            last_modified = category_catalog.fingerprint()[1]
+            response = not_modified(request, etag, last_modified)
+            return set_validators(response or paginator.get_paginated_response(categories), etag, last_modified)
+        except InvalidCursor:
+            return Response({'message': 'Invalid cursor'}, status=status.HTTP_400_BAD_REQUEST)
         except Exception as e:
             return Response({'message': f'An error occurred: {str(e)}'}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
@@ -61,7 +77,7 @@ class CategoryView(ViewSet):
         except Exception as e:
             return Response({'message': f'An error occurred: {str(e)}'}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
-class CategorySerializer(serializers.ModelSerializer):
+class CategorySerializer(TimedSerializerMixin, serializers.ModelSerializer):
     """JSON serializer for categories."""
     
     class Meta:
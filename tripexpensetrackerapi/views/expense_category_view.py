@@ -2,7 +2,12 @@ from django.http import HttpResponseServerError
 from rest_framework.viewsets import ViewSet
 from rest_framework.response import Response
 from rest_framework import serializers, status
+from tripexpensetrackerapi import fast_serializers, rollups
+from tripexpensetrackerapi.catalog import category_catalog
 from tripexpensetrackerapi.models import ExpenseCategory, Expense, Category
+from tripexpensetrackerapi.pagination import InvalidCursor, KeysetPagination
+from tripexpensetrackerapi.timestamps import touch_expenses
+from tripexpensetrackerapi.metrics import TimedSerializerMixin
 
 class ExpenseCategoryView(ViewSet):
     """ExpenseCategory view"""
@@ -10,7 +15,7 @@ class ExpenseCategoryView(ViewSet):
     def retrieve(self, request, pk):
         """Handle GET requests for a single expense category."""
         try:
-            expense_category = ExpenseCategory.objects.get(pk=pk)
+            expense_category = expense_category_queryset().get(pk=pk)
             serializer = ExpenseCategorySerializer(expense_category)
             return Response(serializer.data)
         except ExpenseCategory.DoesNotExist:
@@ -19,11 +24,18 @@ class ExpenseCategoryView(ViewSet):
             return Response({'message': f'An error occurred: {str(e)}'}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
     def list(self, request):
-        """Handle GET requests to get all expense categories."""
+        """Handle GET requests to get a page of expense categories."""
         try:
-            expense_categories = ExpenseCategory.objects.all()
-            serializer = ExpenseCategorySerializer(expense_categories, many=True)
-            return Response(serializer.data)
+            paginator = KeysetPagination()
+            if fast_serializers.enabled():
+                rows = fast_serializers.expense_category_values(ExpenseCategory.objects.all())
+                data = fast_serializers.expense_category_dicts(paginator.paginate_queryset(rows, request))
+            else:
+                expense_categories = paginator.paginate_queryset(expense_category_queryset(), request)
+                data = ExpenseCategorySerializer(expense_categories, many=True).data
+            return paginator.get_paginated_response(data)
+        except InvalidCursor:
+            return Response({'message': 'Invalid cursor'}, status=status.HTTP_400_BAD_REQUEST)
         except Exception as e:
             return Response({'message': f'An error occurred: {str(e)}'}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
@@ -31,14 +43,17 @@ class ExpenseCategoryView(ViewSet):
         """Handle POST operations, create a new expense category."""
         try:
             expense = Expense.objects.get(pk=request.data["expense"])
-            category = Category.objects.get(pk=request.data["category"])
+            if category_catalog.missing([request.data["category"]]):
+                raise Category.DoesNotExist
 
-            expense_category = ExpenseCategory.objects.create(
-                expense=expense,
-                category=category,
-            )
+            # Returns the existing link if the expense already has this category
+            with rollups.tracking(Expense.objects.filter(pk=expense.pk)):
+                expense_category, created = ExpenseCategory.objects.get_or_create(
+                    expense=expense,
+                    category_id=request.data["category"],
+                )
             serializer = ExpenseCategorySerializer(expense_category)
-            return Response(serializer.data, status=status.HTTP_201_CREATED)
+            return Response(serializer.data, status=status.HTTP_201_CREATED if created else status.HTTP_200_OK)
         except Expense.DoesNotExist:
             return Response({'message': 'Expense not found'}, status=status.HTTP_404_NOT_FOUND)
         except Category.DoesNotExist:
@@ -54,7 +69,9 @@ class ExpenseCategoryView(ViewSet):
         """Handle DELETE requests to delete an expense category."""
         try:
             expense_category = ExpenseCategory.objects.get(pk=pk)
-            expense_category.delete()
+            with rollups.tracking(Expense.objects.filter(pk=expense_category.expense_id)):
+                expense_category.delete()
+            touch_expenses([expense_category.expense_id])
             return Response(None, status=status.HTTP_204_NO_CONTENT)
         except ExpenseCategory.DoesNotExist:
             return Response({'message': 'Expense category not found'}, status=status.HTTP_404_NOT_FOUND)
@@ -62,16 +79,28 @@ class ExpenseCategoryView(ViewSet):
             return Response({'message': f'An error occurred: {str(e)}'}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
 
-class ExpenseCategorySerializer(serializers.ModelSerializer):
+def expense_category_queryset():
+    """Expense categories with the expense that ExpenseCategorySerializer reads."""
+    return ExpenseCategory.objects.select_related('expense')
+
+
+class ExpenseCategorySerializer(TimedSerializerMixin, serializers.ModelSerializer):
     """JSON serializer for expense categories."""
     
     # Includes the 'name' field from the related Expense model
     expense_name = serializers.CharField(source='expense.name', read_only=True)
 
-    # Includes the 'name' field from the related Category model
-    category_name = serializers.CharField(source='category.name', read_only=True)
+    # Includes the 'name' field of the related Category, from the in-memory catalog
+    category_name = serializers.SerializerMethodField()
 
     class Meta:
         model = ExpenseCategory
         fields = ('id', 'expense_name', 'category_name')
         depth = 1
+
+    def get_category_name(self, obj):
+        # Async views pass the names from their catalog snapshot in the context
+        names = self.context.get('category_names')
+        if names is not None:
+            return names.get(obj.category_id)
+        return category_catalog.name(obj.category_id)
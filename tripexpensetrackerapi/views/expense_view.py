@@ -1,10 +1,24 @@
-from django.http import HttpResponseServerError
+from django.db import transaction
+from django.db.models import Prefetch
+from django.http import HttpResponseServerError, StreamingHttpResponse
 from rest_framework.viewsets import ViewSet
 from rest_framework.response import Response
 from rest_framework import serializers, status
 from rest_framework.decorators import action
+from tripexpensetrackerapi import fast_serializers, fx, money, rollups, search, suggestions
 from tripexpensetrackerapi.models import Trip, Expense, User, Category, ExpenseCategory
+from tripexpensetrackerapi.catalog import category_catalog
+from tripexpensetrackerapi.bulk import create_expenses, delete_expenses, sync_category_links, update_expenses
+from tripexpensetrackerapi.deletes import delete_expense_rows
+from tripexpensetrackerapi.conditional import is_conditional, make_etag, not_modified, page_validators, set_validators
+from tripexpensetrackerapi.filters import InvalidFilter, expense_ordering, filter_expenses
+from tripexpensetrackerapi.fieldsets import EXPENSE, Fieldset, InvalidFieldset, SparseFieldsMixin, parse_fieldset
+from tripexpensetrackerapi.export import IgnoreClientContentNegotiation, csv_stream, export_chunks, ndjson_stream
+from tripexpensetrackerapi.identity import get_user
+from tripexpensetrackerapi.pagination import InvalidCursor, KeysetPagination
+from tripexpensetrackerapi.timestamps import touch_expenses, touch_trips
 from tripexpensetrackerapi.views.expense_category_view import ExpenseCategorySerializer
+from tripexpensetrackerapi.metrics import TimedSerializerMixin
 
 class ExpenseView(ViewSet):
     """Expense view"""
@@ -12,57 +26,102 @@ class ExpenseView(ViewSet):
     def retrieve(self, request, pk):
         """Handle GET requests for a single expense."""
         try:
-            expense = Expense.objects.get(pk=pk)
-            serializer = ExpenseSerializer(expense)
-            return Response(serializer.data)
+            fieldset = parse_fieldset(request, EXPENSE)
+
+            # Answers 304 from the expense's updated_at alone when the client's copy is current
+            if is_conditional(request):
+                updated_at = Expense.objects.filter(pk=pk).values_list('updated_at', flat=True).first()
+                if updated_at is not None:
+                    response = not_modified(request, make_etag('expense', updated_at, fieldset.key), updated_at)
+                    if response is not None:
+                        return response
+
+            expense = expense_queryset(fieldset).get(pk=pk)
+            serializer = ExpenseSerializer(expense, context={'fieldset': fieldset})
+            return set_validators(
+                Response(serializer.data), make_etag('expense', expense.updated_at, fieldset.key), expense.updated_at
+            )
+        except InvalidFieldset as e:
+            return Response({'message': str(e)}, status=status.HTTP_400_BAD_REQUEST)
         except Expense.DoesNotExist:
             return Response({'message': 'Expense not found'}, status=status.HTTP_404_NOT_FOUND)
         except Exception as e:
             return Response({'message': f'An error occurred: {str(e)}'}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
     def list(self, request):
-        """Handle GET requests to get all expenses."""
+        """Handle GET requests to get a page of expenses, oldest first unless another ordering is asked for.
+
+        Filters and orderings are described in filters.py.
+        """
         try:
-            expenses = Expense.objects.all()
-            serializer = ExpenseSerializer(expenses, many=True)
-            return Response(serializer.data)
+            fieldset = parse_fieldset(request, EXPENSE)
+            paginator = KeysetPagination(ordering=expense_ordering(request.query_params))
+            # Filters expenses by user, trip, dates, categories and amounts
+            expenses = filter_expenses(Expense.objects.all(), request.query_params)
+
+            # Answers 304 from the page's ids and updated_at values when the client's copy is current
+            if is_conditional(request):
+                versions = paginator.paginate_queryset(expenses.values_list('id', 'updated_at'), request)
+                response = not_modified(request, *page_validators(request, versions, paginator.has_next))
+                if response is not None:
+                    return response
+
+            if fast_serializers.enabled():
+                page = paginator.paginate_queryset(fast_serializers.expense_values(expenses, fieldset), request)
+                versions = [(expense['id'], expense['updated_at']) for expense in page]
+                data = fast_serializers.expense_dicts(page, fieldset)
+            else:
+                expenses = filter_expenses(expense_queryset(fieldset), request.query_params)
+                page = paginator.paginate_queryset(expenses, request)
+                versions = [(expense.id, expense.updated_at) for expense in page]
+                data = ExpenseSerializer(page, many=True, context={'fieldset': fieldset}).data
+            return set_validators(
+                paginator.get_paginated_response(data),
+                *page_validators(request, versions, paginator.has_next),
+            )
+        except InvalidCursor:
+            return Response({'message': 'Invalid cursor'}, status=status.HTTP_400_BAD_REQUEST)
+        except (InvalidFieldset, InvalidFilter) as e:
+            return Response({'message': str(e)}, status=status.HTTP_400_BAD_REQUEST)
         except Exception as e:
             return Response({'message': f'An error occurred: {str(e)}'}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
     def create(self, request):
         """Handle POST operations, create a new expense."""
         try:
-            user = User.objects.get(pk=request.data["user"])
+            user = get_user(request.data["user"])
             trip_id = request.data.get("trip")
             trip = Trip.objects.get(pk=trip_id) if trip_id else None
-
-            expense = Expense.objects.create(
-                user=user,
-                name=request.data["name"],
-                amount=request.data["amount"],
-                description=request.data["description"],
-                date=request.data["date"],
-                trip=trip
-            )
+            # Expenses are in the home currency unless another one with an exchange rate is given
+            currency = money.parse_currency(request.data.get("currency"))
+            fx.check(currency, request.data["date"])
 
             # Checks if categories are provided in the request
-            category_ids = request.data.get("categories")
-            categories = []
-
-            if category_ids:
-                # Creates ExpenseCategory instances for the provided category IDs
-                for category_id in category_ids:
-                    category = Category.objects.get(pk=category_id)
-                    expense_category = ExpenseCategory.objects.create(
-                        category=category,
-                        expense=expense,
-                    )
-                    categories.append(expense_category)
-
-            # Assigns ExpenseCategory instances to the expense if provided
-            expense.categories.set(categories)
-
-            serializer = ExpenseSerializer(expense)
+            category_ids = request.data.get("categories") or []
+            # Validates the category IDs against the catalog
+            if category_ids and category_catalog.missing(category_ids):
+                raise Category.DoesNotExist
+            category_ids = list(dict.fromkeys(int(category_id) for category_id in category_ids))
+
+            with transaction.atomic():
+                expense = Expense.objects.create(
+                    user=user,
+                    name=request.data["name"],
+                    currency=currency,
+                    amount=request.data["amount"],
+                    description=request.data["description"],
+                    date=request.data["date"],
+                    trip=trip
+                )
+                # Links all the categories in one insert
+                ExpenseCategory.objects.bulk_create(
+                    ExpenseCategory(category_id=category_id, expense=expense) for category_id in category_ids
+                )
+                rollups.add(Expense.objects.filter(pk=expense.pk))
+            suggestions.expense_changed(None, (user.id, expense.name, category_ids))
+
+            # Reloads the expense with its relations so serializing it costs a fixed number of queries
+            serializer = ExpenseSerializer(expense_queryset().get(pk=expense.pk))
             return Response(serializer.data, status=status.HTTP_201_CREATED)
         except User.DoesNotExist:
             return Response({'message': 'User not found'}, status=status.HTTP_404_NOT_FOUND)
@@ -70,6 +129,8 @@ class ExpenseView(ViewSet):
             return Response({'message': 'Trip not found'}, status=status.HTTP_404_NOT_FOUND)
         except Category.DoesNotExist:
             return Response({'message': 'Category not found'}, status=status.HTTP_404_NOT_FOUND)
+        except money.InvalidAmount as e:
+            return Response({'message': str(e)}, status=status.HTTP_400_BAD_REQUEST)
         except Exception as e:
             return Response({'message': f'An error occurred: {str(e)}'}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
@@ -77,26 +138,40 @@ class ExpenseView(ViewSet):
         """Handle PUT requests to update an expense."""
         try:
             expense = Expense.objects.get(pk=pk)
-            user = User.objects.get(pk=request.data["user"])
+            user = get_user(request.data["user"])
+            # Unknown category IDs are ignored
             category_ids = request.data.get("categories", [])
-            categories = Category.objects.filter(pk__in=category_ids)
+            missing = category_catalog.missing(category_ids)
+            categories = [int(category_id) for category_id in category_ids if int(category_id) not in missing]
+            # The links are only read, before they change, when a loaded suggestion index needs them
+            old_categories = None
+            if suggestions.loaded(expense.user_id) or suggestions.loaded(user.id):
+                old_categories = list(
+                    ExpenseCategory.objects.filter(expense=expense).values_list('category_id', flat=True)
+                )
+            old = (expense.user_id, expense.name, old_categories)
 
             expense.user = user
             expense.name = request.data["name"]
+            # Keeps the expense's currency unless another one is given; the amount is read in it
+            if request.data.get("currency"):
+                expense.currency = money.parse_currency(request.data["currency"])
             expense.amount = request.data["amount"]
             expense.description = request.data["description"]
             expense.date = request.data["date"]
+            fx.check(expense.currency, expense.date)
 
-            # Updates expense details
-            expense.save()
-            
-            # Clears existing categories through ExpenseCategory only if new categories are provided
-            if categories:
-                ExpenseCategory.objects.filter(expense=expense).delete()
+            # Counts the change in the user's monthly rollups in the same transaction
+            with rollups.tracking(Expense.objects.filter(pk=expense.pk)):
+                # Updates expense details
+                expense.save()
 
-            # Adds new categories
-            for category in categories:
-                ExpenseCategory.objects.create(expense=expense, category=category)
+                # Replaces the expense's categories only if new categories are provided,
+                # writing just the links that were added or removed
+                if categories:
+                    sync_category_links({expense.id: categories})
+                if old_categories is not None:
+                    suggestions.expense_changed(old, (user.id, expense.name, categories or old_categories))
 
             return Response(None, status=status.HTTP_204_NO_CONTENT)
         except Expense.DoesNotExist:
@@ -105,22 +180,19 @@ class ExpenseView(ViewSet):
             return Response({'message': 'User not found'}, status=status.HTTP_404_NOT_FOUND)
         except Category.DoesNotExist:
             return Response({'message': 'Category not found'}, status=status.HTTP_404_NOT_FOUND)
+        except money.InvalidAmount as e:
+            return Response({'message': str(e)}, status=status.HTTP_400_BAD_REQUEST)
         except Exception as e:
             return Response({'message': f'An error occurred: {str(e)}'}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
       
     def destroy(self, request, pk):
         try:
-            expense = Expense.objects.get(pk=pk)
+            with transaction.atomic():
+                trip_id = Expense.objects.filter(pk=pk).values_list('trip_id', flat=True).get()
 
-            # Fetch all associated ExpenseCategory instances
-            expense_categories = ExpenseCategory.objects.filter(expense=expense)
-
-            # Delete each ExpenseCategory
-            for expense_category in expense_categories:
-                expense_category.delete()
-
-            # Now delete the expense
-            expense.delete()
+                # Deletes the expense's category links and then the expense, one statement each
+                delete_expense_rows(Expense.objects.filter(pk=pk))
+                touch_trips([trip_id])
 
             return Response(None, status=status.HTTP_204_NO_CONTENT)
         except Expense.DoesNotExist:
@@ -134,12 +206,18 @@ class ExpenseView(ViewSet):
     def add_expense_category(self, request, pk):
         """Post request for a user to add a category to an expense"""
         try:
-            category = Category.objects.get(pk=request.data["category"])
+            if category_catalog.missing([request.data["category"]]):
+                raise Category.DoesNotExist
             expense = Expense.objects.get(pk=pk)
-            expense_category = ExpenseCategory.objects.create(
-                category=category,
-                expense=expense,
-            )
+
+            # Adding a category the expense already has changes nothing
+            with rollups.tracking(Expense.objects.filter(pk=expense.pk)):
+                expense_category, created = ExpenseCategory.objects.get_or_create(
+                    category_id=request.data["category"],
+                    expense=expense,
+                )
+            if not created:
+                return Response({'message': 'Expense already has this category'}, status=status.HTTP_200_OK)
             return Response({'message': 'Category added to expense'}, status=status.HTTP_201_CREATED)
         except Expense.DoesNotExist:
             return Response({'error': 'Expense not found.'}, status=status.HTTP_404_NOT_FOUND)
@@ -153,7 +231,9 @@ class ExpenseView(ViewSet):
         """Delete request for a user to remove a category from an expense"""
         try:
             expense_category = ExpenseCategory.objects.get(pk=expense_category, expense__pk=pk)
-            expense_category.delete()
+            with rollups.tracking(Expense.objects.filter(pk=pk)):
+                expense_category.delete()
+            touch_expenses([expense_category.expense_id])
 
             return Response({"message": "Expense category removed"}, status=status.HTTP_204_NO_CONTENT)
         except ExpenseCategory.DoesNotExist:
@@ -161,12 +241,171 @@ class ExpenseView(ViewSet):
         except Exception as e:
             return Response({'error': f'An error occurred: {str(e)}'}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
+    # BULK create/update/delete
+
+    @action(methods=['post', 'put', 'delete'], detail=False)
+    def bulk(self, request):
+        """Create (POST), update (PUT) or delete (DELETE) many expenses in one transaction.
+
+        POST and PUT take a list of expenses shaped like the single create and
+        update payloads (PUT items also carry an `id`); DELETE takes a list of
+        expense ids. If any item is invalid nothing is written, and the
+        response lists the errors for each failing item by its index.
+        """
+        try:
+            if request.method == 'POST':
+                ids, errors = create_expenses(request.data)
+                if errors:
+                    return Response({'errors': errors}, status=status.HTTP_400_BAD_REQUEST)
+                expenses = {expense.id: expense for expense in expense_queryset().filter(pk__in=ids)}
+                serializer = ExpenseSerializer([expenses[expense_id] for expense_id in ids], many=True)
+                return Response(serializer.data, status=status.HTTP_201_CREATED)
+
+            if request.method == 'PUT':
+                errors = update_expenses(request.data)
+            else:
+                errors = delete_expenses(request.data)
+            if errors:
+                return Response({'errors': errors}, status=status.HTTP_400_BAD_REQUEST)
+            return Response(None, status=status.HTTP_204_NO_CONTENT)
+        except Exception as e:
+            return Response({'message': f'An error occurred: {str(e)}'}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+
+    # EXPORT
 
-class ExpenseSerializer(serializers.ModelSerializer):
+    @action(methods=['get'], detail=False, content_negotiation_class=IgnoreClientContentNegotiation)
+    def export(self, request):
+        """Stream every expense for a user and/or trip as NDJSON (default) or CSV.
+
+        Query params: userId, tripId, output=ndjson|csv
+        """
+        user_id = request.query_params.get('userId')
+        trip_id = request.query_params.get('tripId')
+        output = request.query_params.get('output', 'ndjson')
+
+        if not user_id and not trip_id:
+            return Response({'message': 'userId or tripId is required'}, status=status.HTTP_400_BAD_REQUEST)
+        if output not in ('ndjson', 'csv'):
+            return Response({'message': 'output must be ndjson or csv'}, status=status.HTTP_400_BAD_REQUEST)
+
+        expenses = Expense.objects.all()
+        if user_id:
+            expenses = expenses.filter(user_id=user_id)
+        if trip_id:
+            expenses = expenses.filter(trip_id=trip_id)
+
+        # Rows are read and written lazily while the response is being sent
+        chunks = export_chunks(expenses)
+        if output == 'csv':
+            response = StreamingHttpResponse(csv_stream(chunks), content_type='text/csv')
+            response['Content-Disposition'] = 'attachment; filename="expenses.csv"'
+        else:
+            response = StreamingHttpResponse(ndjson_stream(chunks), content_type='application/x-ndjson')
+        return response
+
+    # SUGGESTIONS
+
+    @action(methods=['get'], detail=False)
+    def suggest(self, request):
+        """Handle GET requests for typeahead suggestions: a user's most used expense names starting with `q`.
+
+        Query params: userId, q, limit. Each suggestion lists the categories
+        most often used with the name.
+        """
+        try:
+            user_id = int(request.query_params['userId'])
+            limit = int(request.query_params.get('limit', suggestions.DEFAULT_LIMIT))
+            if not 1 <= limit <= suggestions.MAX_LIMIT:
+                raise ValueError
+        except (KeyError, ValueError):
+            return Response(
+                {'message': f'userId is required and limit must be 1 to {suggestions.MAX_LIMIT}'},
+                status=status.HTTP_400_BAD_REQUEST,
+            )
+        try:
+            return Response({'results': suggestions.suggest(user_id, request.query_params.get('q', ''), limit)})
+        except Exception as e:
+            return Response({'message': f'An error occurred: {str(e)}'}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+
+    # SEARCH
+
+    @action(methods=['get'], detail=False)
+    def search(self, request):
+        """Handle GET requests to search a user's expense names and descriptions, best matches first.
+
+        Query params: userId, q (see search.parse_query), page_size, cursor,
+        and the fields/include of the expense list
+        """
+        try:
+            user_id = request.query_params.get('userId')
+            if not user_id or not user_id.isdigit():
+                return Response({'message': 'userId is required'}, status=status.HTTP_400_BAD_REQUEST)
+            query = search.parse_query(request.query_params.get('q'))
+            fieldset = parse_fieldset(request, EXPENSE)
+
+            def fetch(cursor, limit):
+                after = None if cursor is None else (float(cursor[0]), int(cursor[1]))
+                return search.search(int(user_id), query, limit, after)
+
+            paginator = KeysetPagination(ordering=('rank', 'id'))
+            ids = [row['id'] for row in paginator.paginate_rows(fetch, request)]
+            # Loads the page's expenses in one query and puts them back in rank order
+            if fast_serializers.enabled():
+                rows = fast_serializers.expense_values(Expense.objects.filter(pk__in=ids), fieldset)
+                rows = {row['id']: row for row in rows}
+                # An expense deleted since the search is left out
+                page = [rows[expense_id] for expense_id in ids if expense_id in rows]
+                data = fast_serializers.expense_dicts(page, fieldset)
+            else:
+                expenses = expense_queryset(fieldset).in_bulk(ids)
+                data = ExpenseSerializer(
+                    [expenses[expense_id] for expense_id in ids if expense_id in expenses], many=True,
+                    context={'fieldset': fieldset},
+                ).data
+            return paginator.get_paginated_response(data)
+        except InvalidCursor:
+            return Response({'message': 'Invalid cursor'}, status=status.HTTP_400_BAD_REQUEST)
+        except (InvalidFieldset, search.InvalidSearch) as e:
+            return Response({'message': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+        except Exception as e:
+            return Response({'message': f'An error occurred: {str(e)}'}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+
+
+def expense_queryset(fieldset=None):
+    """Expenses with the columns and relations that ExpenseSerializer reads for `fieldset`.
+
+    The categories prefetch also fills in each link's `expense`, and category
+    names come from the catalog, so the links need no joins. Links are in id
+    order, as the fast serializers list them. Relations the fieldset leaves
+    out are not loaded at all.
+    """
+    keys = (fieldset or Fieldset(EXPENSE)).keys(EXPENSE)
+    # Pagination, validators and the trips prefetch always need these
+    columns = {'id', 'date', 'updated_at', 'trip'}
+    columns.update(name for name in ('name', 'currency', 'description') if name in keys)
+    if 'amount' in keys:
+        columns.update(('amount_minor', 'currency'))
+    expenses = Expense.objects.all()
+    if 'user' in keys:
+        columns.add('user')
+        expenses = expenses.select_related('user')
+    if 'categories' in keys:
+        # Category links render their expense's name
+        columns.add('name')
+        expenses = expenses.prefetch_related(Prefetch('categories', queryset=ExpenseCategory.objects.order_by('id')))
+    return expenses.only(*columns)
+
+
+class ExpenseSerializer(SparseFieldsMixin, TimedSerializerMixin, serializers.ModelSerializer):
     """JSON serializer for expenses."""
+    spec = EXPENSE
+    amount = serializers.SerializerMethodField()
     categories = ExpenseCategorySerializer(many=True, read_only=True, required=False)
     
     class Meta:
         model = Expense
-        fields = ('id', 'name', 'user', 'amount', 'description', 'date', 'categories')
+        fields = ('id', 'name', 'user', 'amount', 'currency', 'description', 'date', 'categories')
         depth = 1
+
+    def get_amount(self, expense):
+        return money.format_amount(expense.amount_minor, expense.currency)
@@ -0,0 +1,15 @@
+from django.conf import settings
+from django.http import HttpResponse, HttpResponseForbidden
+from django.views.decorators.http import require_GET
+from tripexpensetrackerapi.metrics import render_prometheus
+
+
+@require_GET
+def metrics(request):
+    """Handle GET requests for this process's request metrics in the Prometheus text format.
+
+    Only clients at the addresses in settings.METRICS_ALLOWED_IPS may read them.
+    """
+    if request.META.get('REMOTE_ADDR') not in getattr(settings, 'METRICS_ALLOWED_IPS', ('127.0.0.1', '::1')):
+        return HttpResponseForbidden()
+    return HttpResponse(render_prometheus(), content_type='text/plain; version=0.0.4; charset=utf-8')
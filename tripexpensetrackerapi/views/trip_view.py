@@ -1,11 +1,22 @@
+from django.db.models import BigIntegerField, Count, Max, Min, OuterRef, Prefetch, Subquery, Sum, Value
+from django.db.models.functions import Coalesce
 from django.http import HttpResponseServerError
 from rest_framework.viewsets import ViewSet
 from rest_framework.response import Response
 from rest_framework import serializers, status
 from rest_framework.decorators import action
-from tripexpensetrackerapi.models import Trip, Expense, User
-from tripexpensetrackerapi.views.expense_view import ExpenseSerializer
+from tripexpensetrackerapi import fast_serializers, fx, response_cache, rollups
+from tripexpensetrackerapi.models import Trip, Expense, ExpenseCategory, User
+from tripexpensetrackerapi.catalog import category_catalog
+from tripexpensetrackerapi.deletes import delete_trip, purge_trip, run_in_background
+from tripexpensetrackerapi.conditional import is_conditional, make_etag, not_modified, page_validators, set_validators
+from tripexpensetrackerapi.money import home_currency
+from tripexpensetrackerapi.fieldsets import TRIP, Fieldset, InvalidFieldset, SparseFieldsMixin, parse_fieldset
+from tripexpensetrackerapi.identity import get_user
+from tripexpensetrackerapi.pagination import InvalidCursor, KeysetPagination
+from tripexpensetrackerapi.views.expense_view import ExpenseSerializer, expense_queryset
 from tripexpensetrackerapi.views.user_view import UserSerializer
+from tripexpensetrackerapi.metrics import TimedSerializerMixin
 
 class TripView(ViewSet):
     """Trip view"""
@@ -13,32 +24,82 @@ class TripView(ViewSet):
     def retrieve(self, request, pk):
         """Handle GET requests for a single trip."""
         try:
-            trip = Trip.objects.get(pk=pk)
-            serializer = TripSerializer(trip)
-            return Response(serializer.data)
+            fieldset = parse_fieldset(request, TRIP)
+
+            # Answers 304 from the trip's updated_at alone when the client's copy is current
+            if is_conditional(request):
+                updated_at = Trip.objects.filter(pk=pk).values_list('updated_at', flat=True).first()
+                if updated_at is not None:
+                    response = not_modified(request, make_etag('trip', updated_at, fieldset.key), updated_at)
+                    if response is not None:
+                        return response
+
+            def build():
+                trip = trip_queryset(fieldset).get(pk=pk)
+                etag = make_etag('trip', trip.updated_at, fieldset.key)
+                data = TripSerializer(trip, context={'fieldset': fieldset}).data
+                return {'data': data, 'etag': etag, 'last_modified': trip.updated_at}
+
+            # Serves the serialized trip from the response cache while the trip is unchanged
+            cached = response_cache.get_or_build(response_cache.trip_key(int(pk), fieldset.key), build)
+            return set_validators(Response(cached['data']), cached['etag'], cached['last_modified'])
+        except InvalidFieldset as e:
+            return Response({'message': str(e)}, status=status.HTTP_400_BAD_REQUEST)
         except Trip.DoesNotExist:
             return Response({'message': 'Trip not found'}, status=status.HTTP_404_NOT_FOUND)
         except Exception as e:
             return Response({'message': f'An error occurred: {str(e)}'}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
     
     def list(self, request):
-        """Handle GET requests to get all trips for a specific user."""
+        """Handle GET requests to get a page of trips for a specific user."""
         try:
             # Gets user ID from the request
             user_id = request.query_params.get('userId', None)
+            fieldset = parse_fieldset(request, TRIP)
 
             # Filters trips based on the user's ID
-            trips = Trip.objects.filter(user__id=user_id)
+            paginator = KeysetPagination(ordering=('date', 'id'))
+            trips = trip_queryset(fieldset).filter(user__id=user_id)
+
+            # Answers 304 from the page's ids and updated_at values when the client's copy is current
+            if is_conditional(request):
+                versions = paginator.paginate_queryset(trips.values_list('id', 'updated_at'), request)
+                response = not_modified(request, *page_validators(request, versions, paginator.has_next))
+                if response is not None:
+                    return response
+
+            def build():
+                if fast_serializers.enabled():
+                    page = paginator.paginate_queryset(fast_serializers.trip_values(trips, fieldset), request)
+                    versions = [(trip['id'], trip['updated_at']) for trip in page]
+                    data = fast_serializers.trip_dicts(page, fieldset)
+                else:
+                    page = paginator.paginate_queryset(trips, request)
+                    versions = [(trip.id, trip.updated_at) for trip in page]
+                    data = TripSerializer(page, many=True, context={'fieldset': fieldset}).data
+                etag, last_modified = page_validators(request, versions, paginator.has_next)
+                return {
+                    'data': paginator.get_paginated_data(data),
+                    'etag': etag,
+                    'last_modified': last_modified,
+                }
 
-            serializer = TripSerializer(trips, many=True)
-            return Response(serializer.data)
+            # Serves the serialized page from the response cache while none of the user's trips change
+            cached = response_cache.get_or_build(
+                response_cache.trip_list_key(user_id, request.build_absolute_uri()), build
+            )
+            return set_validators(Response(cached['data']), cached['etag'], cached['last_modified'])
+        except InvalidCursor:
+            return Response({'message': 'Invalid cursor'}, status=status.HTTP_400_BAD_REQUEST)
+        except InvalidFieldset as e:
+            return Response({'message': str(e)}, status=status.HTTP_400_BAD_REQUEST)
         except Exception as e:
             return Response({'message': f'An error occurred: {str(e)}'}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
     def create(self, request):
         """Handle POST operations, create a new trip."""
         try:
-            user = User.objects.get(pk=request.data["userId"])
+            user = get_user(request.data["userId"])
             trip = Trip.objects.create(
                 user=user,
                 name=request.data["name"],
@@ -67,19 +128,21 @@ class TripView(ViewSet):
             return Response({'message': f'An error occurred: {str(e)}'}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
         
     def destroy(self, request, pk):
-        """Handle DELETE requests to delete a trip"""
+        """Handle DELETE requests to delete a trip.
+
+        With `?background=true` the expenses are deleted in short chunked
+        transactions after the response (202), for trips too large to delete
+        while holding the write lock.
+        """
         try:
             trip = Trip.objects.get(pk=pk)
 
-            # Fetches all associated expenses for the trip
-            expenses = Expense.objects.filter(trip=trip)
+            if request.query_params.get('background') == 'true':
+                run_in_background(purge_trip, trip.id)
+                return Response({'message': 'Trip deletion started'}, status=status.HTTP_202_ACCEPTED)
 
-            # Deletes each expense (this will trigger the ExpenseCategoryView logic cascade)
-            for expense in expenses:
-                expense.delete()
-
-            # Now deletes the trip
-            trip.delete()
+            # Deletes the trip's category links, expenses and the trip itself in a few set-based statements
+            delete_trip(trip)
 
             return Response(None, status=status.HTTP_204_NO_CONTENT)
         except Trip.DoesNotExist:
@@ -87,6 +150,65 @@ class TripView(ViewSet):
         except Exception as e:
             return Response({'message': f'An error occurred: {str(e)}'}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
         
+    @action(methods=['get'], detail=True)
+    def summary(self, request, pk):
+        """Handle GET requests for a trip's spending totals, in the home currency.
+
+        Everything is aggregated in the database in three queries, without
+        loading any expenses; amounts are converted with integer arithmetic
+        (see fx.py). An expense with several categories counts towards each
+        of them, so category totals can add up to more than the trip total.
+        """
+        try:
+            if not Trip.objects.filter(pk=pk).exists():
+                return Response({'message': 'Trip not found'}, status=status.HTTP_404_NOT_FOUND)
+
+            categories = (
+                ExpenseCategory.objects.filter(expense__trip_id=pk)
+                .values('category_id')
+                .annotate(total=Sum(fx.home_value('expense__')), count=Count('id'))
+                .order_by('category_id')
+            )
+            names = category_catalog.names()
+            # The trip's totals are summed up from its days
+            days = list(
+                Expense.objects.filter(trip_id=pk)
+                .values('date')
+                .annotate(total=Sum(fx.home_value()), count=Count('id'), min=Min(fx.home_value()),
+                          max=Max(fx.home_value()))
+                .order_by('date')
+            )
+            total = sum(row['total'] for row in days)
+            count = sum(row['count'] for row in days)
+
+            return Response({
+                'id': int(pk),
+                'currency': home_currency(),
+                'total': fx.format_home(total),
+                'count': count,
+                'min': fx.format_home(min((row['min'] for row in days), default=None)),
+                'max': fx.format_home(max((row['max'] for row in days), default=None)),
+                'avg': fx.format_home(total // count) if count else None,
+                'categories': sorted(
+                    (
+                        {
+                            'id': row['category_id'],
+                            'name': names.get(row['category_id']),
+                            'total': fx.format_home(row['total']),
+                            'count': row['count'],
+                        }
+                        for row in categories
+                    ),
+                    key=lambda category: (category['name'] or '', category['id']),
+                ),
+                'days': [
+                    {'date': row['date'], 'total': fx.format_home(row['total']), 'count': row['count']}
+                    for row in days
+                ],
+            })
+        except Exception as e:
+            return Response({'message': f'An error occurred: {str(e)}'}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+
     # ADD/REMOVE trip expenses
     
     @action(methods=['post'], detail=True)
@@ -98,10 +220,11 @@ class TripView(ViewSet):
 
             # Updates the user of the expense to be the user associated with the trip
             expense.user = trip.user
-            expense.save()
 
-            # Adds expense to the trip
-            trip.expenses.add(expense)
+            # Adds expense to the trip (saving it bumps both its old and new trip); a new owner takes its rollups
+            expense.trip = trip
+            with rollups.tracking(Expense.objects.filter(pk=expense.pk)):
+                expense.save()
             return Response({'message': 'Expense added to trip'}, status=status.HTTP_201_CREATED)
         except Expense.DoesNotExist:
             return Response({'error': 'Expense not found.'}, status=status.HTTP_404_NOT_FOUND)
@@ -120,11 +243,12 @@ class TripView(ViewSet):
             expense = Expense.objects.get(pk=expense_id)
 
             # Checks if the expense is associated with the trip before removing
-            if expense not in trip.expenses.all():
+            if expense.trip_id != trip.id:
                 return Response({'error': 'Expense is not associated with the trip.'}, status=status.HTTP_404_NOT_FOUND)
 
-            # Removes the expense from the trip
-            trip.expenses.remove(expense)
+            # Removes the expense from the trip (saving it bumps the trip)
+            expense.trip = None
+            expense.save()
             
             return Response({'message': 'Expense removed from trip'}, status=status.HTTP_204_NO_CONTENT)
         
@@ -138,11 +262,45 @@ class TripView(ViewSet):
             return Response({'error': f'An error occurred: {str(e)}'}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
 
-class TripSerializer(serializers.ModelSerializer):
+def trip_queryset(fieldset=None):
+    """Trips with the columns and relations that TripSerializer reads for `fieldset`, expenses in id order.
+
+    Relations the fieldset leaves out are not loaded at all, and `total` is
+    only summed when asked for.
+    """
+    keys = (fieldset or Fieldset(TRIP)).keys(TRIP)
+    # Pagination and validators always need these
+    columns = {'id', 'date', 'updated_at'}
+    columns.update(name for name in ('name', 'description') if name in keys)
+    trips = Trip.objects.all()
+    if 'user_details' in keys:
+        columns.add('user')
+        trips = trips.select_related('user')
+    if 'expense_details' in keys:
+        trips = trips.prefetch_related(Prefetch('expenses', queryset=expense_queryset(fieldset).order_by('id')))
+    if 'total' in keys:
+        trips = trips.annotate(total=trip_total())
+    return trips.only(*columns)
+
+
+def trip_total():
+    """The sum of the outer trip's expense amounts as an fx.home_value() sum, zero for a trip without expenses."""
+    totals = (
+        Expense.objects.filter(trip=OuterRef('pk')).order_by().values('trip').annotate(total=Sum(fx.home_value()))
+    )
+    return Coalesce(Subquery(totals.values('total')), Value(0), output_field=BigIntegerField())
+
+
+class TripSerializer(SparseFieldsMixin, TimedSerializerMixin, serializers.ModelSerializer):
+    spec = TRIP
+    total = serializers.SerializerMethodField()
     user_details = UserSerializer(source='user', read_only=True)
     expense_details = ExpenseSerializer(source='expenses', many=True, read_only=True)
 
     class Meta:
         model = Trip
-        fields = ('id', 'name', 'date', 'description', 'user_details', 'expense_details')
+        fields = ('id', 'name', 'date', 'description', 'total', 'user_details', 'expense_details')
         depth = 1
+
+    def get_total(self, trip):
+        return fx.format_home(trip.total)
@@ -2,6 +2,7 @@ from rest_framework.decorators import api_view
 from django.http import HttpResponseServerError
 from rest_framework.decorators import action
 from rest_framework.response import Response
+from tripexpensetrackerapi.identity import find_user_by_uid
 from tripexpensetrackerapi.models import User
 
 @api_view(['POST'])
@@ -13,9 +14,9 @@ def check_user(request):
     '''
     uid = request.data['uid']
 
-    # Use the built-in authenticate method to verify
-    # authenticate returns the user object or None if no user is found
-    user = User.objects.filter(uid=uid).first()
+    # Looks the user up through the identity cache
+    # returns the user object or None if no user is found
+    user = find_user_by_uid(uid)
 
     # If authentication was successful, respond with their token
     if user is not None:
@@ -39,9 +40,10 @@ def register_user(request):
       request -- The full HTTP request object
     '''
 
-    user = User.objects.create(
-        name=request.data["name"],
-        uid=request.data["uid"]
+    # uid is unique, so registering twice (or concurrently) returns the same user
+    user, _ = User.objects.get_or_create(
+        uid=request.data["uid"],
+        defaults={'name': request.data["name"]}
     )
 
     # Return the user info to the client
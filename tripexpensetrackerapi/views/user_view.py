@@ -1,9 +1,20 @@
+from datetime import date, timedelta
 from django.http import HttpResponseServerError
 from rest_framework.viewsets import ViewSet
 from rest_framework.response import Response
 from rest_framework import serializers, status
 from rest_framework import status
-from tripexpensetrackerapi.models import User
+from rest_framework.decorators import action
+from django.utils import timezone
+from tripexpensetrackerapi import analytics, fx, rollups
+from tripexpensetrackerapi.catalog import category_catalog
+from tripexpensetrackerapi.models import Expense, MonthlyRollup, User
+from tripexpensetrackerapi.money import format_amount, home_currency
+from tripexpensetrackerapi.pagination import InvalidCursor, KeysetPagination
+from tripexpensetrackerapi.metrics import TimedSerializerMixin
+
+DASHBOARD_MONTHS = 24
+MAX_DASHBOARD_MONTHS = 120
 
 class UserView(ViewSet):
     """View for handling requests for users"""
@@ -20,17 +31,148 @@ class UserView(ViewSet):
             return Response({'message': ex.args[0]}, status=status.HTTP_404_NOT_FOUND)
 
     def list(self, request):
-        """Handle GET requests for all users
+        """Handle GET requests for a page of users
         
-        Returns -> Response -- JSON serialized list of users"""
+        Returns -> Response -- JSON serialized page of users and the next page link"""
         try:
-            users = User.objects.all()
+            paginator = KeysetPagination()
+            users = paginator.paginate_queryset(User.objects.all(), request)
             serializer = UserSerializer(users, many=True)
-            return Response(serializer.data)
+            return paginator.get_paginated_response(serializer.data)
+        except InvalidCursor:
+            return Response({'message': 'Invalid cursor'}, status=status.HTTP_400_BAD_REQUEST)
         except User.DoesNotExist as ex:
             return Response({'message': ex.args[0]}, status=status.HTTP_404_NOT_FOUND)
-        
-class UserSerializer(serializers.ModelSerializer):
+
+    @action(methods=['get'], detail=True)
+    def totals(self, request, pk):
+        """Handle GET requests for a user's spending in the home currency and in each currency they used
+
+        Returns -> Response -- JSON totals, converted in the database with one query"""
+        try:
+            if not User.objects.filter(pk=pk).exists():
+                return Response({'message': 'User not found'}, status=status.HTTP_404_NOT_FOUND)
+            total, count, currencies = fx.totals(Expense.objects.filter(user_id=pk))
+            return Response({
+                'id': int(pk),
+                'currency': home_currency(),
+                'total': format_amount(total, home_currency()),
+                'count': count,
+                'currencies': [
+                    {'currency': currency, 'total': format_amount(amount, currency), 'count': expenses}
+                    for currency, amount, expenses in currencies
+                ],
+            })
+        except Exception as e:
+            return Response({'message': f'An error occurred: {str(e)}'}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+
+    @action(methods=['get'], detail=True)
+    def dashboard(self, request, pk):
+        """Handle GET requests for a user's spending per month, in total and per category
+
+        Returns -> Response -- JSON months, oldest first, read from the monthly rollups alone"""
+        try:
+            count = int(request.query_params.get('months', DASHBOARD_MONTHS))
+        except ValueError:
+            return Response({'message': 'months must be a whole number'}, status=status.HTTP_400_BAD_REQUEST)
+        if not 1 <= count <= MAX_DASHBOARD_MONTHS:
+            return Response(
+                {'message': f'months must be between 1 and {MAX_DASHBOARD_MONTHS}'},
+                status=status.HTTP_400_BAD_REQUEST,
+            )
+        try:
+            if not User.objects.filter(pk=pk).exists():
+                return Response({'message': 'User not found'}, status=status.HTTP_404_NOT_FOUND)
+            months = rollups.months_back(count, timezone.now().date())
+            rows = MonthlyRollup.objects.filter(user_id=pk, month__gte=months[0], month__lte=months[-1]).order_by(
+                'month', '-total', 'category_id'
+            ).values_list('month', 'category_id', 'total', 'count')
+            # Months without expenses have no rollup rows, and are shown as zero
+            dashboard = {month: {'total': 0, 'count': 0, 'categories': []} for month in months}
+            names = category_catalog.names()
+            for month, category_id, total, expenses in rows:
+                entry = dashboard[month]
+                if category_id is None:
+                    entry['total'], entry['count'] = total, expenses
+                else:
+                    entry['categories'].append({
+                        'id': category_id, 'name': names.get(category_id),
+                        'total': fx.format_home(total), 'count': expenses,
+                    })
+            return Response({
+                'id': int(pk),
+                'currency': home_currency(),
+                'months': [
+                    {
+                        'month': month.strftime('%Y-%m'),
+                        'total': fx.format_home(entry['total']),
+                        'count': entry['count'],
+                        'categories': entry['categories'],
+                    }
+                    for month, entry in dashboard.items()
+                ],
+            })
+        except Exception as e:
+            return Response({'message': f'An error occurred: {str(e)}'}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+
+    @action(methods=['get'], detail=True)
+    def analytics(self, request, pk):
+        """Handle GET requests for a user's spending percentiles per category, daily trend and outlying expenses
+
+        Returns -> Response -- JSON analytics, computed over the user's expenses as NumPy arrays"""
+        try:
+            options = analytics.options(request.query_params, timezone.now().date())
+        except analytics.InvalidAnalytics as ex:
+            return Response({'message': str(ex)}, status=status.HTTP_400_BAD_REQUEST)
+        try:
+            if not User.objects.filter(pk=pk).exists():
+                return Response({'message': 'User not found'}, status=status.HTTP_404_NOT_FOUND)
+            data = analytics.columns(int(pk))
+            overall, categories = analytics.percentiles(data, options['percentiles'])
+            first, totals, averages = analytics.trend(data, options['until'], options['days'], options['window'])
+            rows, scores = analytics.anomalies(data, options['limit'])
+            names = category_catalog.names()
+            return Response({
+                'id': int(pk),
+                'currency': home_currency(),
+                'count': len(data),
+                'percentiles': options['percentiles'],
+                'overall': None if overall is None else [analytics.formatted(value) for value in overall],
+                'categories': sorted(
+                    (
+                        {
+                            'id': category_id, 'name': names.get(category_id), 'count': count,
+                            'values': [analytics.formatted(value) for value in values],
+                        }
+                        for category_id, (count, values) in categories.items()
+                    ),
+                    key=lambda category: (-category['count'], category['id']),
+                ),
+                'trend': {
+                    'window': options['window'],
+                    'days': [
+                        {
+                            'date': (first + timedelta(days=n)).isoformat(),
+                            'total': analytics.formatted(total),
+                            'average': analytics.formatted(average),
+                        }
+                        for n, (total, average) in enumerate(zip(totals, averages))
+                    ],
+                },
+                'anomalies': [
+                    {
+                        'id': int(data.ids[row]),
+                        'date': date.fromordinal(int(data.days[row])).isoformat(),
+                        'amount': analytics.formatted(data.amounts[row]),
+                        'score': round(float(score), 2),
+                    }
+                    for row, score in zip(rows, scores)
+                ],
+            })
+        except Exception as e:
+            return Response({'message': f'An error occurred: {str(e)}'}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+
+class UserSerializer(TimedSerializerMixin, serializers.ModelSerializer):
     """JSON serializer for the User model"""
     class Meta:
         model = User